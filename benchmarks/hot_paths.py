@@ -0,0 +1,246 @@
+"""Microbenchmarks for the handler hot paths.
+
+Run with ``python -m benchmarks.hot_paths``. Each handler runs on batches of
+1, 10, 100 and 1000 records against the in-memory fakes of
+``local_pipeline.fakes``, next to the pieces that dominate per-record cost:
+decoding record bodies (raw and still in the SNS envelope), logging the full event, rendering an
+email, and importing each handler module in a fresh interpreter (the
+module-level part of a cold start).
+
+Results are written as JSON with ``--output``. Given ``--baseline``, every
+benchmark whose median is more than ``--threshold`` slower than the stored
+run is reported and the exit status is 1, so CI can flag a regression.
+Timings are machine dependent; regenerate the baseline on the machine that
+compares against it.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import ExitStack
+from unittest.mock import patch
+
+from lambda_src.db_update_handler import app as db_update_app
+from lambda_src.email_handler import app as email_app
+from lambda_src.inventory_handler import app as inventory_app
+from lambda_src.webhook_handler import app as webhook_app
+from local_pipeline.fakes import FakeDynamoDB, FakeSecretsManager, FakeSes, FakeSns
+from order_common.idempotency import IdempotencyStore
+from order_common.logger import Logger
+from order_common.orders import decode_record
+from order_common.rate_limit import TokenBucket
+
+BATCH_SIZES = (1, 10, 100, 1000)
+HANDLER_MODULES = ('webhook_handler', 'email_handler', 'inventory_handler', 'db_update_handler', 'aggregator_handler')
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# Medians below this are within timer noise and are not compared.
+MIN_COMPARABLE_MS = 0.01
+
+
+def _records(batch_size, enveloped=False):
+    """SQS records as raw message delivery produces them, or inside the SNS envelope."""
+    records = []
+    for i in range(batch_size):
+        body = json.dumps({'order_id': f'cs_bench_{i}', 'amount_total': 1000 + i})
+        if enveloped:
+            body = json.dumps({'Type': 'Notification', 'MessageId': f'sns-{i}', 'Message': body})
+        records.append({'messageId': f'm{i}', 'receiptHandle': f'r{i}', 'body': body,
+                        'attributes': {'ApproximateReceiveCount': '1'}, 'eventSource': 'aws:sqs'})
+    return records
+
+
+def _measure(setup, run, repeat, number=1):
+    """Median, min and p95 wall time of ``run(setup())`` in milliseconds. Each
+    sample averages ``number`` back-to-back runs, which steadies short ones."""
+    samples = []
+    for _ in range(repeat):
+        state = setup()
+        started = time.perf_counter()
+        for _ in range(number):
+            run(state)
+        samples.append((time.perf_counter() - started) * 1000 / number)
+    samples.sort()
+    return {
+        'median_ms': round(statistics.median(samples), 4),
+        'min_ms': round(samples[0], 4),
+        'p95_ms': round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 4),
+        'repeat': repeat,
+    }
+
+
+def _consumer_patches(dynamodb, ses):
+    """Point the consumer modules at fresh fakes, as LocalPipeline does."""
+    def store(namespace):
+        return IdempotencyStore(dynamodb, 'idempotency', namespace=namespace)
+
+    return [
+        patch.multiple(email_app, ses_client=ses, idempotency=store('email'),
+                       send_rate_limiter=TokenBucket(1e9), EMAIL_SEND_MODE='bulk',
+                       SES_TEMPLATE_NAME='OrderConfirmation'),
+        patch.multiple(inventory_app, dynamodb=dynamodb, INVENTORY_TABLE_NAME='inventory',
+                       INITIAL_STOCK_QUANTITY=10 ** 9, idempotency=store('inventory')),
+        patch.multiple(db_update_app, dynamodb=dynamodb, ORDERS_TABLE_NAME='orders',
+                       idempotency=store('db_update')),
+    ]
+
+
+def bench_handlers(repeat):
+    results = {}
+    handlers = {
+        'email': email_app.lambda_handler,
+        'inventory': inventory_app.lambda_handler,
+        'db_update': db_update_app.lambda_handler,
+    }
+    for batch_size in BATCH_SIZES:
+        event = {'Records': _records(batch_size)}
+        for name, handler in handlers.items():
+            def setup():
+                # Fresh tables each run, so no order is a duplicate of the last run.
+                stack = ExitStack()
+                for p in _consumer_patches(FakeDynamoDB(), FakeSes()):
+                    stack.enter_context(p)
+                return stack
+
+            def run(stack):
+                with stack:
+                    handler(event, None)
+
+            result = _measure(setup, run, max(3, repeat // batch_size))
+            result['per_record_ms'] = round(result['median_ms'] / batch_size, 4)
+            results[f'handler.{name}.batch_{batch_size}'] = result
+
+    sns = FakeSns()
+    body = json.dumps({'order_id': 'cs_bench', 'amount_total': 1000, 'api_key': 'bench-key'})
+    with patch.multiple(webhook_app, sns_client=sns, SNS_TOPIC_ARN=sns.topic_arn, API_KEY_SECRET_ID='API_KEY',
+                        secrets_client=FakeSecretsManager({'API_KEY': 'bench-key'})):
+        webhook_app.api_key_cache.clear()
+        results['handler.webhook.request'] = _measure(
+            lambda: None, lambda _: webhook_app.lambda_handler({'body': body}, None), repeat)
+        batch = {'resource': webhook_app.BATCH_RESOURCE, 'body': json.dumps({
+            'orders': [{'order_id': f'cs_bench_{i}', 'amount_total': 1000} for i in range(100)],
+            'api_key': 'bench-key'})}
+        result = _measure(lambda: None, lambda _: webhook_app.lambda_handler(batch, None), max(3, repeat // 100))
+        result['per_record_ms'] = round(result['median_ms'] / 100, 4)
+        results['handler.webhook.batch_100'] = result
+        webhook_app.api_key_cache.clear()
+    return results
+
+
+def bench_serialization(repeat):
+    results = {}
+    logger = Logger('benchmark')
+    for batch_size in (10, 100, 1000):
+        records = _records(batch_size)
+        enveloped = _records(batch_size, enveloped=True)
+        number = max(1, 1000 // batch_size)
+        decoders = {
+            # The two json.loads calls per record made before raw delivery.
+            'decode_envelope': lambda _: [json.loads(json.loads(r['body'])['Message']) for r in enveloped],
+            'decode_record.enveloped': lambda _: [decode_record(r) for r in enveloped],
+            'decode_record.raw': lambda _: [decode_record(r) for r in records],
+        }
+        for name, decode in decoders.items():
+            result = _measure(lambda: None, decode, repeat, number)
+            result['per_record_ms'] = round(result['median_ms'] / batch_size, 4)
+            results[f'{name}.batch_{batch_size}'] = result
+
+        event = {'Records': records}
+        results[f'log_event_dumps.batch_{batch_size}'] = _measure(
+            lambda: None, lambda _: json.dumps(event), repeat, number)
+        # What the handlers do now: nothing unless debug logging is sampled in.
+        results[f'log_event_sampled.batch_{batch_size}'] = _measure(
+            lambda: None, lambda _: logger.payload('Received event', event=event), repeat, 1000)
+
+    order_ids = [f'cs_bench_{i}' for i in range(100)]
+    result = _measure(lambda: None, lambda _: [email_app.order_email_message(o) for o in order_ids], repeat, 10)
+    result['per_record_ms'] = round(result['median_ms'] / len(order_ids), 4)
+    results['render_email.batch_100'] = result
+    return results
+
+
+def bench_imports(repeat):
+    """Wall time of importing each handler in a new interpreter, minus the
+    interpreter start-up itself."""
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+
+    def run_python(code):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, env=env)
+        return (time.perf_counter() - started) * 1000
+
+    baseline = statistics.median(run_python('pass') for _ in range(repeat))
+    results = {}
+    for module in HANDLER_MODULES:
+        samples = sorted(run_python(f'import lambda_src.{module}.app') for _ in range(repeat))
+        results[f'import.{module}'] = {
+            'median_ms': round(statistics.median(samples) - baseline, 4),
+            'min_ms': round(samples[0] - baseline, 4),
+            'repeat': repeat,
+        }
+    return results
+
+
+def run(repeat=100, import_repeat=5, include_imports=True):
+    with patch('builtins.print'):
+        results = {}
+        results.update(bench_handlers(repeat))
+        results.update(bench_serialization(repeat))
+    if include_imports:
+        results.update(bench_imports(import_repeat))
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'benchmarks': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Benchmarks whose median grew by more than ``threshold`` (a fraction)."""
+    regressions = []
+    for name, result in current['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if not previous or previous['median_ms'] < MIN_COMPARABLE_MS:
+            continue
+        change = result['median_ms'] / previous['median_ms'] - 1
+        if change > threshold:
+            regressions.append((name, previous['median_ms'], result['median_ms'], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=100, help='runs per single-record benchmark')
+    parser.add_argument('--import-repeat', type=int, default=5, help='interpreter launches per import benchmark')
+    parser.add_argument('--skip-imports', action='store_true')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE_PATH,
+                        help=f'compare against a stored run (default {BASELINE_PATH})')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, as a fraction')
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.import_repeat, include_imports=not args.skip_imports)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    print(f"{'benchmark':<40}{'median ms':>12}{'per record':>12}{'p95 ms':>10}")
+    for name, r in sorted(results['benchmarks'].items()):
+        print(f"{name:<40}{r['median_ms']:>12}{r.get('per_record_ms', ''):>12}{r.get('p95_ms', ''):>10}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for name, before, after, change in regressions:
+            print(f"SLOWER: {name}: {before} ms -> {after} ms (+{change:.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No benchmark is more than {args.threshold:.0%} slower than {args.baseline}.")
+
+
+if __name__ == '__main__':
+    main()
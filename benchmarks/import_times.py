@@ -0,0 +1,113 @@
+"""Import time of each handler, measured with ``python -X importtime``.
+
+Run with ``python -m benchmarks.import_times``. Each handler is imported the
+way Lambda loads it, ``app`` from the handler directory with the common layer
+on the path, in a fresh interpreter ``--repeat`` times. The module-level part
+of a cold start is the median cumulative import time of ``app``; the modules
+with the highest self time in the median run show where it goes.
+
+With ``--prewarm`` the handlers also create their boto3 clients at import, as
+they do during init in 'optimized' packaging (see order_common.aws).
+
+Each handler's median is compared with its cold-start budget in
+``import_budgets.json`` (under ``import`` or ``prewarm``); any handler over
+budget is reported and the exit status is 1, so CI can track the budgets.
+Timings are machine dependent; set the budgets on the machine that checks them.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_SRC = os.path.join(ROOT, 'lambda_src')
+COMMON_LAYER_PATH = os.path.join(LAMBDA_SRC, 'common_layer', 'python')
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), 'import_budgets.json')
+
+
+def handlers():
+    return sorted(name for name in os.listdir(LAMBDA_SRC)
+                  if name.endswith('_handler') and os.path.exists(os.path.join(LAMBDA_SRC, name, 'app.py')))
+
+
+def parse_importtime(stderr):
+    """``{module: (self_us, cumulative_us)}`` from ``-X importtime`` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue  # The header line.
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def import_handler(handler, prewarm=False):
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([os.path.join(LAMBDA_SRC, handler), COMMON_LAYER_PATH]),
+               PYTHONDONTWRITEBYTECODE='1',
+               PREWARM_CLIENTS='true' if prewarm else 'false',
+               AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=LAMBDA_SRC, env=env, capture_output=True, text=True, check=True)
+    return parse_importtime(result.stderr)
+
+
+def measure(handler, repeat, prewarm=False, top=5):
+    runs = sorted((import_handler(handler, prewarm) for _ in range(repeat)),
+                  key=lambda modules: modules['app'][1])
+    median_run = runs[len(runs) // 2]
+    heaviest = sorted(median_run.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    return {
+        'median_ms': round(statistics.median(run['app'][1] for run in runs) / 1000, 2),
+        'min_ms': round(runs[0]['app'][1] / 1000, 2),
+        'repeat': repeat,
+        'heaviest_modules_ms': {name: round(self_us / 1000, 2) for name, (self_us, _) in heaviest},
+    }
+
+
+def over_budget(results, budgets):
+    """``(handler, budget_ms, median_ms)`` for each handler above its budget."""
+    return [(handler, budgets[handler], result['median_ms'])
+            for handler, result in results.items()
+            if handler in budgets and result['median_ms'] > budgets[handler]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('handlers', nargs='*', help='handlers to measure (default: all)')
+    parser.add_argument('--repeat', type=int, default=5, help='interpreter launches per handler')
+    parser.add_argument('--prewarm', action='store_true', help='create the boto3 clients at import')
+    parser.add_argument('--top', type=int, default=5, help='heaviest modules listed per handler')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--budgets', nargs='?', const=BUDGETS_PATH,
+                        help=f'check against cold-start budgets (default {BUDGETS_PATH})')
+    args = parser.parse_args()
+
+    results = {handler: measure(handler, args.repeat, args.prewarm, args.top)
+               for handler in args.handlers or handlers()}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    print(f"{'handler':<24}{'median ms':>12}{'min ms':>10}  heaviest modules (self ms)")
+    for handler, r in results.items():
+        heaviest = ', '.join(f'{name} {ms}' for name, ms in r['heaviest_modules_ms'].items())
+        print(f"{handler:<24}{r['median_ms']:>12}{r['min_ms']:>10}  {heaviest}")
+
+    if args.budgets:
+        with open(args.budgets) as f:
+            budgets = json.load(f)['prewarm' if args.prewarm else 'import']
+        exceeded = over_budget(results, budgets)
+        for handler, budget, median in exceeded:
+            print(f"OVER BUDGET: {handler}: {median} ms (budget {budget} ms)")
+        if exceeded:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
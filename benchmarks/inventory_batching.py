@@ -0,0 +1,141 @@
+"""Compare DynamoDB call counts and latency of inventory update strategies.
+
+Run with ``python -m benchmarks.inventory_batching``. DynamoDB is replaced by an
+in-memory fake that charges a fixed simulated latency per API call, so the
+numbers show how the number of round trips scales with batch size and SKU mix.
+"""
+import argparse
+import json
+import random
+import time
+from unittest.mock import patch
+
+from lambda_src.inventory_handler import app
+from order_common.orders import decode_record
+
+
+class FakeInventoryTable:
+    """Minimal low-level DynamoDB client stand-in that counts calls and
+    simulated latency. Items are stored with plain Python values."""
+
+    def __init__(self, call_latency_ms):
+        self.call_latency_ms = call_latency_ms
+        self.items = {}
+        self.calls = 0
+
+    def _charge(self):
+        self.calls += 1
+
+    def get_item(self, Key, **_):
+        self._charge()
+        item = self.items.get(Key['PK']['S'])
+        return {'Item': {'stock_quantity': {'N': str(item['stock_quantity'])}}} if item else {}
+
+    def put_item(self, Item, **_):
+        self._charge()
+        self.items[Item['PK']['S']] = {'stock_quantity': int(Item['stock_quantity']['N'])}
+
+    def _apply_update(self, Key, ExpressionAttributeValues, **_):
+        item = self.items.setdefault(Key['PK']['S'], {})
+        current = item.get('stock_quantity', int(ExpressionAttributeValues[':initial']['N']))
+        item['stock_quantity'] = current - int(ExpressionAttributeValues[':qty']['N'])
+        return item['stock_quantity']
+
+    def update_item(self, ReturnValues=None, **kwargs):
+        self._charge()
+        return {'Attributes': {'stock_quantity': {'N': str(self._apply_update(**kwargs))}}}
+
+    def transact_write_items(self, TransactItems):
+        self._charge()
+        for action in TransactItems:
+            self._apply_update(**action['Update'])
+
+    @property
+    def simulated_ms(self):
+        return self.calls * self.call_latency_ms
+
+
+def _records(batch_size, sku_count):
+    records = []
+    for i in range(batch_size):
+        order = {'order_id': str(i), 'items': [{'sku': f'sku-{random.randrange(sku_count)}', 'quantity': 1}]}
+        records.append({'messageId': f'm{i}', 'body': json.dumps({'Message': json.dumps(order)})})
+    return records
+
+
+def legacy_per_record_loop(table, records):
+    """The original handler: read-modify-write of the inventory row per record."""
+    for record in records:
+        order = json.loads(json.loads(record['body'])['Message'])
+        for item in order['items']:
+            key = f"inventory#{item['sku']}"
+            response = table.get_item(TableName='bench', Key={'PK': {'S': key}})
+            current = int(response['Item']['stock_quantity']['N']) if 'Item' in response else 100
+            table.put_item(TableName='bench', Item={'PK': {'S': key},
+                                                    'stock_quantity': {'N': str(current - item['quantity'])}})
+
+
+def per_record_atomic(table, records):
+    """One conditional write per record, without coalescing."""
+    for record in records:
+        app.decrement_order(app._order_demand(decode_record(record)))
+
+
+def coalesced_handler(table, records):
+    # Every iteration replays the same orders; don't let them count as duplicates.
+    app.idempotency.clear()
+    app.lambda_handler({'Records': records}, None)
+
+
+STRATEGIES = {
+    'legacy_per_record_loop': legacy_per_record_loop,
+    'per_record_atomic': per_record_atomic,
+    'coalesced_handler': coalesced_handler,
+}
+
+
+def run(batch_sizes, sku_count, call_latency_ms, iterations):
+    results = []
+    for batch_size in batch_sizes:
+        records = _records(batch_size, sku_count)
+        for name, strategy in STRATEGIES.items():
+            table = FakeInventoryTable(call_latency_ms)
+            with patch.object(app, 'dynamodb', table), \
+                    patch.object(app, 'INVENTORY_TABLE_NAME', 'bench'), patch('builtins.print'):
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    strategy(table, records)
+                cpu_ms = (time.perf_counter() - started) * 1000 / iterations
+            results.append({
+                'strategy': name,
+                'batch_size': batch_size,
+                'distinct_skus': min(sku_count, batch_size),
+                'dynamodb_calls': table.calls // iterations,
+                'cpu_ms': round(cpu_ms, 3),
+                'estimated_latency_ms': round(cpu_ms + table.simulated_ms / iterations, 3),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--skus', type=int, default=3, help='number of distinct SKUs in the batch')
+    parser.add_argument('--call-latency-ms', type=float, default=5.0, help='simulated latency per DynamoDB call')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    random.seed(0)
+    results = run(args.batch_sizes, args.skus, args.call_latency_ms, args.iterations)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'strategy':<24}{'batch':>7}{'skus':>6}{'ddb calls':>11}{'cpu ms':>10}{'est. ms':>10}")
+    for r in results:
+        print(f"{r['strategy']:<24}{r['batch_size']:>7}{r['distinct_skus']:>6}{r['dynamodb_calls']:>11}"
+              f"{r['cpu_ms']:>10}{r['estimated_latency_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
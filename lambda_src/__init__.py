@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Handlers import the shared layer as a top-level ``order_common`` package, the
+# way Lambda mounts it under /opt/python. Make it importable the same way when
+# the handlers are loaded from this package (tests, local tools).
+_COMMON_LAYER_PATH = os.path.join(os.path.dirname(__file__), 'common_layer', 'python')
+if _COMMON_LAYER_PATH not in sys.path:
+    sys.path.append(_COMMON_LAYER_PATH)
@@ -0,0 +1,141 @@
+import json
+import os
+import random
+import time
+from decimal import Decimal
+
+from order_common.aggregates import bucket_keys
+from order_common.aws import ClientError, lazy_client, prewarm
+from order_common.dynamo import deserialize
+from order_common.logger import Logger
+from order_common.metrics import COUNT, Metrics
+from order_common.orders_table import ORDER_SK, timestamp
+
+AGGREGATES_TABLE_NAME = os.environ.get('AGGREGATES_TABLE_NAME')
+# Batch markers only need to outlive the stream's 24-hour retention, after
+# which a batch can no longer be redelivered.
+BATCH_MARKER_TTL_SECONDS = int(os.environ.get('BATCH_MARKER_TTL_SECONDS', str(2 * 24 * 3600)))
+# TransactWriteItems accepts at most 100 actions; one is the batch marker.
+MAX_BUCKET_UPDATES = 99
+# Shards updating the same totals at once cancel each other's transactions.
+TRANSACTION_MAX_ATTEMPTS = int(os.environ.get('TRANSACTION_MAX_ATTEMPTS', '3'))
+
+dynamodb = lazy_client('dynamodb')
+metrics = Metrics('aggregator')
+logger = Logger('aggregator')
+prewarm(dynamodb)
+
+
+def _new_order(record):
+    """``(created_at, amount_total)`` of the order a stream record inserted,
+    or None if the record is not a new order."""
+    if record.get('eventName') != 'INSERT':
+        return None
+    stream_record = record['dynamodb']
+    image = stream_record.get('NewImage', {})
+    # Backfilled orders were placed before the totals were kept.
+    if image.get('SK', {}).get('S') != ORDER_SK or 'backfilled' in image:
+        return None
+    created_at = image.get('created_at', {}).get('S') or timestamp(stream_record.get('ApproximateCreationDateTime'))
+    amount = deserialize(image['amount_total']) if 'amount_total' in image else None
+    return created_at, Decimal(amount or 0)
+
+
+def chunk_records(records):
+    """Split stream records, in order, into ``(records, {bucket: (count, amount)})``
+    chunks touching at most MAX_BUCKET_UPDATES buckets each.
+
+    The split depends only on the records, so a redelivered batch is cut the
+    same way and every chunk finds its own marker.
+    """
+    chunk, totals = [], {}
+    for record in records:
+        order = _new_order(record)
+        keys = bucket_keys(order[0]) if order else []
+        if chunk and len(totals.keys() | set(keys)) > MAX_BUCKET_UPDATES:
+            yield chunk, totals
+            chunk, totals = [], {}
+        chunk.append(record)
+        for key in keys:
+            count, amount = totals.get(key, (0, Decimal(0)))
+            totals[key] = (count + 1, amount + order[1])
+    if chunk:
+        yield chunk, totals
+
+
+def _transaction(records, totals, now):
+    first = records[0]['dynamodb']['SequenceNumber']
+    last = records[-1]['dynamodb']['SequenceNumber']
+    actions = [{
+        'Put': {
+            'TableName': AGGREGATES_TABLE_NAME,
+            'Item': {
+                'PK': {'S': f'batch#{first}-{last}'},
+                'expires_at': {'N': str(int(now) + BATCH_MARKER_TTL_SECONDS)},
+            },
+            'ConditionExpression': 'attribute_not_exists(PK)',
+        }
+    }]
+    for key, (count, amount) in sorted(totals.items()):
+        actions.append({
+            'Update': {
+                'TableName': AGGREGATES_TABLE_NAME,
+                'Key': {'PK': {'S': key}},
+                'UpdateExpression': 'ADD order_count :count, amount_total :amount',
+                'ExpressionAttributeValues': {':count': {'N': str(count)}, ':amount': {'N': str(amount)}},
+            }
+        })
+    return actions
+
+
+def apply_chunk(records, totals, now=None):
+    """Add ``totals`` and the chunk's batch marker in one transaction.
+
+    Returns False if the marker already existed, i.e. the chunk was applied
+    by an earlier delivery of the same batch.
+    """
+    actions = _transaction(records, totals, time.time() if now is None else now)
+    for attempt in range(TRANSACTION_MAX_ATTEMPTS):
+        try:
+            with metrics.timer('DynamoDBLatency'):
+                dynamodb.transact_write_items(TransactItems=actions)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            codes = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+            if codes and codes[0] == 'ConditionalCheckFailed':
+                return False
+            if 'TransactionConflict' not in codes or attempt == TRANSACTION_MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+
+@logger.inject_context
+@metrics.instrument
+def lambda_handler(event, context):
+    # Errors propagate: the event source retries the whole batch, and the
+    # chunks already applied are skipped by their markers.
+    records = event.get('Records', [])
+    parse_started = time.perf_counter()
+    chunks = list(chunk_records(records))
+    if records:
+        metrics.put('RecordParseTime', (time.perf_counter() - parse_started) * 1000 / len(records))
+
+    aggregated = duplicates = 0
+    for chunk, totals in chunks:
+        if not totals:
+            continue
+        if apply_chunk(chunk, totals):
+            aggregated += len(chunk)
+        else:
+            duplicates += len(chunk)
+            logger.info('Skipping already aggregated records',
+                        sequence_number=chunk[-1]['dynamodb']['SequenceNumber'])
+    metrics.put('DuplicateRecords', duplicates, COUNT)
+    logger.info('Aggregated %d record(s) in %d chunk(s); %d were duplicates', aggregated, len(chunks), duplicates)
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps('Aggregation finished.')
+    }
@@ -0,0 +1,36 @@
+"""Backfill the original OrdersTable: ``python -m lambda_src.backfill_orders``.
+
+Copies its orders to OrdersTableV2 and its stock counters to InventoryTable
+(see order_common.migration). Tables are given by their physical names from
+the stack's resources. Run it once after deploying the new tables with
+``inventory_backfill_pending`` set, then deploy again without it; it is safe
+to run again.
+"""
+import argparse
+import json
+
+from order_common.aws import get_client
+from order_common.migration import DEFAULT_INITIAL_STOCK, backfill
+from order_common.orders_table import DEFAULT_SHARD_COUNT
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy the original OrdersTable into OrdersTableV2 and '
+                                                 'InventoryTable.')
+    parser.add_argument('legacy_table', help='name of the original OrdersTable')
+    parser.add_argument('orders_table', help='name of OrdersTableV2')
+    parser.add_argument('inventory_table', help='name of InventoryTable')
+    parser.add_argument('--shard-count', type=int, default=DEFAULT_SHARD_COUNT,
+                        help="the stack's orders_index_shard_count")
+    parser.add_argument('--initial-stock', type=int, default=DEFAULT_INITIAL_STOCK,
+                        help="the inventory handler's INITIAL_STOCK_QUANTITY")
+    parser.add_argument('--page-size', type=int, help='items read per scan request')
+    args = parser.parse_args()
+
+    stats = backfill(get_client('dynamodb'), args.legacy_table, args.orders_table, args.inventory_table,
+                     shard_count=args.shard_count, initial_stock=args.initial_stock, page_size=args.page_size)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
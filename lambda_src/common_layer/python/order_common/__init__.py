@@ -0,0 +1,10 @@
+"""Code shared by the order processing handlers, shipped as a Lambda layer.
+
+Lambda mounts the layer at /opt/python, so handlers import it as ``order_common``.
+
+Handlers import this package before the AWS SDK, so ``INIT_STARTED_AT`` marks
+the start of their module-level set-up for the InitDuration metric.
+"""
+import time
+
+INIT_STARTED_AT = time.perf_counter()
@@ -0,0 +1,37 @@
+"""Running order totals per minute, hour and day.
+
+aggregator_handler folds the OrdersTable stream into one item per period in
+the aggregates table, keyed by the period and the UTC start of the period as
+a prefix of the orders' ``created_at``::
+
+    minute#2026-10-17T10:31    hour#2026-10-17T10    day#2026-10-17
+
+Each item holds ``order_count`` and ``amount_total``, so reading a total is
+one GetItem however many orders it covers.
+"""
+from decimal import Decimal
+
+from order_common.dynamo import from_item
+
+# Length of the created_at prefix that identifies each period.
+PERIODS = {'minute': 16, 'hour': 13, 'day': 10}
+
+
+def bucket_key(period, created_at):
+    return f'{period}#{created_at[:PERIODS[period]]}'
+
+
+def bucket_keys(created_at):
+    """Keys of every period an order created at ``created_at`` counts towards."""
+    return [bucket_key(period, created_at) for period in PERIODS]
+
+
+def get_totals(dynamodb, table_name, period, start):
+    """``{'order_count', 'amount_total'}`` for the ``period`` starting at
+    ``start`` (an ISO-8601 UTC time, e.g. ``2026-10-17`` for a day)."""
+    response = dynamodb.get_item(TableName=table_name, Key={'PK': {'S': bucket_key(period, start)}})
+    item = from_item(response.get('Item', {}))
+    return {
+        'order_count': int(item.get('order_count', 0)),
+        'amount_total': item.get('amount_total', Decimal(0)),
+    }
@@ -0,0 +1,126 @@
+"""Lazily created, shared boto3 clients.
+
+Handlers keep module-level client names (``ses_client = lazy_client('ses')``)
+but nothing is built at import time: the client is created on first use and
+then reused for the life of the container, keeping its keep-alive connection
+pool warm across invocations. All clients are low-level clients, so no
+resource models are loaded, and share one tuned botocore config.
+
+Importing boto3 is most of a handler's import time, so it is deferred to the
+first client too. With ``PREWARM_CLIENTS=true`` (optimized packaging)
+handlers call ``prewarm`` at import time instead, which moves that cost and
+the clients' creation into the function's init phase, ahead of the first
+event.
+
+``ClientError`` is re-exported so that handlers import botocore through the
+layer, after ``order_common`` has started the InitDuration clock.
+"""
+import os
+import threading
+
+from botocore.exceptions import ClientError  # noqa: F401  Re-exported for the handlers.
+
+from order_common.logger import Logger
+
+PREWARM_CLIENTS = os.environ.get('PREWARM_CLIENTS', 'false').lower() == 'true'
+
+_session = None
+_client_config = None
+_clients = {}
+_lock = threading.Lock()
+logger = Logger('order_common.aws')
+
+
+def _create_session():
+    import boto3
+    return boto3.session.Session()
+
+
+def client_config():
+    """The botocore config shared by all clients."""
+    global _client_config
+    if _client_config is None:
+        from botocore.config import Config
+        _client_config = Config(
+            max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '20')),
+            connect_timeout=float(os.environ.get('AWS_CONNECT_TIMEOUT_SECONDS', '2')),
+            read_timeout=float(os.environ.get('AWS_READ_TIMEOUT_SECONDS', '5')),
+            retries={
+                'mode': 'adaptive',
+                'max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', '4')),
+            },
+            tcp_keepalive=True,
+        )
+    return _client_config
+
+
+def get_client(service_name):
+    """Return the shared client for ``service_name``, creating it on first use."""
+    client = _clients.get(service_name)
+    if client is not None:
+        return client
+    global _session
+    with _lock:
+        client = _clients.get(service_name)
+        if client is None:
+            # Sessions are not thread-safe; create clients under the lock.
+            if _session is None:
+                _session = _create_session()
+            client = _session.client(service_name, config=client_config())
+            _clients[service_name] = client
+        return client
+
+
+class LazyClient:
+    """Stand-in for a boto3 client that creates the real one on first attribute access."""
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        # Introspection (copy, mock, inspect) must not build a client.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(get_client(self.service_name), name)
+
+    def __repr__(self):
+        return f'LazyClient({self.service_name!r})'
+
+
+def lazy_client(service_name):
+    return LazyClient(service_name)
+
+
+def prewarm(*clients):
+    """Create ``clients`` (lazy clients or service names) now if
+    ``PREWARM_CLIENTS`` is set. A client that cannot be created is left to
+    fail on first use, as it would without prewarming."""
+    if not PREWARM_CLIENTS:
+        return
+    for client in clients:
+        service_name = client.service_name if isinstance(client, LazyClient) else client
+        try:
+            get_client(service_name)
+        except Exception as e:
+            logger.warning('Could not prewarm the %s client', service_name, error=e)
+
+
+# Error codes AWS services return when a request was rejected for its rate
+# rather than its content.
+THROTTLING_ERROR_CODES = frozenset({
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+})
+
+
+def is_throttling_error(error):
+    """Whether ``error`` is a botocore ``ClientError`` for a throttled request."""
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    return response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
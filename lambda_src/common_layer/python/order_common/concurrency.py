@@ -0,0 +1,132 @@
+"""Adjusting the SQS consumers' maximum concurrency to their backlog.
+
+concurrency_handler runs every minute. For each consumer it reads the depth
+and the age of the oldest message of its queue, and the ``Throttles`` the
+handler reported (throttling errors from SES or DynamoDB), for the latest
+minute with queue metrics. ``next_concurrency`` then picks the new
+MaximumConcurrency of the consumer's event source mapping:
+
+* throttled: multiply by ``decrease_factor``; more pollers would only add
+  retries against a downstream that is already saturated
+* backlogged (the oldest message is older than ``target_age_seconds``, or the
+  queue holds more than one batch per allowed instance): multiply by
+  ``increase_factor``
+* otherwise: unchanged
+
+always within ``[minimum, maximum]``. The decision only depends on its
+inputs, so ``simulate`` can replay a recorded metric series through it.
+"""
+import math
+from dataclasses import dataclass
+from typing import NamedTuple
+
+# Lowest MaximumConcurrency an SQS event source mapping accepts, and the highest.
+MIN_MAXIMUM_CONCURRENCY = 2
+MAX_MAXIMUM_CONCURRENCY = 1000
+
+# Metrics read per consumer, as (query id prefix, namespace, metric name, statistic).
+QUEUE_METRICS = (
+    ('visible', 'AWS/SQS', 'ApproximateNumberOfMessagesVisible', 'Maximum'),
+    ('age', 'AWS/SQS', 'ApproximateAgeOfOldestMessage', 'Maximum'),
+)
+THROTTLES_METRIC = 'Throttles'
+
+
+@dataclass(frozen=True)
+class ControlSettings:
+    minimum: int = MIN_MAXIMUM_CONCURRENCY
+    maximum: int = MAX_MAXIMUM_CONCURRENCY
+    batch_size: int = 10
+    target_age_seconds: float = 60.0
+    increase_factor: float = 1.5
+    decrease_factor: float = 0.5
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**{name: values[name] for name in cls.__dataclass_fields__ if name in values})
+
+
+class QueueSample(NamedTuple):
+    """One minute of a consumer's metrics."""
+    visible: float
+    age_seconds: float
+    throttles: float = 0
+
+
+def next_concurrency(current, sample, settings):
+    """The MaximumConcurrency to set after observing ``sample``.
+
+    ``current`` is None for a mapping without a concurrency limit, which is
+    treated as ``settings.maximum``.
+    """
+    current = settings.maximum if current is None else current
+    current = min(max(current, settings.minimum), settings.maximum)
+    if sample.throttles > 0:
+        target = math.floor(current * settings.decrease_factor)
+    elif sample.age_seconds > settings.target_age_seconds or sample.visible > current * settings.batch_size:
+        target = max(current + 1, math.ceil(current * settings.increase_factor))
+    else:
+        target = current
+    return min(max(target, settings.minimum), settings.maximum)
+
+
+def simulate(samples, settings, initial=None):
+    """The concurrency chosen after each sample of a series, starting from ``initial``."""
+    history = []
+    current = initial
+    for sample in samples:
+        current = next_concurrency(current, sample, settings)
+        history.append(current)
+    return history
+
+
+def metric_queries(consumers, namespace, period=60):
+    """GetMetricData queries for ``consumers`` (``{name: {'queue': <queue name>}}``).
+
+    Query IDs are ``<metric>_<consumer name>``, which ``samples_from_metric_data``
+    relies on.
+    """
+    queries = []
+    for name, consumer in consumers.items():
+        metrics = [(prefix, metric_namespace, metric_name, {'QueueName': consumer['queue']}, statistic)
+                   for prefix, metric_namespace, metric_name, statistic in QUEUE_METRICS]
+        metrics.append(('throttles', namespace, THROTTLES_METRIC, {'Service': name}, 'Sum'))
+        for prefix, metric_namespace, metric_name, dimensions, statistic in metrics:
+            queries.append({
+                'Id': f'{prefix}_{name}',
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': metric_namespace,
+                        'MetricName': metric_name,
+                        'Dimensions': [{'Name': key, 'Value': value} for key, value in dimensions.items()],
+                    },
+                    'Period': period,
+                    'Stat': statistic,
+                },
+                'ReturnData': True,
+            })
+    return queries
+
+
+def samples_from_metric_data(results, consumers):
+    """``{name: QueueSample}`` from the ``MetricDataResults`` of ``metric_queries``.
+
+    Each sample is taken at the newest minute with a queue depth datapoint;
+    a metric without a datapoint at that minute counts as 0 (the handler
+    reports no Throttles when there were none). A consumer whose queue has
+    no depth datapoint is left out.
+    """
+    series = {result['Id']: dict(zip(result.get('Timestamps', []), result.get('Values', [])))
+              for result in results}
+    samples = {}
+    for name in consumers:
+        visible = series.get(f'visible_{name}')
+        if not visible:
+            continue
+        at = max(visible)
+        samples[name] = QueueSample(
+            visible=visible[at],
+            age_seconds=series.get(f'age_{name}', {}).get(at, 0),
+            throttles=series.get(f'throttles_{name}', {}).get(at, 0),
+        )
+    return samples
@@ -0,0 +1,44 @@
+"""Conversion between Python values and the DynamoDB wire format used by the
+low-level client."""
+from decimal import Decimal
+
+# Created on first use: boto3.dynamodb.types imports all of boto3.
+_serializer = None
+_deserializer = None
+
+
+def _load_codecs():
+    global _serializer, _deserializer
+    from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+    _serializer, _deserializer = TypeSerializer(), TypeDeserializer()
+
+
+def _to_dynamo_value(value):
+    # The serializer rejects floats; JSON payloads may still carry them.
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _to_dynamo_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_dynamo_value(v) for v in value]
+    return value
+
+
+def serialize(value):
+    if _serializer is None:
+        _load_codecs()
+    return _serializer.serialize(_to_dynamo_value(value))
+
+
+def deserialize(attribute_value):
+    if _deserializer is None:
+        _load_codecs()
+    return _deserializer.deserialize(attribute_value)
+
+
+def to_item(values):
+    return {key: serialize(value) for key, value in values.items()}
+
+
+def from_item(item):
+    return {key: deserialize(value) for key, value in item.items()}
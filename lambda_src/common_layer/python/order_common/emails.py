@@ -0,0 +1,20 @@
+"""The order confirmation email, sent by email_handler or email_sender_handler."""
+
+
+def order_email_message(order_id):
+    return {
+        'Subject': {
+            'Data': f'Order Confirmation - {order_id}',
+            'Charset': 'UTF-8'
+        },
+        'Body': {
+            'Text': {
+                'Data': f'Your order {order_id} has been successfully processed.',
+                'Charset': 'UTF-8'
+            },
+            'Html': {
+                'Data': f'<html><body><h1>Order Confirmation</h1><p>Your order <strong>{order_id}</strong> has been successfully processed.</p></body></html>',
+                'Charset': 'UTF-8'
+            }
+        }
+    }
@@ -0,0 +1,149 @@
+"""Idempotency guard for the SQS consumers.
+
+SNS -> SQS delivery is at-least-once, so the same order can reach a consumer
+more than once, in the same batch or in a later one. Before doing any work a
+consumer claims the order IDs of its batch; only the claimed ones are processed.
+
+Claims are conditional writes to a DynamoDB table (one TransactWriteItems call
+per 100 keys). A claim starts IN_PROGRESS with a short lease so an invocation
+that crashes mid-batch does not block redelivery forever; ``complete`` turns it
+into a COMPLETED record kept for ``ttl_seconds``, and ``release`` deletes it so a
+failed record can be retried. Completed keys are also remembered in an
+in-process LRU so warm containers skip known duplicates without a DynamoDB call.
+"""
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+from order_common.dynamo import to_item
+
+STATUS_IN_PROGRESS = 'IN_PROGRESS'
+STATUS_COMPLETED = 'COMPLETED'
+# TransactWriteItems accepts at most 100 actions, BatchWriteItem 25.
+MAX_TRANSACTION_ITEMS = 100
+MAX_BATCH_WRITE_ITEMS = 25
+MAX_BATCH_WRITE_ATTEMPTS = 5
+
+
+class IdempotencyStore:
+
+    def __init__(self, dynamodb, table_name, namespace, ttl_seconds=24 * 3600, lease_seconds=900,
+                 cache_size=4096, clock=time.time):
+        """``dynamodb`` is a low-level DynamoDB client and ``table_name`` a table
+        keyed on ``PK``; with no table name, deduplication is in memory only.
+        ``namespace`` separates consumers, since each of them has to process
+        every order once."""
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.cache_size = cache_size
+        self._clock = clock
+        self._completed = OrderedDict()
+
+    def clear(self):
+        self._completed.clear()
+
+    def _pk(self, key):
+        return f'{self.namespace}#{key}'
+
+    def _remember(self, key):
+        self._completed[key] = True
+        self._completed.move_to_end(key)
+        while len(self._completed) > self.cache_size:
+            self._completed.popitem(last=False)
+
+    def claim_many(self, keys):
+        """Claim ``keys`` for processing.
+
+        Returns ``(claimed, busy)``: the keys this invocation now owns, and the
+        keys another invocation holds an unexpired IN_PROGRESS lease on. Callers
+        should report busy keys as failed so SQS retries them later; keys in
+        neither set are duplicates of completed work and can be skipped.
+        ``None`` keys are ignored.
+        """
+        pending = []
+        seen = set()
+        for key in keys:
+            if key is None or key in self._completed or key in seen:
+                continue
+            seen.add(key)
+            pending.append(key)
+        if self.table_name is None or not pending:
+            return set(pending), set()
+
+        claimed, busy = set(), set()
+        for i in range(0, len(pending), MAX_TRANSACTION_ITEMS):
+            chunk_claimed, chunk_busy = self._claim_chunk(pending[i:i + MAX_TRANSACTION_ITEMS])
+            claimed |= chunk_claimed
+            busy |= chunk_busy
+        return claimed, busy
+
+    def _claim_chunk(self, keys):
+        # A transaction is all-or-nothing: when some keys are already claimed the
+        # cancellation reasons say which, and the rest is claimed in a retry.
+        busy = set()
+        while keys:
+            now = int(self._clock())
+            try:
+                self.dynamodb.transact_write_items(TransactItems=[{
+                    'Put': {
+                        'TableName': self.table_name,
+                        'Item': to_item({'PK': self._pk(key), 'status': STATUS_IN_PROGRESS,
+                                         'expires_at': now + self.lease_seconds}),
+                        'ConditionExpression': 'attribute_not_exists(PK) OR expires_at < :now',
+                        'ExpressionAttributeValues': {':now': {'N': str(now)}},
+                        'ReturnValuesOnConditionCheckFailure': 'ALL_OLD',
+                    }
+                } for key in keys])
+                return set(keys), busy
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+                reasons = e.response.get('CancellationReasons', [])
+                taken = {}
+                for key, reason in zip(keys, reasons):
+                    if reason.get('Code') == 'ConditionalCheckFailed':
+                        taken[key] = reason.get('Item', {}).get('status', {}).get('S')
+                if not taken:
+                    # Cancelled for another reason (e.g. a conflicting transaction).
+                    raise
+                for key, status in taken.items():
+                    if status == STATUS_COMPLETED:
+                        self._remember(key)
+                    else:
+                        busy.add(key)
+                keys = [key for key in keys if key not in taken]
+        return set(), busy
+
+    def complete(self, keys):
+        """Mark claimed ``keys`` as processed."""
+        keys = [key for key in keys if key is not None]
+        for key in keys:
+            self._remember(key)
+        if self.table_name is None or not keys:
+            return
+        expires_at = int(self._clock()) + self.ttl_seconds
+        self._batch_write([{'PutRequest': {'Item': to_item({
+            'PK': self._pk(key), 'status': STATUS_COMPLETED, 'expires_at': expires_at})}} for key in keys])
+
+    def release(self, keys):
+        """Drop claims on ``keys`` whose processing failed so they can be retried."""
+        keys = [key for key in keys if key is not None]
+        if self.table_name is None or not keys:
+            return
+        self._batch_write([{'DeleteRequest': {'Key': {'PK': {'S': self._pk(key)}}}} for key in keys])
+
+    def _batch_write(self, requests):
+        for i in range(0, len(requests), MAX_BATCH_WRITE_ITEMS):
+            request_items = {self.table_name: requests[i:i + MAX_BATCH_WRITE_ITEMS]}
+            for attempt in range(MAX_BATCH_WRITE_ATTEMPTS):
+                response = self.dynamodb.batch_write_item(RequestItems=request_items)
+                request_items = response.get('UnprocessedItems')
+                if not request_items:
+                    break
+                time.sleep(0.05 * 2 ** attempt)
+            else:
+                raise RuntimeError(f"Idempotency records were not written: {request_items}")
@@ -0,0 +1,118 @@
+"""Structured JSON logging for the handlers.
+
+Each handler creates one ``Logger`` at module level and wraps its entry point
+with ``inject_context``::
+
+    logger = Logger('email')
+
+    @logger.inject_context
+    @metrics.instrument
+    def lambda_handler(event, context):
+        with logger.bind(message_id=record['messageId'], order_id=order_id):
+            logger.info('Email sent', ses_message_id=response['MessageId'])
+
+Every line is one JSON object with the level, a timestamp in epoch
+milliseconds, the logger name, the Lambda request ID and the fields bound
+for the record being handled (SQS ``message_id``, ``order_id``), so Logs
+Insights can follow one order or one invocation. The request ID and bound
+fields are shared by every logger in the process, so the shared layer's
+loggers carry them too.
+
+Nothing is formatted for a disabled level: ``%`` arguments are only applied,
+and callable field values only called, when the line is written. Verbose
+payloads such as the full event go through ``payload``, which writes them
+with ``LOG_LEVEL=DEBUG`` only, and then only for an ``EVENT_LOG_SAMPLE_RATE``
+share of invocations.
+"""
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get('EVENT_LOG_SAMPLE_RATE', '0.1'))
+
+# Correlation state of the current invocation, shared by all loggers. Bound
+# fields are per thread, so handlers can bind a record in a worker thread.
+_invocation = {'request_id': None, 'sampled': False}
+_bound = threading.local()
+
+
+class Logger:
+
+    def __init__(self, name, level=LOG_LEVEL, sample_rate=EVENT_LOG_SAMPLE_RATE, clock=time.time):
+        self.name = name
+        self.level = LEVELS.get(level.upper(), LEVELS['INFO'])
+        self.sample_rate = sample_rate
+        self._clock = clock
+
+    def is_enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    @contextmanager
+    def bind(self, **fields):
+        """Add ``fields`` to every line logged by this thread in the block."""
+        previous = getattr(_bound, 'fields', {})
+        _bound.fields = {**previous, **fields}
+        try:
+            yield
+        finally:
+            _bound.fields = previous
+
+    def _write(self, level, message, args, fields):
+        if args:
+            message = message % args
+        line = {
+            'level': level,
+            'timestamp': int(self._clock() * 1000),
+            'logger': self.name,
+            'message': message,
+        }
+        if _invocation['request_id'] is not None:
+            line['request_id'] = _invocation['request_id']
+        line.update(getattr(_bound, 'fields', {}))
+        for key, value in fields.items():
+            line[key] = value() if callable(value) else value
+        print(json.dumps(line, default=str))
+
+    def log(self, level, message, *args, **fields):
+        if LEVELS[level] >= self.level:
+            self._write(level, message, args, fields)
+
+    def debug(self, message, *args, **fields):
+        self.log('DEBUG', message, *args, **fields)
+
+    def info(self, message, *args, **fields):
+        self.log('INFO', message, *args, **fields)
+
+    def warning(self, message, *args, **fields):
+        self.log('WARNING', message, *args, **fields)
+
+    def error(self, message, *args, **fields):
+        self.log('ERROR', message, *args, **fields)
+
+    def payload(self, message, *args, **fields):
+        """Log a verbose payload at debug level in sampled invocations only."""
+        if _invocation['sampled'] and self.is_enabled('DEBUG'):
+            self._write('DEBUG', message, args, fields)
+
+    def inject_context(self, handler):
+        """Decorate a Lambda handler to tag its lines with the request ID,
+        decide whether its payloads are sampled and log the event if so."""
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            _invocation['request_id'] = getattr(context, 'aws_request_id', None)
+            _invocation['sampled'] = self.is_enabled('DEBUG') and random.random() < self.sample_rate
+            self.payload('Received event', event=event)
+            try:
+                return handler(event, context)
+            finally:
+                _invocation['request_id'] = None
+                _invocation['sampled'] = False
+
+        return wrapper
@@ -0,0 +1,109 @@
+"""CloudWatch metrics for the handlers, written as Embedded Metric Format (EMF).
+
+EMF metrics are JSON log lines that CloudWatch Logs turns into metrics, so
+no PutMetricData call is made on the request path. Each handler creates one
+``Metrics`` at module level and wraps its entry point::
+
+    metrics = Metrics('email')
+
+    @metrics.instrument
+    def lambda_handler(event, context):
+        with metrics.timer('SesLatency'):
+            ...
+
+Every invocation emits ColdStart (1 or 0) and BatchSize; the first one in a
+container also emits InitDuration, the time from the handler's first import
+of ``order_common`` to the handler being defined. That covers the handler's
+module-level set-up including the SDK imports, which come after it; the
+Lambda runtime's own start-up is not included.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from order_common import INIT_STARTED_AT
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'OrderProcessing')
+# EMF accepts at most 100 values per metric in one document.
+MAX_VALUES_PER_DOCUMENT = 100
+
+MILLISECONDS = 'Milliseconds'
+COUNT = 'Count'
+
+
+class Metrics:
+    """Collects metric values during an invocation and prints them as EMF."""
+
+    def __init__(self, service, namespace=METRICS_NAMESPACE, clock=time.perf_counter):
+        """``service`` becomes the ``Service`` dimension of every metric."""
+        self.service = service
+        self.namespace = namespace
+        self._clock = clock
+        self._values = {}
+        self._units = {}
+        self._lock = threading.Lock()
+        self._cold_start = True
+        self._init_ms = None
+
+    def put(self, name, value, unit=MILLISECONDS):
+        with self._lock:
+            self._units[name] = unit
+            self._values.setdefault(name, []).append(value)
+
+    @contextmanager
+    def timer(self, name):
+        """Record the duration of the ``with`` block, in milliseconds, as ``name``."""
+        started = self._clock()
+        try:
+            yield
+        finally:
+            self.put(name, (self._clock() - started) * 1000)
+
+    def flush(self):
+        """Print the collected values as EMF documents and reset them."""
+        with self._lock:
+            values, units = self._values, self._units
+            self._values, self._units = {}, {}
+        if not values:
+            return
+        longest = max(len(v) for v in values.values())
+        for start in range(0, longest, MAX_VALUES_PER_DOCUMENT):
+            names = [name for name, v in values.items() if len(v) > start]
+            document = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [['Service']],
+                        'Metrics': [{'Name': name, 'Unit': units[name]} for name in names],
+                    }],
+                },
+                'Service': self.service,
+            }
+            for name in names:
+                chunk = values[name][start:start + MAX_VALUES_PER_DOCUMENT]
+                document[name] = chunk[0] if len(chunk) == 1 else chunk
+            print(json.dumps(document))
+
+    def instrument(self, handler):
+        """Decorate a Lambda handler to record start-up and batch metrics and
+        flush all metrics when it returns."""
+        self._init_ms = (time.perf_counter() - INIT_STARTED_AT) * 1000
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            self.put('ColdStart', 1 if self._cold_start else 0, COUNT)
+            if self._cold_start:
+                self.put('InitDuration', self._init_ms)
+                self._cold_start = False
+            if isinstance(event, dict) and 'Records' in event:
+                self.put('BatchSize', len(event['Records']), COUNT)
+            try:
+                return handler(event, context)
+            finally:
+                self.flush()
+
+        return wrapper
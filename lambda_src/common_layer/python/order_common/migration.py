@@ -0,0 +1,137 @@
+"""Backfill of the original OrdersTable into OrdersTableV2 and InventoryTable.
+
+The original table keyed every item on ``PK`` alone: orders under
+``order#{order_id}`` with their ``order_id`` and ``amount_total``, and the
+inventory handler's stock counters under ``inventory`` and
+``inventory#{sku}``. Giving orders a sort key and indexes needed a new table,
+and the counters moved to their own, so neither starts with that data.
+``backfill`` copies it. It can run while the handlers run, and again after a
+partial run:
+
+- An order is written unless the new table already has it (the handlers
+  saved it since the deploy). Its creation time was never stored, so
+  ``created_at`` is the time of the backfill; the item is marked
+  ``backfilled`` and the aggregator leaves it out of the totals.
+- A counter gets its old stock less what the inventory handler took from it
+  since the deploy, i.e. its initial stock minus its current value. Each
+  counter is marked ``backfilled`` and adjusted only once. The handler may
+  have sold more than the old stock held, since it started from its initial
+  stock; such a counter is set to 0, never below, and counted as
+  ``counters_oversold``. Keep the inventory consumer paused until the
+  backfill has run (``inventory_backfill_pending``) so that cannot happen.
+"""
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+from order_common.dynamo import from_item, to_item
+from order_common.logger import Logger
+from order_common.orders_table import DEFAULT_SHARD_COUNT, order_item, timestamp
+
+ORDER_PREFIX = 'order#'
+INVENTORY_PREFIX = 'inventory'
+# The inventory handler's default INITIAL_STOCK_QUANTITY; the stack runs it
+# with one counter per SKU, so this is also each counter's initial stock.
+DEFAULT_INITIAL_STOCK = 100
+# Counter writes that lose a race with the inventory handler are retried.
+MAX_COUNTER_ATTEMPTS = 10
+
+MOVED = 'moved'
+PRESENT = 'present'
+OVERSOLD = 'oversold'
+
+logger = Logger('order_common.migration')
+
+
+def scan(dynamodb, table_name, page_size=None):
+    """Yield every item of a table in wire format, page by page."""
+    request = {'TableName': table_name}
+    if page_size:
+        request['Limit'] = page_size
+    while True:
+        response = dynamodb.scan(**request)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _conditional(write):
+    """Run ``write``; False if its condition failed."""
+    try:
+        write()
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+    return True
+
+
+def backfill_order(dynamodb, table_name, legacy_item, created_at, shard_count=DEFAULT_SHARD_COUNT):
+    """Copy one original order item; False if the order is already there."""
+    legacy = from_item(legacy_item)
+    order_id = legacy.get('order_id') or legacy['PK'][len(ORDER_PREFIX):]
+    item = order_item(order_id, legacy.get('amount_total'), legacy.get('customer_id'), created_at=created_at,
+                      shard_count=shard_count)
+    item['backfilled'] = True
+    return _conditional(lambda: dynamodb.put_item(TableName=table_name, Item=to_item(item),
+                                                  ConditionExpression='attribute_not_exists(PK)'))
+
+
+def backfill_counter(dynamodb, table_name, legacy_item, initial_stock=DEFAULT_INITIAL_STOCK):
+    """Move one original stock counter.
+
+    Returns ``MOVED``, ``PRESENT`` if it was moved before, or ``OVERSOLD`` if
+    more was taken since the deploy than it held and it was set to 0.
+    """
+    key = {'PK': legacy_item['PK']}
+    stock = int(legacy_item['stock_quantity']['N'])
+    for _ in range(MAX_COUNTER_ATTEMPTS):
+        current = dynamodb.get_item(TableName=table_name, Key=key, ConsistentRead=True).get('Item')
+        if current and 'backfilled' in current:
+            return PRESENT
+        if current and 'stock_quantity' in current:
+            taken = initial_stock - int(current['stock_quantity']['N'])
+            # Written only if the handler has not changed the counter since it was read.
+            condition = 'attribute_not_exists(backfilled) AND stock_quantity = :seen'
+            values = {':seen': current['stock_quantity']}
+        else:
+            taken = 0
+            condition = 'attribute_not_exists(PK)'
+            values = {}
+        values.update({':stock': {'N': str(max(stock - taken, 0))}, ':backfilled': {'BOOL': True}})
+        if _conditional(lambda: dynamodb.update_item(
+            TableName=table_name,
+            Key=key,
+            UpdateExpression='SET stock_quantity = :stock, backfilled = :backfilled',
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+        )):
+            if stock - taken >= 0:
+                return MOVED
+            logger.warning('Counter oversold since the deploy; set to 0', pk=key['PK']['S'], legacy_stock=stock,
+                           taken=taken)
+            return OVERSOLD
+    raise RuntimeError(f"Counter {key['PK']['S']} kept changing; run the backfill again.")
+
+
+def backfill(dynamodb, legacy_table, orders_table, inventory_table, shard_count=DEFAULT_SHARD_COUNT,
+             initial_stock=DEFAULT_INITIAL_STOCK, now=None, page_size=None):
+    """Copy the orders and stock counters of ``legacy_table``; returns counts
+    of what was copied, what was already there, the counters that were
+    oversold and set to 0, and the items that were not recognised."""
+    created_at = timestamp(now)
+    stats = Counter()
+    for item in scan(dynamodb, legacy_table, page_size):
+        pk = item['PK']['S']
+        if pk.startswith(ORDER_PREFIX):
+            copied = backfill_order(dynamodb, orders_table, item, created_at, shard_count)
+            stats['orders' if copied else 'orders_present'] += 1
+        elif pk.split('#')[0] == INVENTORY_PREFIX and 'stock_quantity' in item:
+            status = backfill_counter(dynamodb, inventory_table, item, initial_stock)
+            stats['counters_present' if status == PRESENT else 'counters'] += 1
+            if status == OVERSOLD:
+                stats['counters_oversold'] += 1
+        else:
+            stats['ignored'] += 1
+    return dict(stats)
@@ -0,0 +1,145 @@
+"""Order messages as they travel from the webhook to the consumer queues.
+
+The topic's SQS subscriptions use raw message delivery, so a record body is
+the order JSON itself. Bodies still wrapped in the SNS envelope (a queue
+subscribed without raw delivery, or messages published before the switch)
+are unwrapped, so both shapes decode to the same ``OrderRecord``.
+
+orjson is used when it is installed and the standard library ``json``
+otherwise; both produce and accept the same JSON.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+else:
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+
+class InvalidOrderError(ValueError):
+    pass
+
+
+class OrderRecord:
+    """One order read from a queue record.
+
+    ``items`` is ``None`` or a list of ``{'sku': ..., 'quantity': ...}`` dicts;
+    a ``quantity`` is a positive integer and defaults to 1.
+    ``deduplication_id`` is the record's FIFO deduplication ID, if any.
+    """
+
+    __slots__ = ('message_id', 'order_id', 'amount_total', 'items', 'customer_id', 'deduplication_id')
+
+    def __init__(self, message_id, order_id, amount_total=None, items=None, customer_id=None,
+                 deduplication_id=None):
+        self.message_id = message_id
+        self.order_id = order_id
+        self.amount_total = amount_total
+        self.items = items
+        self.customer_id = customer_id
+        self.deduplication_id = deduplication_id
+
+    def __repr__(self):
+        return (f"OrderRecord(message_id={self.message_id!r}, order_id={self.order_id!r}, "
+                f"amount_total={self.amount_total!r}, items={self.items!r}, customer_id={self.customer_id!r}, "
+                f"deduplication_id={self.deduplication_id!r})")
+
+    def __eq__(self, other):
+        if not isinstance(other, OrderRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    @property
+    def idempotency_key(self):
+        """The key consumers claim this record under.
+
+        On a standard queue every copy of an order is a duplicate, so the key
+        is the order ID. On a FIFO queue the topic has already dropped
+        duplicate publishes, and each later event of an order (it was
+        updated) has its own deduplication ID and must take effect too, so
+        the key is the order ID and that ID.
+        """
+        if self.deduplication_id:
+            return f'{self.order_id}#{self.deduplication_id}'
+        return self.order_id
+
+    @classmethod
+    def from_message(cls, message, message_id=None):
+        """Validate a decoded order message; raises ``InvalidOrderError``."""
+        if not isinstance(message, dict):
+            raise InvalidOrderError("Order message is not a JSON object.")
+        order_id = message.get('order_id')
+        if not isinstance(order_id, str) or not order_id:
+            raise InvalidOrderError("Order message has no order_id.")
+        amount_total = message.get('amount_total')
+        if amount_total is not None and (isinstance(amount_total, bool)
+                                         or not isinstance(amount_total, (int, float))):
+            raise InvalidOrderError(f"Order {order_id} has a non-numeric amount_total.")
+        items = message.get('items')
+        if items is not None:
+            if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+                raise InvalidOrderError(f"Order {order_id} has malformed items.")
+            for item in items:
+                quantity = item.get('quantity', 1)
+                if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+                    raise InvalidOrderError(f"Order {order_id} has an item quantity that is not a positive integer.")
+        customer_id = message.get('customer_id')
+        if customer_id is not None and not isinstance(customer_id, str):
+            raise InvalidOrderError(f"Order {order_id} has a non-string customer_id.")
+        return cls(message_id, order_id, amount_total, items, customer_id)
+
+
+def unwrap(body):
+    """Decode a record body, unwrapping the SNS envelope if there is one."""
+    message = loads(body)
+    if isinstance(message, dict):
+        inner = message.get('Message')
+        if isinstance(inner, str) and 'order_id' not in message:
+            message = loads(inner)
+    return message
+
+
+def decode_record(record):
+    """``OrderRecord`` for an SQS record; raises ``InvalidOrderError`` (or a
+    JSON decode error, also a ``ValueError``) for a malformed body."""
+    order = OrderRecord.from_message(unwrap(record.get('body') or '{}'), record.get('messageId'))
+    order.deduplication_id = (record.get('attributes') or {}).get('MessageDeduplicationId')
+    return order
+
+
+def message_group_id(record):
+    """The FIFO message group of an SQS record, or None on a standard queue."""
+    return (record.get('attributes') or {}).get('MessageGroupId')
+
+
+def with_group_failures(records, failed):
+    """``failed`` (message IDs) plus every record of a FIFO batch that comes
+    after a failed record of the same message group.
+
+    A FIFO consumer must not let a message overtake an earlier one of its
+    group: once one fails, the rest of the group goes back to the queue with
+    it and is retried after it. Records of standard queues have no group and
+    are returned unchanged.
+    """
+    failed = set(failed)
+    blocked = set()
+    for record in records:
+        group = message_group_id(record)
+        if group is None:
+            continue
+        if group in blocked:
+            failed.add(record.get('messageId'))
+        elif record.get('messageId') in failed:
+            blocked.add(group)
+    return failed
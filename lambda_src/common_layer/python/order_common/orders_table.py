@@ -0,0 +1,138 @@
+"""Key schema of OrdersTable and the queries reporting reads use.
+
+Each order is one item under ``PK = order#{order_id}``, ``SK = order``; the
+sort key leaves room for more items per order. Three global secondary
+indexes, all sorted by ``created_at`` (ISO-8601 UTC), answer the
+operational queries without a Scan:
+
+    ByDate      GSI1PK = date#{day}#{shard}
+    ByCustomer  GSI2PK = customer#{customer_id}   (only orders with a customer)
+    ByStatus    GSI3PK = status#{status}#{day}#{shard}
+
+A day's orders would all share one index partition, which takes about 1000
+writes/s, so the date and status keys are spread over ``shard_count``
+buckets chosen by a stable hash of the order ID. Readers query every bucket
+and merge the results by ``created_at``. The shard count may be raised
+later but not lowered: days written with more buckets would be read partly.
+"""
+import heapq
+import time
+import zlib
+from datetime import datetime, timezone
+
+from order_common.dynamo import from_item, to_item
+
+ORDER_SK = 'order'
+STATUS_PLACED = 'placed'
+DEFAULT_SHARD_COUNT = 4
+
+DATE_INDEX = 'ByDate'
+CUSTOMER_INDEX = 'ByCustomer'
+STATUS_INDEX = 'ByStatus'
+# Partition and sort key attribute of each index.
+INDEX_KEYS = {
+    DATE_INDEX: ('GSI1PK', 'created_at'),
+    CUSTOMER_INDEX: ('GSI2PK', 'created_at'),
+    STATUS_INDEX: ('GSI3PK', 'created_at'),
+}
+
+
+def order_key(order_id):
+    return {'PK': f'order#{order_id}', 'SK': ORDER_SK}
+
+
+def timestamp(now=None):
+    """``now`` (epoch seconds, default the current time) as ISO-8601 UTC with milliseconds."""
+    moment = datetime.fromtimestamp(time.time() if now is None else now, tz=timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f'{moment.microsecond // 1000:03d}Z'
+
+
+def index_shard(order_id, shard_count=DEFAULT_SHARD_COUNT):
+    # crc32 rather than hash(), which is salted per process.
+    return zlib.crc32(str(order_id).encode()) % shard_count
+
+
+def order_item(order_id, amount_total=None, customer_id=None, status=STATUS_PLACED, created_at=None,
+               shard_count=DEFAULT_SHARD_COUNT):
+    """The OrdersTable item for an order, index keys included, as plain values."""
+    created_at = created_at or timestamp()
+    day = created_at[:10]
+    shard = index_shard(order_id, shard_count)
+    item = dict(order_key(order_id))
+    item.update({
+        'order_id': order_id,
+        'amount_total': amount_total,
+        'status': status,
+        'created_at': created_at,
+        'updated_at': created_at,
+        'GSI1PK': f'date#{day}#{shard}',
+        'GSI3PK': f'status#{status}#{day}#{shard}',
+    })
+    if customer_id:
+        item['customer_id'] = customer_id
+        item['GSI2PK'] = f'customer#{customer_id}'
+    return item
+
+
+def get_order(dynamodb, table_name, order_id):
+    response = dynamodb.get_item(TableName=table_name, Key=to_item(order_key(order_id)))
+    return from_item(response['Item']) if 'Item' in response else None
+
+
+def _query(dynamodb, table_name, index_name, partition, start=None, end=None, page_size=None):
+    """Yield the items of one index partition in ``created_at`` order,
+    optionally limited to ``start <= created_at <= end``, page by page."""
+    partition_attribute, sort_attribute = INDEX_KEYS[index_name]
+    condition = f'{partition_attribute} = :partition'
+    values = {':partition': {'S': partition}}
+    if start is not None and end is not None:
+        condition += f' AND {sort_attribute} BETWEEN :start AND :end'
+        values.update({':start': {'S': start}, ':end': {'S': end}})
+    elif start is not None:
+        condition += f' AND {sort_attribute} >= :start'
+        values[':start'] = {'S': start}
+    elif end is not None:
+        condition += f' AND {sort_attribute} <= :end'
+        values[':end'] = {'S': end}
+    request = {
+        'TableName': table_name,
+        'IndexName': index_name,
+        'KeyConditionExpression': condition,
+        'ExpressionAttributeValues': values,
+    }
+    if page_size:
+        request['Limit'] = page_size
+    while True:
+        response = dynamodb.query(**request)
+        for item in response.get('Items', []):
+            yield from_item(item)
+        if 'LastEvaluatedKey' not in response:
+            return
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _merged(queries):
+    return heapq.merge(*queries, key=lambda order: order['created_at'])
+
+
+def orders_for_day(dynamodb, table_name, day, shard_count=DEFAULT_SHARD_COUNT, start=None, end=None,
+                   page_size=None):
+    """Orders created on ``day`` (``YYYY-MM-DD``), oldest first.
+
+    ``start``/``end`` narrow the day to a time range. Pages are fetched as
+    the result is consumed, so stopping early reads no further.
+    """
+    return _merged(_query(dynamodb, table_name, DATE_INDEX, f'date#{day}#{shard}', start, end, page_size)
+                   for shard in range(shard_count))
+
+
+def orders_with_status(dynamodb, table_name, status, day, shard_count=DEFAULT_SHARD_COUNT, page_size=None):
+    """Orders in ``status`` that were created on ``day``, oldest first."""
+    return _merged(_query(dynamodb, table_name, STATUS_INDEX, f'status#{status}#{day}#{shard}',
+                          page_size=page_size)
+                   for shard in range(shard_count))
+
+
+def orders_for_customer(dynamodb, table_name, customer_id, start=None, end=None, page_size=None):
+    """A customer's orders, oldest first, optionally within ``[start, end]``."""
+    return _query(dynamodb, table_name, CUSTOMER_INDEX, f'customer#{customer_id}', start, end, page_size)
@@ -0,0 +1,210 @@
+"""Outbox of order confirmation emails, sent at the SES rate by a scheduler.
+
+In the ``outbox`` delivery mode email_handler does not call SES: it adds one
+item per order to the outbox table and acknowledges the SQS record, so the
+email queue drains at DynamoDB speed whatever SES does. email_sender_handler
+runs every minute and sends the due items, paced by a ``TokenBucket`` at the
+account's SES send rate. email_events_handler records what SES reports back
+through the configuration set's event destination.
+
+An item, ``PK = email#{order_id}``, moves through ``delivery_status``:
+
+    pending    waiting for ``next_attempt_at``
+    sent       accepted by SES; ``ses_message_id`` is set
+    delivered, bounced, complained, rejected
+               reported by SES for a sent email
+    failed     a permanent SES error, or ``max_attempts`` attempts
+
+Pending items carry ``due_shard`` (``due#{shard}``) and ``next_attempt_at``
+(epoch seconds), the keys of the sparse ``ByDueTime`` index the sender
+queries; they are removed when the item leaves ``pending``. Adding is
+conditional on the item not existing, so a redelivered order is not sent
+twice. A sender claims an item before sending it by moving its
+``next_attempt_at`` one lease ahead: a concurrent sender skips it, and if
+the sender dies mid-send the item is retried once the lease ends.
+"""
+import random
+import time
+import zlib
+
+from botocore.exceptions import ClientError
+
+from order_common.dynamo import from_item, to_item
+
+STATUS_PENDING = 'pending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+# Statuses taken from the SES events of the configuration set.
+EVENT_STATUSES = {
+    'Delivery': 'delivered',
+    'Bounce': 'bounced',
+    'Complaint': 'complained',
+    'Reject': 'rejected',
+    'Rendering Failure': 'rejected',
+}
+DUE_INDEX = 'ByDueTime'
+# Partition and sort key attribute of each index.
+INDEX_KEYS = {DUE_INDEX: ('due_shard', 'next_attempt_at')}
+DEFAULT_SHARD_COUNT = 4
+# Message tag carrying the outbox key through SES to its events. Tag values
+# only allow letters, digits, '_' and '-', so the order ID is hex encoded.
+OUTBOX_TAG = 'outbox_id'
+# SES errors that fail the same way however often they are retried.
+PERMANENT_ERROR_CODES = frozenset({
+    'MessageRejected',
+    'MailFromDomainNotVerifiedException',
+    'ConfigurationSetDoesNotExistException',
+    'ConfigurationSetSendingPausedException',
+    'InvalidParameterValue',
+    'TemplateDoesNotExistException',
+})
+
+
+def outbox_key(order_id):
+    return {'PK': f'email#{order_id}'}
+
+
+def tag_value(order_id):
+    return str(order_id).encode().hex()
+
+
+def order_id_from_tag(value):
+    return bytes.fromhex(value).decode()
+
+
+def is_permanent_error(error):
+    """Whether retrying the SES call that raised ``error`` cannot succeed."""
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    return response.get('Error', {}).get('Code') in PERMANENT_ERROR_CODES
+
+
+def retry_delay(attempts, base_seconds=30, max_seconds=3600, rng=random):
+    """Seconds to wait after the ``attempts``-th failed attempt: exponential
+    backoff with jitter over the upper half, so retries of a throttled burst
+    spread out but none comes back almost at once."""
+    delay = min(max_seconds, base_seconds * 2 ** max(attempts - 1, 0))
+    return rng.uniform(delay / 2, delay)
+
+
+def _is_conditional_failure(error):
+    return error.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+class EmailOutbox:
+
+    def __init__(self, dynamodb, table_name, shard_count=DEFAULT_SHARD_COUNT, ttl_seconds=30 * 24 * 3600,
+                 lease_seconds=300, clock=time.time):
+        """``dynamodb`` is a low-level DynamoDB client and ``table_name`` a
+        table keyed on ``PK`` with the ``ByDueTime`` index. Items expire
+        ``ttl_seconds`` after they were added."""
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.shard_count = shard_count
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+
+    def _shard(self, order_id):
+        # crc32 rather than hash(), which is salted per process.
+        return f'due#{zlib.crc32(str(order_id).encode()) % self.shard_count}'
+
+    def _update(self, order_id, expression, values, condition=None, **kwargs):
+        request = {'TableName': self.table_name, 'Key': to_item(outbox_key(order_id)),
+                   'UpdateExpression': expression, 'ExpressionAttributeValues': to_item(values), **kwargs}
+        if condition:
+            request['ConditionExpression'] = condition
+        return self.dynamodb.update_item(**request)
+
+    def add(self, order_id):
+        """Queue the email of ``order_id``; False if it was queued before."""
+        now = self.clock()
+        item = {
+            **outbox_key(order_id),
+            'order_id': str(order_id),
+            'delivery_status': STATUS_PENDING,
+            'attempts': 0,
+            'due_shard': self._shard(order_id),
+            'next_attempt_at': round(now, 3),
+            'created_at': round(now, 3),
+            'expires_at': int(now + self.ttl_seconds),
+        }
+        try:
+            self.dynamodb.put_item(TableName=self.table_name, Item=to_item(item),
+                                   ConditionExpression='attribute_not_exists(PK)')
+        except ClientError as e:
+            if _is_conditional_failure(e):
+                return False
+            raise
+        return True
+
+    def due(self, limit=100):
+        """Up to ``limit`` pending items whose ``next_attempt_at`` has passed,
+        as plain values, the longest waiting first within each shard."""
+        now = self.clock()
+        items = []
+        for shard in range(self.shard_count):
+            request = {
+                'TableName': self.table_name,
+                'IndexName': DUE_INDEX,
+                'KeyConditionExpression': 'due_shard = :shard AND next_attempt_at <= :now',
+                'ExpressionAttributeValues': to_item({':shard': f'due#{shard}', ':now': round(now, 3)}),
+                'Limit': limit - len(items),
+            }
+            items.extend(from_item(item) for item in self.dynamodb.query(**request).get('Items', []))
+            if len(items) >= limit:
+                break
+        return items
+
+    def claim(self, item):
+        """Take ``item`` (as returned by ``due``) for one send attempt.
+
+        Returns the number of attempts including this one, or None if another
+        sender took it or it is no longer pending.
+        """
+        try:
+            response = self._update(
+                item['order_id'],
+                'SET next_attempt_at = :lease, attempts = attempts + :one',
+                {':lease': round(self.clock() + self.lease_seconds, 3), ':one': 1,
+                 ':pending': STATUS_PENDING, ':seen': item['next_attempt_at']},
+                condition='delivery_status = :pending AND next_attempt_at = :seen',
+                ReturnValues='UPDATED_NEW')
+        except ClientError as e:
+            if _is_conditional_failure(e):
+                return None
+            raise
+        return int(from_item(response['Attributes'])['attempts'])
+
+    def mark_sent(self, order_id, ses_message_id):
+        self._update(order_id,
+                     'SET delivery_status = :sent, ses_message_id = :id, sent_at = :now '
+                     'REMOVE due_shard, next_attempt_at',
+                     {':sent': STATUS_SENT, ':id': ses_message_id, ':now': round(self.clock(), 3)})
+
+    def retry_after(self, order_id, delay_seconds, error):
+        """Leave the item pending for another attempt in ``delay_seconds``."""
+        self._update(order_id, 'SET next_attempt_at = :at, last_error = :error',
+                     {':at': round(self.clock() + delay_seconds, 3), ':error': str(error)[:1000]})
+
+    def mark_failed(self, order_id, error):
+        self._update(order_id, 'SET delivery_status = :failed, last_error = :error REMOVE due_shard, next_attempt_at',
+                     {':failed': STATUS_FAILED, ':error': str(error)[:1000]})
+
+    def record_event(self, order_id, status, ses_message_id):
+        """Set the status SES reported for the email it accepted as
+        ``ses_message_id``; False if the item is not that email or already
+        has a later status (SES events may arrive out of order, a complaint
+        after the delivery)."""
+        try:
+            self._update(order_id, 'SET delivery_status = :status, event_at = :now',
+                         {':status': status, ':now': round(self.clock(), 3), ':id': ses_message_id,
+                          ':sent': STATUS_SENT, ':delivered': EVENT_STATUSES['Delivery']},
+                         condition='ses_message_id = :id AND delivery_status = :sent '
+                                   'OR ses_message_id = :id AND delivery_status = :delivered')
+        except ClientError as e:
+            if _is_conditional_failure(e):
+                return False
+            raise
+        return True
@@ -0,0 +1,56 @@
+"""Client-side rate limiting for calls to rate-capped AWS APIs (e.g. SES)."""
+import threading
+import time
+
+# Shortfall treated as rounding error. Refills are computed in floats, so a
+# bucket can stop a hair below a whole token, and on a coarse clock the sleep
+# for that gap may not move the clock at all.
+_TOKEN_EPSILON = 1e-9
+
+
+class TokenBucket:
+    """Token bucket allowing ``rate`` operations per second on average, with
+    bursts of up to ``capacity``. Thread-safe; ``acquire`` blocks until the
+    requested tokens are available."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """Take ``tokens``, waiting as long as needed. Requests larger than the
+        bucket are served in capacity-sized pieces. Returns the seconds waited."""
+        waited = 0.0
+        remaining = float(tokens)
+        while remaining > 0:
+            with self._lock:
+                self._refill()
+                take = min(remaining, self.capacity)
+                if self._tokens >= take - _TOKEN_EPSILON:
+                    self._tokens = max(0.0, self._tokens - take)
+                    remaining -= take
+                    continue
+                delay = (take - self._tokens) / self.rate
+            self._sleep(delay)
+            waited += delay
+        return waited
@@ -0,0 +1,213 @@
+"""Moving messages from a dead-letter queue back to its source queue.
+
+``Redrive`` runs ``concurrency`` receivers against the DLQ. Each receives up
+to 10 messages, sends the ones to move to the source queue with one
+SendMessageBatch and deletes them from the DLQ with one DeleteMessageBatch.
+Sends are paced by a ``TokenBucket`` shared by the receivers.
+
+A message is deleted only after it was sent, so a failure leaves it in the
+DLQ rather than losing it; at worst a message is delivered twice, which the
+consumers' idempotency absorbs. Messages that are not moved (a dry run, an
+``order_id`` filter, a failed send) stay hidden for ``visibility_timeout``
+so the receivers get past them, and are made visible again when the run
+ends. The run ends when the DLQ has no more visible messages, after
+``max_messages`` or at ``stop_at``.
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from order_common.logger import Logger
+from order_common.orders import unwrap
+from order_common.rate_limit import TokenBucket
+
+# SQS batch APIs accept at most 10 entries.
+MAX_BATCH_SIZE = 10
+
+logger = Logger('order_common.redrive')
+
+
+def message_order_id(body):
+    """The order_id of a queued message body, or None if it has none."""
+    try:
+        message = unwrap(body)
+    except ValueError:
+        return None
+    return message.get('order_id') if isinstance(message, dict) else None
+
+
+class Redrive:
+    """One redrive run from ``dlq_url`` to ``source_url``.
+
+    ``order_ids`` restricts the run to those orders. With ``dry_run`` nothing
+    is sent or deleted; ``stats()['would_move']`` counts what would be.
+    ``progress`` is called with ``stats()`` at most every
+    ``progress_interval`` seconds while the run lasts.
+    """
+
+    def __init__(self, sqs, dlq_url, source_url, rate=50.0, concurrency=4, dry_run=False, order_ids=None,
+                 max_messages=None, visibility_timeout=300, wait_seconds=1, stop_at=None, progress=None,
+                 progress_interval=5.0, clock=time.monotonic, sleep=time.sleep):
+        self.sqs = sqs
+        self.dlq_url = dlq_url
+        self.source_url = source_url
+        self.concurrency = max(1, concurrency)
+        self.dry_run = dry_run
+        self.order_ids = set(order_ids) if order_ids else None
+        self.max_messages = max_messages
+        self.visibility_timeout = visibility_timeout
+        self.wait_seconds = wait_seconds
+        self.stop_at = stop_at
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self._clock = clock
+        self._limiter = TokenBucket(rate, capacity=max(rate, MAX_BATCH_SIZE), clock=clock, sleep=sleep)
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._reserved = 0
+        self._held = []
+        self._started_at = None
+        self._reported_at = None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        elapsed = self._clock() - self._started_at if self._started_at is not None else 0.0
+        for name in ('received', 'moved', 'would_move', 'skipped', 'failed'):
+            counts.setdefault(name, 0)
+        counts['elapsed_seconds'] = round(elapsed, 3)
+        counts['moved_per_second'] = round(counts['moved'] / elapsed, 2) if elapsed > 0 else 0.0
+        return counts
+
+    def run(self):
+        """Redrive until the DLQ is drained or a limit is reached; returns ``stats()``."""
+        self._started_at = self._reported_at = self._clock()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for future in [executor.submit(self._receive_loop) for _ in range(self.concurrency)]:
+                    future.result()
+        finally:
+            self._release_held()
+        return self.stats()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counts[name] += value
+
+    def _reserve(self):
+        """How many messages the next receive may take (0 to stop)."""
+        if self.stop_at is not None and self._clock() >= self.stop_at:
+            return 0
+        with self._lock:
+            if self.max_messages is None:
+                return MAX_BATCH_SIZE
+            limit = min(MAX_BATCH_SIZE, self.max_messages - self._reserved)
+            self._reserved += max(limit, 0)
+            return max(limit, 0)
+
+    def _receive_loop(self):
+        while True:
+            limit = self._reserve()
+            if not limit:
+                return
+            response = self.sqs.receive_message(QueueUrl=self.dlq_url, MaxNumberOfMessages=limit,
+                                                WaitTimeSeconds=self.wait_seconds,
+                                                VisibilityTimeout=self.visibility_timeout,
+                                                AttributeNames=['All'], MessageAttributeNames=['All'])
+            messages = response.get('Messages', [])
+            if self.max_messages is not None and len(messages) < limit:
+                with self._lock:
+                    self._reserved -= limit - len(messages)
+            if not messages:
+                return
+            self._count('received', len(messages))
+            self._handle(messages)
+            self._report()
+
+    def _handle(self, messages):
+        if self.order_ids is None:
+            selected = messages
+        else:
+            selected, skipped = [], []
+            for message in messages:
+                (selected if message_order_id(message['Body']) in self.order_ids else skipped).append(message)
+            self._count('skipped', len(skipped))
+            self._hold(skipped)
+        if not selected:
+            return
+        if self.dry_run:
+            self._count('would_move', len(selected))
+            self._hold(selected)
+            return
+        self._move(selected)
+
+    def _move(self, messages):
+        self._limiter.acquire(len(messages))
+        entries = []
+        for index, message in enumerate(messages):
+            entry = {'Id': str(index), 'MessageBody': message['Body']}
+            if message.get('MessageAttributes'):
+                entry['MessageAttributes'] = message['MessageAttributes']
+            group_id = message.get('Attributes', {}).get('MessageGroupId')
+            if group_id:
+                # FIFO queues: keep the group; the DLQ message ID is a deduplication ID
+                # the source queue has not seen, and repeats if the same copy is sent twice.
+                entry['MessageGroupId'] = group_id
+                entry['MessageDeduplicationId'] = message['MessageId']
+            entries.append(entry)
+        try:
+            response = self.sqs.send_message_batch(QueueUrl=self.source_url, Entries=entries)
+        except ClientError as e:
+            logger.error('Failed to send %d message(s)', len(messages), queue_url=self.source_url, error=e)
+            self._count('failed', len(messages))
+            self._hold(messages)
+            return
+        sent = [messages[int(entry['Id'])] for entry in response.get('Successful', [])]
+        unsent = [messages[int(entry['Id'])] for entry in response.get('Failed', [])]
+        if unsent:
+            self._count('failed', len(unsent))
+            self._hold(unsent)
+        if not sent:
+            return
+        self._count('moved', len(sent))
+        try:
+            response = self.sqs.delete_message_batch(
+                QueueUrl=self.dlq_url,
+                Entries=[{'Id': str(index), 'ReceiptHandle': m['ReceiptHandle']} for index, m in enumerate(sent)])
+            undeleted = len(response.get('Failed', []))
+        except ClientError as e:
+            logger.error('Failed to delete redriven messages', queue_url=self.dlq_url, error=e)
+            undeleted = len(sent)
+        if undeleted:
+            # Already sent; the copies left in the DLQ would be redriven twice.
+            self._count('delete_failed', undeleted)
+
+    def _hold(self, messages):
+        handles = [m['ReceiptHandle'] for m in messages]
+        with self._lock:
+            self._held.extend(handles)
+
+    def _release_held(self):
+        with self._lock:
+            held, self._held = self._held, []
+        for start in range(0, len(held), MAX_BATCH_SIZE):
+            entries = [{'Id': str(index), 'ReceiptHandle': handle, 'VisibilityTimeout': 0}
+                       for index, handle in enumerate(held[start:start + MAX_BATCH_SIZE])]
+            try:
+                self.sqs.change_message_visibility_batch(QueueUrl=self.dlq_url, Entries=entries)
+            except ClientError as e:
+                # They become visible on their own when the visibility timeout ends.
+                logger.error('Failed to release skipped messages', queue_url=self.dlq_url, error=e)
+
+    def _report(self):
+        if self.progress is None:
+            return
+        now = self._clock()
+        with self._lock:
+            if now - self._reported_at < self.progress_interval:
+                return
+            self._reported_at = now
+        self.progress(self.stats())
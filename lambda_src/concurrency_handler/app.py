@@ -0,0 +1,77 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from order_common.aws import ClientError, lazy_client, prewarm
+from order_common.concurrency import ControlSettings, metric_queries, next_concurrency, samples_from_metric_data
+from order_common.logger import Logger
+from order_common.metrics import COUNT, METRICS_NAMESPACE, Metrics
+
+# Consumers by name: {"email": {"queue": "<queue name>", "mapping": "<event source mapping UUID>",
+# "minimum": 2, "maximum": 100, "batch_size": 10, "target_age_seconds": 150}, ...}
+CONSUMERS = json.loads(os.environ.get('CONSUMERS', '{}'))
+# SQS publishes queue metrics every minute, sometimes a few minutes late.
+METRIC_PERIOD_SECONDS = 60
+LOOKBACK_MINUTES = int(os.environ.get('LOOKBACK_MINUTES', '5'))
+
+cloudwatch = lazy_client('cloudwatch')
+lambda_client = lazy_client('lambda')
+metrics = Metrics('concurrency')
+logger = Logger('concurrency')
+# MaximumConcurrency is reported under each consumer's own Service dimension.
+consumer_metrics = {}
+prewarm(cloudwatch, lambda_client)
+
+
+def get_metric_data(now):
+    request = {
+        'MetricDataQueries': metric_queries(CONSUMERS, METRICS_NAMESPACE, METRIC_PERIOD_SECONDS),
+        'StartTime': now - timedelta(minutes=LOOKBACK_MINUTES),
+        'EndTime': now,
+    }
+    results = []
+    while True:
+        response = cloudwatch.get_metric_data(**request)
+        results.extend(response.get('MetricDataResults', []))
+        if not response.get('NextToken'):
+            return results
+        request['NextToken'] = response['NextToken']
+
+
+def adjust(name, consumer, sample):
+    """Set the consumer's MaximumConcurrency for ``sample``; returns the value in effect."""
+    mapping = lambda_client.get_event_source_mapping(UUID=consumer['mapping'])
+    current = mapping.get('ScalingConfig', {}).get('MaximumConcurrency')
+    target = next_concurrency(current, sample, ControlSettings.from_dict(consumer))
+    if target != current:
+        lambda_client.update_event_source_mapping(UUID=consumer['mapping'],
+                                                  ScalingConfig={'MaximumConcurrency': target})
+        logger.info('Set maximum concurrency of %s from %s to %s', name, current, target, consumer=name,
+                    visible=sample.visible, age_seconds=sample.age_seconds, throttles=sample.throttles)
+    return target
+
+
+@logger.inject_context
+@metrics.instrument
+def lambda_handler(event, context):
+    """Adjust every consumer's maximum concurrency from its latest queue metrics."""
+    samples = samples_from_metric_data(get_metric_data(datetime.now(timezone.utc)), CONSUMERS)
+    concurrency = {}
+    for name, consumer in CONSUMERS.items():
+        sample = samples.get(name)
+        if sample is None:
+            logger.warning('No queue metrics; leaving the maximum concurrency unchanged', consumer=name)
+            continue
+        try:
+            concurrency[name] = adjust(name, consumer, sample)
+        except ClientError as e:
+            # E.g. the mapping is still applying the previous update; retried next minute.
+            logger.error('Failed to adjust the maximum concurrency', consumer=name, error=e)
+            continue
+        service_metrics = consumer_metrics.setdefault(name, Metrics(name))
+        service_metrics.put('MaxConcurrency', concurrency[name], COUNT)
+        service_metrics.flush()
+    return {
+        'statusCode': 200,
+        'body': json.dumps(concurrency)
+    }
@@ -1,34 +1,169 @@
 import json
 import os
-import boto3
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from order_common.aws import is_throttling_error, lazy_client, prewarm
+from order_common.dynamo import from_item, to_item
+from order_common.idempotency import IdempotencyStore
+from order_common.logger import Logger
+from order_common.metrics import COUNT, Metrics
+from order_common.orders import decode_record, with_group_failures
+from order_common.orders_table import DEFAULT_SHARD_COUNT, order_item, timestamp
 
 ORDERS_TABLE_NAME = os.environ.get('ORDERS_TABLE_NAME')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(ORDERS_TABLE_NAME) if ORDERS_TABLE_NAME else None
+# Buckets the date and status indexes of OrdersTable are spread over.
+ORDERS_INDEX_SHARD_COUNT = max(1, int(os.environ.get('ORDERS_INDEX_SHARD_COUNT', str(DEFAULT_SHARD_COUNT))))
+# BatchWriteItem accepts at most 25 put/delete requests per call.
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_WRITE_MAX_ATTEMPTS = int(os.environ.get('BATCH_WRITE_MAX_ATTEMPTS', '5'))
+BATCH_WRITE_BASE_DELAY_SECONDS = float(os.environ.get('BATCH_WRITE_BASE_DELAY_SECONDS', '0.05'))
+BATCH_WRITE_MAX_DELAY_SECONDS = float(os.environ.get('BATCH_WRITE_MAX_DELAY_SECONDS', '2'))
+BATCH_WRITE_CONCURRENCY = max(1, int(os.environ.get('BATCH_WRITE_CONCURRENCY', '4')))
+
+IDEMPOTENCY_TABLE_NAME = os.environ.get('IDEMPOTENCY_TABLE_NAME')
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '900'))
+
+dynamodb = lazy_client('dynamodb')
+metrics = Metrics('db_update')
+logger = Logger('db_update')
+idempotency = IdempotencyStore(
+    dynamodb,
+    IDEMPOTENCY_TABLE_NAME,
+    namespace='db_update',
+    lease_seconds=IDEMPOTENCY_LEASE_SECONDS
+)
+prewarm(dynamodb)
+
+
+def _backoff_delay(attempt):
+    # Exponential backoff with full jitter.
+    return random.uniform(0, min(BATCH_WRITE_MAX_DELAY_SECONDS, BATCH_WRITE_BASE_DELAY_SECONDS * 2 ** attempt))
+
+
+def _write_chunk(items):
+    """Write up to 25 items with BatchWriteItem, retrying unprocessed items.
+
+    Returns the items that were still unprocessed after the last attempt.
+    """
+    requests = [{'PutRequest': {'Item': to_item(item)}} for item in items]
+    for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+        with metrics.timer('DynamoDBLatency'):
+            response = dynamodb.batch_write_item(RequestItems={ORDERS_TABLE_NAME: requests})
+        requests = response.get('UnprocessedItems', {}).get(ORDERS_TABLE_NAME, [])
+        if not requests:
+            return []
+        # DynamoDB leaves items unprocessed when the table or a partition is throttled.
+        metrics.put('Throttles', len(requests), COUNT)
+        if attempt < BATCH_WRITE_MAX_ATTEMPTS - 1:
+            time.sleep(_backoff_delay(attempt))
+    return [from_item(request['PutRequest']['Item']) for request in requests]
+
 
+def write_orders(items):
+    """Write ``items`` in 25-item chunks, sending chunks concurrently.
 
+    Returns the items that could not be written.
+    """
+    chunks = [items[i:i + BATCH_WRITE_MAX_ITEMS] for i in range(0, len(items), BATCH_WRITE_MAX_ITEMS)]
+    if len(chunks) <= 1:
+        return _write_chunk(chunks[0]) if chunks else []
+    # Low-level clients are thread-safe, so the chunks can share one client.
+    with ThreadPoolExecutor(max_workers=min(BATCH_WRITE_CONCURRENCY, len(chunks))) as executor:
+        return [item for unprocessed in executor.map(_write_chunk, chunks) for item in unprocessed]
+
+
+@logger.inject_context
+@metrics.instrument
 def lambda_handler(event, context):
-    if not table:
-        print("ERROR: ORDERS_TABLE_NAME environment variable not set.")
-        return {'statusCode': 500}
+    if not ORDERS_TABLE_NAME:
+        logger.error('ORDERS_TABLE_NAME environment variable not set')
+        return {
+            'statusCode': 500,
+            'batchItemFailures': [{'itemIdentifier': record.get('messageId')} for record in event.get('Records', [])]
+        }
 
-    print(f"Received event: {json.dumps(event)}")
-    for record in event.get('Records', []):
+    failed = set()
+    orders = []
+    records = event.get('Records', [])
+    parse_started = time.perf_counter()
+    for record in records:
         try:
-            sns_message_body = json.loads(record.get('body', '{}'))
-            event_str = sns_message_body.get('Message', '{}')
-            event_obj = json.loads(event_str)
-            item_to_save = {
-                'PK': f"order#{event_obj.get('order_id')}",
-                'order_id': event_obj.get("order_id"),
-                'amount_total': event_obj.get('amount_total'),
-            }
-            table.put_item(Item=item_to_save)
-            print(f"Successfully saved order {event_obj.get('order_id')}.")
+            orders.append(decode_record(record))
         except Exception as e:
-            print(f"ERROR: Failed to process SQS record: {record.get('messageId')}. Error: {e}")
-            raise e
+            logger.error('Failed to decode SQS record', message_id=record.get('messageId'), error=e)
+            failed.add(record.get('messageId'))
+    if records:
+        metrics.put('RecordParseTime', (time.perf_counter() - parse_started) * 1000 / len(records))
+    # On a FIFO queue, records behind a malformed one of their group wait for it.
+    failed = with_group_failures(records, failed)
+    orders = [order for order in orders if order.message_id not in failed]
+
+    try:
+        with metrics.timer('IdempotencyLatency'):
+            claimed, busy = idempotency.claim_many(order.idempotency_key for order in orders)
+    except Exception as e:
+        logger.error('Failed to claim orders for processing', error=e)
+        claimed, busy = set(), {order.idempotency_key for order in orders}
+
+    accepted = []
+    for order in orders:
+        message_id, key = order.message_id, order.idempotency_key
+        if key not in claimed:
+            if key in busy:
+                # Another invocation holds this order; let SQS retry it later.
+                failed.add(message_id)
+            else:
+                logger.info('Skipping duplicate order', message_id=message_id, order_id=order.order_id)
+            continue
+        # Later copies of the same order in this batch are duplicates.
+        claimed.discard(key)
+        accepted.append(order)
+    # A FIFO record must not be applied ahead of a busy one of its group.
+    failed = with_group_failures(records, failed)
+    held_back = [order.idempotency_key for order in accepted if order.message_id in failed]
+    accepted = [order for order in accepted if order.message_id not in failed]
+
+    # Orders are de-duplicated by key before writing: BatchWriteItem rejects two
+    # requests for the same key, so every record that carried an order shares
+    # the outcome of its write. On a FIFO queue the last event of an order in
+    # the batch is its latest state.
+    items_by_pk = {}
+    message_ids_by_pk = {}
+    keys_by_pk = {}
+    created_at = timestamp()
+    for order in accepted:
+        item_to_save = order_item(order.order_id, order.amount_total, order.customer_id, created_at=created_at,
+                                  shard_count=ORDERS_INDEX_SHARD_COUNT)
+        items_by_pk[item_to_save['PK']] = item_to_save
+        message_ids_by_pk.setdefault(item_to_save['PK'], []).append(order.message_id)
+        keys_by_pk.setdefault(item_to_save['PK'], []).append(order.idempotency_key)
+
+    try:
+        unprocessed = write_orders(list(items_by_pk.values()))
+    except Exception as e:
+        if is_throttling_error(e):
+            metrics.put('Throttles', 1, COUNT)
+        logger.error('Failed to save orders', error=e)
+        unprocessed = list(items_by_pk.values())
+    if unprocessed:
+        logger.error('%d order(s) were not saved', len(unprocessed),
+                     order_ids=[item['order_id'] for item in unprocessed])
+        failed |= {message_id for item in unprocessed for message_id in message_ids_by_pk[item['PK']]}
+    logger.info('Saved %d order(s)', len(items_by_pk) - len(unprocessed))
+
+    unprocessed_pks = {item['PK'] for item in unprocessed}
+    try:
+        with metrics.timer('IdempotencyLatency'):
+            idempotency.complete(key for pk, keys in keys_by_pk.items() if pk not in unprocessed_pks for key in keys)
+            idempotency.release(held_back + [key for pk in unprocessed_pks for key in keys_by_pk[pk]])
+    except Exception as e:
+        # Unreleased claims expire with their lease and the orders are retried then.
+        logger.error('Failed to record idempotency state', error=e)
+
     return {
         'statusCode': 200,
-        'body': json.dumps('DB update processing finished.')
+        'body': json.dumps('DB update processing finished.'),
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in with_group_failures(records, failed)]
     }
@@ -0,0 +1,55 @@
+import json
+import os
+
+from order_common.aws import lazy_client, prewarm
+from order_common.logger import Logger
+from order_common.metrics import COUNT, Metrics
+from order_common.outbox import EVENT_STATUSES, OUTBOX_TAG, EmailOutbox, order_id_from_tag
+
+EMAIL_OUTBOX_TABLE_NAME = os.environ.get('EMAIL_OUTBOX_TABLE_NAME')
+
+metrics = Metrics('email_events')
+logger = Logger('email_events')
+outbox = EmailOutbox(lazy_client('dynamodb'), EMAIL_OUTBOX_TABLE_NAME)
+prewarm('dynamodb')
+
+
+def record_event(ses_event):
+    """Apply one SES configuration set event to its outbox item; returns the
+    status recorded, or None if the event was ignored."""
+    event_type = ses_event.get('eventType')
+    status = EVENT_STATUSES.get(event_type)
+    if status is None:
+        # Send, Open, Click and DeliveryDelay leave the status as it is.
+        return None
+    mail = ses_event.get('mail', {})
+    tags = mail.get('tags', {}).get(OUTBOX_TAG)
+    if not tags:
+        logger.warning('Ignoring %s event without an %s tag', event_type, OUTBOX_TAG, ses_message_id=mail.get('messageId'))
+        return None
+    order_id = order_id_from_tag(tags[0])
+    with metrics.timer('OutboxLatency'):
+        recorded = outbox.record_event(order_id, status, mail.get('messageId'))
+    if not recorded:
+        logger.info('Ignoring out-of-date %s event', event_type, order_id=order_id)
+        return None
+    logger.info('Email %s', status, order_id=order_id, ses_message_id=mail.get('messageId'))
+    return status
+
+
+@logger.inject_context
+@metrics.instrument
+def lambda_handler(event, context):
+    """Record the SES events published to the email events topic. A failed
+    update raises, so SNS retries the whole notification."""
+    counts = {}
+    for record in event.get('Records', []):
+        status = record_event(json.loads(record['Sns']['Message']))
+        if status is not None:
+            counts[status] = counts.get(status, 0) + 1
+    for status in set(EVENT_STATUSES.values()):
+        metrics.put(f'Emails{status.title()}', counts.get(status, 0), COUNT)
+    return {
+        'statusCode': 200,
+        'body': json.dumps(counts)
+    }
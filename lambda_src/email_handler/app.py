@@ -1,55 +1,218 @@
 import json
 import os
-import boto3
+import time
+
+from order_common.aws import is_throttling_error, lazy_client, prewarm
+from order_common.emails import order_email_message
+from order_common.idempotency import IdempotencyStore
+from order_common.logger import Logger
+from order_common.metrics import COUNT, Metrics
+from order_common.orders import decode_record, with_group_failures
+from order_common.outbox import EmailOutbox
+from order_common.rate_limit import TokenBucket
 
 SENDER_EMAIL = os.environ.get("SENDER_EMAIL")
 RECIPIENT_EMAIL = os.environ.get("RECIPIENT_EMAIL")
+IDEMPOTENCY_TABLE_NAME = os.environ.get('IDEMPOTENCY_TABLE_NAME')
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '900'))
+# 'single' sends one SendEmail per order; 'bulk' sends each batch through the
+# SES_TEMPLATE_NAME template with SendBulkTemplatedEmail.
+EMAIL_SEND_MODE = os.environ.get('EMAIL_SEND_MODE', 'single')
+SES_TEMPLATE_NAME = os.environ.get('SES_TEMPLATE_NAME')
+# Share of the account's SES send rate this container may use, in emails/s.
+SES_SEND_RATE = float(os.environ.get('SES_SEND_RATE', '1'))
+# 'direct' sends from this handler; 'outbox' only adds each order to the
+# EMAIL_OUTBOX_TABLE_NAME table, which email_sender_handler drains at the SES
+# send rate (see order_common.outbox).
+EMAIL_DELIVERY_MODE = os.environ.get('EMAIL_DELIVERY_MODE', 'direct')
+EMAIL_OUTBOX_TABLE_NAME = os.environ.get('EMAIL_OUTBOX_TABLE_NAME')
+# SendBulkTemplatedEmail accepts at most 50 destinations per call.
+MAX_BULK_DESTINATIONS = 50
 
-ses_client = boto3.client('ses')
+ses_client = lazy_client('ses')
+metrics = Metrics('email')
+logger = Logger('email')
+idempotency = IdempotencyStore(
+    lazy_client('dynamodb'),
+    IDEMPOTENCY_TABLE_NAME,
+    namespace='email',
+    lease_seconds=IDEMPOTENCY_LEASE_SECONDS
+)
+send_rate_limiter = TokenBucket(SES_SEND_RATE)
+outbox = EmailOutbox(lazy_client('dynamodb'), EMAIL_OUTBOX_TABLE_NAME)
+prewarm('dynamodb')
+if EMAIL_DELIVERY_MODE == 'direct':
+    # Outbox delivery leaves SES to email_sender_handler.
+    prewarm(ses_client)
+
+
+def send_order_email(order_id):
+    # Gửi email qua SES
+    metrics.put('SesThrottleWait', send_rate_limiter.acquire() * 1000)
+    with metrics.timer('SesLatency'):
+        return ses_client.send_email(
+            Source=SENDER_EMAIL,
+            Destination={
+                'ToAddresses': [RECIPIENT_EMAIL]
+            },
+            Message=order_email_message(order_id)
+        )
+
+
+def send_order_emails_bulk(order_ids):
+    """Send one templated email per order with SendBulkTemplatedEmail.
+
+    Returns ``{index: error}`` for the positions in ``order_ids`` that SES did
+    not accept, so failures can be mapped back to their SQS records.
+    """
+    failures = {}
+    for start in range(0, len(order_ids), MAX_BULK_DESTINATIONS):
+        chunk = order_ids[start:start + MAX_BULK_DESTINATIONS]
+        metrics.put('SesThrottleWait', send_rate_limiter.acquire(len(chunk)) * 1000)
+        try:
+            with metrics.timer('SesLatency'):
+                response = ses_client.send_bulk_templated_email(
+                    Source=SENDER_EMAIL,
+                    Template=SES_TEMPLATE_NAME,
+                    DefaultTemplateData=json.dumps({'order_id': ''}),
+                    Destinations=[{
+                        'Destination': {'ToAddresses': [RECIPIENT_EMAIL]},
+                        'ReplacementTemplateData': json.dumps({'order_id': order_id})
+                    } for order_id in chunk]
+                )
+        except Exception as e:
+            if is_throttling_error(e):
+                metrics.put('Throttles', 1, COUNT)
+            failures.update({start + offset: str(e) for offset in range(len(chunk))})
+            continue
+        statuses = response.get('Status', [])
+        for offset in range(len(chunk)):
+            status = statuses[offset] if offset < len(statuses) else {'Status': 'Missing'}
+            if status.get('Status') != 'Success':
+                failures[start + offset] = status.get('Error') or status.get('Status')
+    return failures
 
-def lambda_handler(event, context):
-    print(f"Received event: {json.dumps(event)}")
 
-    for record in event.get('Records', []):
+def _hold_back_groups(records, batch_item_failures):
+    """Add the records a failure holds back in its FIFO message group to
+    ``batch_item_failures``; returns their message IDs."""
+    failed = {failure['itemIdentifier'] for failure in batch_item_failures}
+    held_ids = with_group_failures(records, failed) - failed
+    held = [record.get('messageId') for record in records if record.get('messageId') in held_ids]
+    batch_item_failures.extend({'itemIdentifier': message_id} for message_id in held)
+    return set(held)
+
+
+def queue_emails(orders, batch_item_failures):
+    """Add the email of each order to the outbox; the outbox skips orders it already holds."""
+    queued = 0
+    for record, order in orders:
         try:
-            sns_message_body = json.loads(record.get('body', '{}'))
-            event_str = sns_message_body.get('Message', '{}')
-            event_obj = json.loads(event_str)
-
-            order_id = event_obj.get('order_id')
-
-            print(f"Sending email for order: {order_id} to {RECIPIENT_EMAIL}")
-
-            # Gửi email qua SES
-            response = ses_client.send_email(
-                Source=SENDER_EMAIL,
-                Destination={
-                    'ToAddresses': [RECIPIENT_EMAIL]
-                },
-                Message={
-                    'Subject': {
-                        'Data': f'Order Confirmation - {order_id}',
-                        'Charset': 'UTF-8'
-                    },
-                    'Body': {
-                        'Text': {
-                            'Data': f'Your order {order_id} has been successfully processed.',
-                            'Charset': 'UTF-8'
-                        },
-                        'Html': {
-                            'Data': f'<html><body><h1>Order Confirmation</h1><p>Your order <strong>{order_id}</strong> has been successfully processed.</p></body></html>',
-                            'Charset': 'UTF-8'
-                        }
-                    }
-                }
-            )
-
-            print(f"Email sent successfully. MessageId: {response['MessageId']}")
+            with metrics.timer('OutboxLatency'):
+                added = outbox.add(order.order_id)
         except Exception as e:
-            print(f"ERROR: Failed to process SQS record: {record.get('messageId')}. Error: {e}")
-            raise e
+            logger.error('Failed to queue the email', message_id=record.get('messageId'),
+                         order_id=order.order_id, error=e)
+            batch_item_failures.append({'itemIdentifier': record.get('messageId')})
+            continue
+        if added:
+            queued += 1
+        else:
+            logger.info('Skipping duplicate order', message_id=record.get('messageId'), order_id=order.order_id)
+    metrics.put('EmailsQueued', queued, COUNT)
+
+
+def send_emails(orders, batch_item_failures):
+    """Send the email of each order now, claiming the orders first so duplicates are skipped.
+
+    Claims are by order ID on FIFO queues too: an order gets one confirmation,
+    however many events it has.
+    """
+    try:
+        with metrics.timer('IdempotencyLatency'):
+            claimed, busy = idempotency.claim_many(order.order_id for _, order in orders)
+    except Exception as e:
+        logger.error('Failed to claim orders for processing', error=e)
+        claimed, busy = set(), {order.order_id for _, order in orders}
+
+    to_send = []
+    for record, order in orders:
+        order_id = order.order_id
+        if order_id not in claimed:
+            if order_id in busy:
+                # Another invocation holds this order; let SQS retry it later.
+                batch_item_failures.append({'itemIdentifier': record.get('messageId')})
+            else:
+                logger.info('Skipping duplicate order', message_id=record.get('messageId'), order_id=order_id)
+            continue
+        # Later copies of the same order in this batch are duplicates.
+        claimed.discard(order_id)
+        to_send.append((record, order_id))
+
+    completed = []
+    released = []
+    if EMAIL_SEND_MODE == 'bulk':
+        logger.info('Sending %d templated email(s)', len(to_send), recipient=RECIPIENT_EMAIL)
+        failures = send_order_emails_bulk([order_id for _, order_id in to_send])
+        for index, (record, order_id) in enumerate(to_send):
+            if index in failures:
+                logger.error('Failed to send the email', message_id=record.get('messageId'), order_id=order_id,
+                             error=failures[index])
+                batch_item_failures.append({'itemIdentifier': record.get('messageId')})
+                released.append(order_id)
+            else:
+                completed.append(order_id)
+    else:
+        for record, order_id in to_send:
+            with logger.bind(message_id=record.get('messageId'), order_id=order_id):
+                try:
+                    logger.debug('Sending email', recipient=RECIPIENT_EMAIL)
+                    response = send_order_email(order_id)
+                    logger.info('Email sent', ses_message_id=response['MessageId'])
+                    completed.append(order_id)
+                except Exception as e:
+                    if is_throttling_error(e):
+                        metrics.put('Throttles', 1, COUNT)
+                    logger.error('Failed to send the email', error=e)
+                    batch_item_failures.append({'itemIdentifier': record.get('messageId')})
+                    released.append(order_id)
+
+    try:
+        with metrics.timer('IdempotencyLatency'):
+            idempotency.complete(completed)
+            idempotency.release(released)
+    except Exception as e:
+        # Unreleased claims expire with their lease and the orders are retried then.
+        logger.error('Failed to record idempotency state', error=e)
+
+
+@logger.inject_context
+@metrics.instrument
+def lambda_handler(event, context):
+    batch_item_failures = []
+    orders = []
+    records = event.get('Records', [])
+    parse_started = time.perf_counter()
+    for record in records:
+        try:
+            orders.append((record, decode_record(record)))
+        except Exception as e:
+            logger.error('Failed to decode SQS record', message_id=record.get('messageId'), error=e)
+            batch_item_failures.append({'itemIdentifier': record.get('messageId')})
+    if records:
+        metrics.put('RecordParseTime', (time.perf_counter() - parse_started) * 1000 / len(records))
+    # On a FIFO queue, records behind a malformed one of their group wait for it.
+    held = _hold_back_groups(records, batch_item_failures)
+    orders = [(record, order) for record, order in orders if record.get('messageId') not in held]
+
+    if EMAIL_DELIVERY_MODE == 'outbox':
+        queue_emails(orders, batch_item_failures)
+    else:
+        send_emails(orders, batch_item_failures)
 
+    _hold_back_groups(records, batch_item_failures)
     return {
         'statusCode': 200,
-        'body': json.dumps('Email processing finished.')
+        'body': json.dumps('Email processing finished.'),
+        'batchItemFailures': batch_item_failures
     }
@@ -0,0 +1,117 @@
+import json
+import os
+import time
+from collections import Counter
+
+from order_common.aws import ClientError, is_throttling_error, lazy_client, prewarm
+from order_common.emails import order_email_message
+from order_common.logger import Logger
+from order_common.metrics import COUNT, Metrics
+from order_common.outbox import OUTBOX_TAG, EmailOutbox, is_permanent_error, retry_delay, tag_value
+from order_common.rate_limit import TokenBucket
+
+SENDER_EMAIL = os.environ.get("SENDER_EMAIL")
+RECIPIENT_EMAIL = os.environ.get("RECIPIENT_EMAIL")
+EMAIL_OUTBOX_TABLE_NAME = os.environ.get('EMAIL_OUTBOX_TABLE_NAME')
+# SES configuration set whose event destination reports deliveries, bounces
+# and complaints to email_events_handler.
+SES_CONFIGURATION_SET = os.environ.get('SES_CONFIGURATION_SET')
+# The account's SES send rate, in emails/s; one sender runs at a time.
+SES_SEND_RATE = float(os.environ.get('SES_SEND_RATE', '1'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '8'))
+EMAIL_RETRY_BASE_SECONDS = float(os.environ.get('EMAIL_RETRY_BASE_SECONDS', '30'))
+# Due items read from the outbox at a time.
+DUE_BATCH_SIZE = 100
+# Time kept back before the function times out to record the last send.
+STOP_MARGIN_SECONDS = 10
+
+ses_client = lazy_client('ses')
+metrics = Metrics('email_sender')
+logger = Logger('email_sender')
+outbox = EmailOutbox(lazy_client('dynamodb'), EMAIL_OUTBOX_TABLE_NAME)
+send_rate_limiter = TokenBucket(SES_SEND_RATE)
+prewarm(ses_client, 'dynamodb')
+
+
+def send_order_email(order_id):
+    request = {
+        'Source': SENDER_EMAIL,
+        'Destination': {'ToAddresses': [RECIPIENT_EMAIL]},
+        'Message': order_email_message(order_id),
+        'Tags': [{'Name': OUTBOX_TAG, 'Value': tag_value(order_id)}],
+    }
+    if SES_CONFIGURATION_SET:
+        request['ConfigurationSetName'] = SES_CONFIGURATION_SET
+    metrics.put('SesThrottleWait', send_rate_limiter.acquire() * 1000)
+    with metrics.timer('SesLatency'):
+        return ses_client.send_email(**request)
+
+
+def deliver(item):
+    """Make one send attempt for a due outbox item.
+
+    Returns 'sent', 'retry', 'throttled', 'failed', or 'skipped' when another
+    sender claimed the item first.
+    """
+    order_id = item['order_id']
+    with metrics.timer('OutboxLatency'):
+        attempts = outbox.claim(item)
+    if attempts is None:
+        return 'skipped'
+    try:
+        response = send_order_email(order_id)
+    except Exception as e:
+        throttled = is_throttling_error(e)
+        if throttled:
+            metrics.put('Throttles', 1, COUNT)
+        with metrics.timer('OutboxLatency'):
+            if is_permanent_error(e) or attempts >= EMAIL_MAX_ATTEMPTS:
+                logger.error('Giving up on the email after %d attempt(s)', attempts, order_id=order_id, error=e)
+                outbox.mark_failed(order_id, e)
+                return 'failed'
+            logger.warning('Failed to send the email', order_id=order_id, attempt=attempts, error=e)
+            outbox.retry_after(order_id, retry_delay(attempts, EMAIL_RETRY_BASE_SECONDS), e)
+        return 'throttled' if throttled else 'retry'
+    with metrics.timer('OutboxLatency'):
+        outbox.mark_sent(order_id, response['MessageId'])
+    metrics.put('OutboxDelay', (outbox.clock() - float(item['created_at'])) * 1000)
+    return 'sent'
+
+
+@logger.inject_context
+@metrics.instrument
+def lambda_handler(event, context):
+    """Send the due outbox emails until none is left or the invocation is
+    about to time out. Runs every minute."""
+    stop_at = None
+    if context is not None:
+        stop_at = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - STOP_MARGIN_SECONDS
+    results = Counter()
+    while stop_at is None or time.monotonic() < stop_at:
+        items = outbox.due(DUE_BATCH_SIZE)
+        progress = False
+        for item in items:
+            if stop_at is not None and time.monotonic() >= stop_at:
+                break
+            try:
+                result = deliver(item)
+            except ClientError as e:
+                # The claim lease expires and the item is retried then.
+                logger.error('Failed to update the outbox', order_id=item['order_id'], error=e)
+                result = 'error'
+            results[result] += 1
+            progress = progress or result not in ('skipped', 'error')
+            if result == 'throttled':
+                # SES allows less than SES_SEND_RATE right now; pause for a second's worth of sends.
+                metrics.put('SesThrottleWait', send_rate_limiter.acquire(SES_SEND_RATE) * 1000)
+        # Nothing due, or only items the index still lists after they were handled.
+        if not progress:
+            break
+    metrics.put('EmailsSent', results['sent'], COUNT)
+    metrics.put('EmailRetries', results['retry'] + results['throttled'], COUNT)
+    metrics.put('EmailsFailed', results['failed'], COUNT)
+    logger.info('Outbox run finished', results=dict(results))
+    return {
+        'statusCode': 200,
+        'body': json.dumps(dict(results))
+    }
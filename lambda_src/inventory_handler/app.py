@@ -1,45 +1,373 @@
 import json
 import os
-import boto3
+import random
+import time
 
-ORDERS_TABLE_NAME = os.environ.get('ORDERS_TABLE_NAME')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(ORDERS_TABLE_NAME) if ORDERS_TABLE_NAME else None
+from order_common.aws import ClientError, is_throttling_error, lazy_client, prewarm
+from order_common.idempotency import IdempotencyStore
+from order_common.logger import Logger
+from order_common.metrics import COUNT, Metrics
+from order_common.orders import InvalidOrderError, decode_record, with_group_failures
 
+INVENTORY_TABLE_NAME = os.environ.get('INVENTORY_TABLE_NAME')
+INITIAL_STOCK_QUANTITY = int(os.environ.get('INITIAL_STOCK_QUANTITY', '100'))
+# Number of counter rows the inventory is spread over. A single DynamoDB item is
+# limited to ~1000 writes/s; with N shards each decrement lands on a random row.
+INVENTORY_SHARD_COUNT = max(1, int(os.environ.get('INVENTORY_SHARD_COUNT', '1')))
+# Orders without line items take one unit of this SKU, which maps to the
+# original single 'inventory' row.
+DEFAULT_SKU = os.environ.get('DEFAULT_SKU', 'default')
+# TransactWriteItems accepts at most 100 actions, BatchGetItem 100 keys.
+MAX_TRANSACTION_ITEMS = 100
+MAX_BATCH_GET_KEYS = 100
+# On a FIFO queue each order's allocation, the stock it holds, is kept next
+# to the counters under this prefix.
+ALLOCATION_PREFIX = 'order#'
 
-def lambda_handler(event, context):
-    print(f"Received event: {json.dumps(event)}")
+IDEMPOTENCY_TABLE_NAME = os.environ.get('IDEMPOTENCY_TABLE_NAME')
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '900'))
+
+dynamodb = lazy_client('dynamodb')
+metrics = Metrics('inventory')
+logger = Logger('inventory')
+idempotency = IdempotencyStore(
+    dynamodb,
+    IDEMPOTENCY_TABLE_NAME,
+    namespace='inventory',
+    lease_seconds=IDEMPOTENCY_LEASE_SECONDS
+)
+prewarm(dynamodb)
+
+
+class OutOfStockError(Exception):
+    pass
+
+
+def _shard_key(sku, shard):
+    base = 'inventory' if sku == DEFAULT_SKU else f'inventory#{sku}'
+    if INVENTORY_SHARD_COUNT == 1:
+        return base
+    return f'{base}#{shard}'
+
+
+def _shard_initial_stock(shard):
+    base, remainder = divmod(INITIAL_STOCK_QUANTITY, INVENTORY_SHARD_COUNT)
+    return base + (1 if shard < remainder else 0)
+
+
+def _decrement_params(sku, shard, quantity):
+    initial = _shard_initial_stock(shard)
+    if initial >= quantity:
+        condition = 'attribute_not_exists(stock_quantity) OR stock_quantity >= :qty'
+    else:
+        condition = 'stock_quantity >= :qty'
+    return {
+        'TableName': INVENTORY_TABLE_NAME,
+        'Key': {'PK': {'S': _shard_key(sku, shard)}},
+        'UpdateExpression': 'SET stock_quantity = if_not_exists(stock_quantity, :initial) - :qty',
+        'ConditionExpression': condition,
+        'ExpressionAttributeValues': {':initial': {'N': str(initial)}, ':qty': {'N': str(quantity)}},
+    }
+
+
+def _decrement_shard(sku, shard, quantity):
+    """Atomically take ``quantity`` from one counter row, never going below zero.
+
+    Returns the new stock of the shard, or ``None`` if it does not hold enough.
+    """
+    try:
+        with metrics.timer('DynamoDBLatency'):
+            response = dynamodb.update_item(ReturnValues='UPDATED_NEW', **_decrement_params(sku, shard, quantity))
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+        raise
+    return int(response['Attributes']['stock_quantity']['N'])
+
+
+def decrement_stock(sku=DEFAULT_SKU, quantity=1):
+    """Decrement inventory by ``quantity`` with a single conditional update.
+
+    Starts on a random shard to spread writes and falls through to the other
+    shards when the chosen one is exhausted.
+    """
+    start = random.randrange(INVENTORY_SHARD_COUNT)
+    for offset in range(INVENTORY_SHARD_COUNT):
+        shard = (start + offset) % INVENTORY_SHARD_COUNT
+        new_stock = _decrement_shard(sku, shard, quantity)
+        if new_stock is not None:
+            return shard, new_stock
+    raise OutOfStockError(f"Not enough stock of {sku} to take {quantity} item(s).")
+
+
+def get_stock_quantity(sku=DEFAULT_SKU):
+    """Total stock across all counter shards; shards never written hold their initial share."""
+    keys = [{'PK': {'S': _shard_key(sku, shard)}} for shard in range(INVENTORY_SHARD_COUNT)]
+    found = {}
+    request = {INVENTORY_TABLE_NAME: {'Keys': keys, 'ProjectionExpression': 'PK, stock_quantity'}}
+    while request:
+        with metrics.timer('DynamoDBLatency'):
+            response = dynamodb.batch_get_item(RequestItems=request)
+        for item in response.get('Responses', {}).get(INVENTORY_TABLE_NAME, []):
+            found[item['PK']['S']] = int(item.get('stock_quantity', {'N': '0'})['N'])
+        request = response.get('UnprocessedKeys')
+    return sum(found.get(_shard_key(sku, shard), _shard_initial_stock(shard))
+               for shard in range(INVENTORY_SHARD_COUNT))
+
+
+def _order_demand(order):
+    """The stock an order takes, as ``{sku: quantity}``."""
+    demand = {}
+    for item in order.items or [{}]:
+        sku = item.get('sku', DEFAULT_SKU)
+        demand[sku] = demand.get(sku, 0) + item.get('quantity', 1)
+    # One action of the order's transaction is kept for its allocation.
+    if len(demand) > MAX_TRANSACTION_ITEMS - 1:
+        raise InvalidOrderError(f"Order {order.order_id} has more than {MAX_TRANSACTION_ITEMS - 1} SKUs.")
+    return demand
+
+
+def _allocation_key(order_id):
+    return {'PK': {'S': f'{ALLOCATION_PREFIX}{order_id}'}}
+
+
+def _allocation_put(order_id, held):
+    item = dict(_allocation_key(order_id), held={'M': {sku: {'N': str(quantity)} for sku, quantity in held.items()}})
+    return {'Put': {'TableName': INVENTORY_TABLE_NAME, 'Item': item}}
 
-    for record in event.get('Records', []):
+
+def get_allocations(order_ids):
+    """The stock each order holds, ``{order_id: {sku: quantity}}``, for the
+    orders that have an allocation (see ``apply_inventory_updates``)."""
+    order_ids = list(order_ids)
+    allocations = {}
+    for i in range(0, len(order_ids), MAX_BATCH_GET_KEYS):
+        keys = [_allocation_key(order_id) for order_id in order_ids[i:i + MAX_BATCH_GET_KEYS]]
+        request = {INVENTORY_TABLE_NAME: {'Keys': keys}}
+        while request:
+            with metrics.timer('DynamoDBLatency'):
+                response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(INVENTORY_TABLE_NAME, []):
+                allocations[item['PK']['S'][len(ALLOCATION_PREFIX):]] = {
+                    sku: int(value['N']) for sku, value in item['held']['M'].items()
+                }
+            request = response.get('UnprocessedKeys')
+    return allocations
+
+
+def _decrement_skus(net, shards, puts=()):
+    """Take ``net[sku]`` from shard ``shards[sku]`` of every SKU, and write
+    ``puts``, in one write: a conditional update for a single SKU,
+    TransactWriteItems otherwise. A negative quantity is put back.
+
+    Returns False, with nothing applied, if a shard does not hold enough.
+    """
+    net = {sku: quantity for sku, quantity in net.items() if quantity}
+    if not net and not puts:
+        return True
+    if len(net) == 1 and not puts:
+        (sku, quantity), = net.items()
+        return _decrement_shard(sku, shards[sku], quantity) is not None
+    try:
+        with metrics.timer('DynamoDBLatency'):
+            dynamodb.transact_write_items(TransactItems=[
+                {'Update': _decrement_params(sku, shards[sku], quantity)} for sku, quantity in net.items()
+            ] + list(puts))
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        return False
+    return True
+
+
+def decrement_order(demand, puts=()):
+    """Take all of one order's ``{sku: quantity}`` demand, and write
+    ``puts``, in a single write, so the order is applied in full or not at all.
+
+    Like ``decrement_stock``, starts on a random shard of each SKU and moves
+    every SKU to its next shard when the write is rejected.
+    """
+    start = {sku: random.randrange(INVENTORY_SHARD_COUNT) for sku in demand}
+    for offset in range(INVENTORY_SHARD_COUNT):
+        shards = {sku: (shard + offset) % INVENTORY_SHARD_COUNT for sku, shard in start.items()}
+        if _decrement_skus(demand, shards, puts):
+            return
+    raise OutOfStockError(f"Not enough stock to take {demand}.")
+
+
+def _update_failed(error, order_ids):
+    if is_throttling_error(error):
+        metrics.put('Throttles', 1, COUNT)
+    logger.error('Inventory update failed', order_ids=order_ids, error=error)
+
+
+def _chunks(demand_by_order, allocations):
+    """Group order IDs so that each group's SKUs and allocations fit in one
+    transaction; an order is never split across groups."""
+    chunk, skus, puts = [], set(), 0
+    for order_id, demand in demand_by_order.items():
+        added = 1 if order_id in allocations else 0
+        if len(skus | demand.keys()) + puts + added > MAX_TRANSACTION_ITEMS:
+            yield chunk
+            chunk, skus, puts = [], set(), 0
+        chunk.append(order_id)
+        skus |= demand.keys()
+        puts += added
+    if chunk:
+        yield chunk
+
+
+def apply_inventory_updates(demand_by_order, allocations=None):
+    """Apply one net decrement per SKU.
+
+    ``demand_by_order`` maps an order ID to the ``{sku: quantity}`` to take
+    for it; a negative quantity is put back. ``allocations`` maps order IDs
+    to the ``{sku: quantity}`` their order holds once its demand is taken,
+    which is recorded in the same write. The orders are written in one
+    TransactWriteItems call, or in as many as keep each call within 100
+    actions; a single SKU uses a plain conditional update. If a net
+    decrement is rejected, each order of that call falls back to its own
+    single write, so only the orders that cannot be served fail and no order
+    is ever partly applied: a failed order can be retried without taking any
+    of its stock twice.
+    Returns the set of order IDs that could not be applied.
+    """
+    allocations = allocations or {}
+    failed = set()
+    for chunk in _chunks(demand_by_order, allocations):
+        net = {}
+        for order_id in chunk:
+            for sku, quantity in demand_by_order[order_id].items():
+                net[sku] = net.get(sku, 0) + quantity
+        puts = [_allocation_put(order_id, allocations[order_id]) for order_id in chunk if order_id in allocations]
         try:
-            sns_message_body = json.loads(record.get('body', '{}'))
-            event_str = sns_message_body.get('Message', '{}')
-            event_obj = json.loads(event_str)
+            if _decrement_skus(net, {sku: random.randrange(INVENTORY_SHARD_COUNT) for sku in net}, puts):
+                continue
+        except Exception as e:
+            # Nothing of this chunk was applied; earlier chunks stay applied.
+            _update_failed(e, chunk)
+            failed.update(chunk)
+            continue
+        for order_id in chunk:
+            puts = [_allocation_put(order_id, allocations[order_id])] if order_id in allocations else []
+            try:
+                decrement_order(demand_by_order[order_id], puts)
+            except Exception as e:
+                _update_failed(e, [order_id])
+                failed.add(order_id)
+    return failed
 
-            order_id = event_obj.get('order_id')
-            print(f"Processing inventory update for order: {order_id}")
 
-            response = table.get_item(Key={'PK': 'inventory'})
+def _order_updates(latest, failed):
+    """The ``(demand_by_order, allocations)`` that bring each order of
+    ``latest`` (``{order_id: (order, demand)}``) to its demand.
 
-            if 'Item' in response:
-                current_stock = response['Item'].get('stock_quantity', 100)
-            else:
-                current_stock = 100
-                print("Inventory record not found. Creating new record with stock_quantity=100")
+    An order from a standard queue is taken once, as claimed by its ID. A
+    FIFO event may be a later state of an order that already took stock, so
+    only the difference to its allocation is taken (or put back), and its
+    new demand becomes its allocation. Orders whose allocation cannot be
+    read are added to ``failed``.
+    """
+    tracked = [order_id for order_id, (order, _) in latest.items() if order.deduplication_id]
+    held = {}
+    if tracked:
+        try:
+            held = get_allocations(tracked)
+        except Exception as e:
+            _update_failed(e, tracked)
+            failed.update(tracked)
+    demand_by_order, allocations = {}, {}
+    for order_id, (order, demand) in latest.items():
+        if order_id in failed:
+            continue
+        if not order.deduplication_id:
+            demand_by_order[order_id] = demand
+            continue
+        previous = held.get(order_id, {})
+        demand_by_order[order_id] = {sku: demand.get(sku, 0) - previous.get(sku, 0)
+                                     for sku in demand.keys() | previous.keys()}
+        allocations[order_id] = demand
+    return demand_by_order, allocations
 
-            new_stock = current_stock - 1
-            print(f"Updating stock: {current_stock} -> {new_stock}")
 
-            table.put_item(Item={
-                'PK': 'inventory',
-                'stock_quantity': new_stock
-            })
-            print(f"Successfully updated inventory. New stock: {new_stock}")
+@logger.inject_context
+@metrics.instrument
+def lambda_handler(event, context):
+    failed = set()
+    orders = []
+    records = event.get('Records', [])
+    parse_started = time.perf_counter()
+    for record in records:
+        try:
+            order = decode_record(record)
+            orders.append((order, _order_demand(order)))
         except Exception as e:
-            print(f"ERROR: Failed to process SQS record: {record.get('messageId')}. Error: {e}")
-            raise e
+            logger.error('Failed to decode SQS record', message_id=record.get('messageId'), error=e)
+            failed.add(record.get('messageId'))
+    if records:
+        metrics.put('RecordParseTime', (time.perf_counter() - parse_started) * 1000 / len(records))
+    # On a FIFO queue, records behind a malformed one of their group wait for it.
+    failed = with_group_failures(records, failed)
+    orders = [(order, demand) for order, demand in orders if order.message_id not in failed]
+
+    try:
+        with metrics.timer('IdempotencyLatency'):
+            claimed, busy = idempotency.claim_many(order.idempotency_key for order, _ in orders)
+    except Exception as e:
+        logger.error('Failed to claim orders for processing', error=e)
+        claimed, busy = set(), {order.idempotency_key for order, _ in orders}
+
+    accepted = []
+    for order, demand in orders:
+        message_id, key = order.message_id, order.idempotency_key
+        if key not in claimed:
+            if key in busy:
+                # Another invocation holds this order; let SQS retry it later.
+                failed.add(message_id)
+            else:
+                logger.info('Skipping duplicate order', message_id=message_id, order_id=order.order_id)
+            continue
+        # Later copies of the same order in this batch are duplicates.
+        claimed.discard(key)
+        logger.debug('Processing inventory update', message_id=message_id, order_id=order.order_id)
+        accepted.append((order, demand))
+    # A FIFO record must not be applied ahead of a busy one of its group.
+    failed = with_group_failures(records, failed)
+    held_back = [order.idempotency_key for order, _ in accepted if order.message_id in failed]
+    accepted = [(order, demand) for order, demand in accepted if order.message_id not in failed]
+
+    # On a FIFO queue the last event of an order in the batch is its latest
+    # state; the order's records share the outcome of its update.
+    latest, message_ids_by_order, keys_by_order = {}, {}, {}
+    for order, demand in accepted:
+        latest[order.order_id] = (order, demand)
+        message_ids_by_order.setdefault(order.order_id, []).append(order.message_id)
+        keys_by_order.setdefault(order.order_id, []).append(order.idempotency_key)
+
+    failed_updates = set()
+    try:
+        demand_by_order, allocations = _order_updates(latest, failed_updates)
+        failed_updates |= apply_inventory_updates(demand_by_order, allocations)
+    except Exception as e:
+        if is_throttling_error(e):
+            metrics.put('Throttles', 1, COUNT)
+        logger.error('Failed to apply inventory updates', error=e)
+        failed_updates = set(latest)
+    failed |= {message_id for order_id in failed_updates for message_id in message_ids_by_order[order_id]}
+    logger.info('Updated inventory for %d order(s); %d record(s) failed', len(latest) - len(failed_updates),
+                len(failed))
+
+    try:
+        with metrics.timer('IdempotencyLatency'):
+            idempotency.complete(key for order_id, keys in keys_by_order.items() if order_id not in failed_updates
+                                 for key in keys)
+            idempotency.release(held_back + [key for order_id in failed_updates for key in keys_by_order[order_id]])
+    except Exception as e:
+        # Unreleased claims expire with their lease and the orders are retried then.
+        logger.error('Failed to record idempotency state', error=e)
 
     return {
         'statusCode': 200,
-        'body': json.dumps('Inventory processing finished.')
+        'body': json.dumps('Inventory processing finished.'),
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in with_group_failures(records, failed)]
     }
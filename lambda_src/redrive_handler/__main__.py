@@ -0,0 +1,45 @@
+"""Redrive a DLQ from the command line: ``python -m lambda_src.redrive_handler``.
+
+Queues are given by URL or name, e.g. the physical names of EmailQueueDLQ and
+EmailQueue from the stack's resources.
+"""
+import argparse
+import json
+import sys
+
+from order_common.aws import get_client
+from order_common.redrive import Redrive
+
+
+def _queue_url(sqs, queue):
+    if queue.startswith('https://'):
+        return queue
+    return sqs.get_queue_url(QueueName=queue)['QueueUrl']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move messages from a dead-letter queue back to its source queue.')
+    parser.add_argument('dlq', help='URL or name of the dead-letter queue')
+    parser.add_argument('source', help='URL or name of the queue to move the messages to')
+    parser.add_argument('--rate', type=float, default=50, help='messages per second')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent receivers')
+    parser.add_argument('--max-messages', type=int, help='stop after this many messages')
+    parser.add_argument('--order-id', action='append', dest='order_ids',
+                        help='only move messages for this order (repeatable)')
+    parser.add_argument('--dry-run', action='store_true', help='count the messages to move without moving them')
+    parser.add_argument('--visibility-timeout', type=int, default=300,
+                        help='seconds skipped messages stay hidden while the run lasts')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='seconds between progress lines')
+    args = parser.parse_args()
+
+    sqs = get_client('sqs')
+    redrive = Redrive(sqs, _queue_url(sqs, args.dlq), _queue_url(sqs, args.source), rate=args.rate,
+                      concurrency=args.concurrency, dry_run=args.dry_run, order_ids=args.order_ids,
+                      max_messages=args.max_messages, visibility_timeout=args.visibility_timeout,
+                      progress=lambda stats: print(json.dumps(stats), file=sys.stderr),
+                      progress_interval=args.progress_interval)
+    print(json.dumps(redrive.run(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import json
+import os
+import time
+
+from order_common.aws import lazy_client, prewarm
+from order_common.logger import Logger
+from order_common.metrics import COUNT, Metrics
+from order_common.redrive import Redrive
+
+# Queue pairs by name: {"email": {"dlq": "<url>", "source": "<url>"}, ...}
+REDRIVE_QUEUES = json.loads(os.environ.get('REDRIVE_QUEUES', '{}'))
+REDRIVE_RATE = float(os.environ.get('REDRIVE_RATE', '50'))
+REDRIVE_CONCURRENCY = int(os.environ.get('REDRIVE_CONCURRENCY', '4'))
+# Time kept back before the function times out to release skipped messages
+# and flush metrics.
+STOP_MARGIN_SECONDS = 10
+PROGRESS_METRICS = {'moved': 'RedriveMoved', 'skipped': 'RedriveSkipped', 'failed': 'RedriveFailed',
+                    'would_move': 'RedriveWouldMove'}
+
+sqs = lazy_client('sqs')
+metrics = Metrics('redrive')
+logger = Logger('redrive')
+prewarm(sqs)
+
+
+def _metrics_reporter(queue):
+    """Progress callback logging a progress line and flushing the counts
+    since the previous call as metrics."""
+    reported = {}
+
+    def report(stats):
+        for name, metric in PROGRESS_METRICS.items():
+            metrics.put(metric, stats[name] - reported.get(name, 0), COUNT)
+            reported[name] = stats[name]
+        metrics.flush()
+        logger.info('Redrive progress', queue=queue, stats=stats)
+
+    return report
+
+
+@logger.inject_context
+@metrics.instrument
+def lambda_handler(event, context):
+    """Redrive one DLQ. The event names the queue and optionally sets
+    ``dry_run``, ``order_ids``, ``max_messages`` and ``rate``."""
+    queue = event.get('queue')
+    if queue not in REDRIVE_QUEUES:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'message': f"Unknown queue {queue!r}; expected one of {sorted(REDRIVE_QUEUES)}."})
+        }
+
+    stop_at = None
+    if context is not None:
+        stop_at = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - STOP_MARGIN_SECONDS
+    report = _metrics_reporter(queue)
+    redrive = Redrive(
+        sqs,
+        REDRIVE_QUEUES[queue]['dlq'],
+        REDRIVE_QUEUES[queue]['source'],
+        rate=float(event.get('rate', REDRIVE_RATE)),
+        concurrency=REDRIVE_CONCURRENCY,
+        dry_run=bool(event.get('dry_run', False)),
+        order_ids=event.get('order_ids'),
+        max_messages=event.get('max_messages'),
+        stop_at=stop_at,
+        progress=report,
+    )
+    stats = redrive.run()
+    report(stats)
+    return {
+        'statusCode': 200,
+        'body': json.dumps(stats)
+    }
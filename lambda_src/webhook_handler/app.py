@@ -1,49 +1,357 @@
+import base64
+import hmac
 import json
 import os
-import boto3
+import threading
+import time
+
+from order_common.aws import lazy_client, prewarm
+from order_common.logger import Logger
+from order_common.metrics import COUNT, Metrics
+from order_common.orders import InvalidOrderError, OrderRecord, dumps, loads
+from order_common.stripe_signature import (
+    SIGNATURE_HEADER, ReplayCache, SignatureVerificationError, check_timestamp, parse_header, signature_matches
+)
 
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
+API_KEY_SECRET_ID = os.environ.get('API_KEY_SECRET_ID', 'API_KEY')
+SECRET_CACHE_TTL_SECONDS = float(os.environ.get('SECRET_CACHE_TTL_SECONDS', '300'))
+SECRET_REFRESH_AHEAD_SECONDS = float(os.environ.get('SECRET_REFRESH_AHEAD_SECONDS', '60'))
+SECRET_ROTATION_GRACE_SECONDS = float(os.environ.get('SECRET_ROTATION_GRACE_SECONDS', '300'))
+SECRET_MIN_REFRESH_INTERVAL_SECONDS = float(os.environ.get('SECRET_MIN_REFRESH_INTERVAL_SECONDS', '10'))
+# 'api_key' checks the api_key field of the JSON body against the secret;
+# 'stripe_signature' verifies the Stripe-Signature header over the raw body,
+# with the secret holding the endpoint's signing secret.
+WEBHOOK_AUTH_MODE = os.environ.get('WEBHOOK_AUTH_MODE', 'api_key')
+STRIPE_SIGNATURE_TOLERANCE_SECONDS = int(os.environ.get('STRIPE_SIGNATURE_TOLERANCE_SECONDS', '300'))
+REPLAY_CACHE_SIZE = int(os.environ.get('REPLAY_CACHE_SIZE', '10000'))
+# POST /webhook/batch takes {"orders": [...]} (plus api_key in 'api_key' mode).
+BATCH_RESOURCE = '/webhook/batch'
+MAX_BATCH_ORDERS = int(os.environ.get('WEBHOOK_MAX_BATCH_ORDERS', '100'))
+# SNS PublishBatch accepts at most 10 entries.
+MAX_PUBLISH_BATCH_SIZE = 10
 
-sns_client = boto3.client('sns')
-secrets_client = boto3.client('secretsmanager')
+sns_client = lazy_client('sns')
+secrets_client = lazy_client('secretsmanager')
+metrics = Metrics('webhook')
+logger = Logger('webhook')
+prewarm(sns_client, secrets_client)
 
-def lambda_handler(event, context):
-    try:
-        body = json.loads(event.get('body', '{}'))
-        order_id = body.get('order_id')
-        amount_total = body.get('amount_total')
-        api_key = body.get('api_key')
 
-        api_key_response = secrets_client.get_secret_value(SecretId="API_KEY")
+class SecretCache:
+    """Keeps a secret in memory across warm invocations.
+
+    The value is served from memory until ``ttl_seconds`` have passed. Once it is
+    within ``refresh_ahead_seconds`` of expiring, a background thread fetches a
+    fresh copy so callers never wait on Secrets Manager while the cache is warm.
+    When a refresh returns a different value (rotation), the previous value is
+    still accepted for ``grace_seconds``.
+    """
+
+    def __init__(self, fetch, ttl_seconds, refresh_ahead_seconds, grace_seconds,
+                 min_refresh_interval_seconds, clock=time.monotonic):
+        self._fetch = fetch
+        self._ttl = ttl_seconds
+        self._refresh_ahead = min(refresh_ahead_seconds, ttl_seconds)
+        self._grace = grace_seconds
+        self._min_refresh_interval = min_refresh_interval_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._value = None
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self._previous = None
+        self._previous_expires_at = 0.0
+        self._refreshing = False
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+    def get(self):
+        now = self._clock()
+        if self._value is None or now >= self._expires_at:
+            self.stats['misses'] += 1
+            return self._refresh()
+        self.stats['hits'] += 1
+        if now >= self._expires_at - self._refresh_ahead:
+            self._refresh_in_background()
+        return self._value
+
+    def matches(self, candidate):
+        """Constant-time check of ``candidate`` against the current and, during a
+        rotation grace window, the previous secret value."""
+        if not isinstance(candidate, str):
+            return False
+        encoded = candidate.encode()
+        return self.verify(lambda secret: hmac.compare_digest(encoded, secret.encode()))
+
+    def verify(self, check):
+        """True if ``check(secret)`` holds for the current secret or, during a
+        rotation grace window, the previous one."""
+        if self._verify_cached(check, self.get()):
+            return True
+        # The secret may have been rotated since we cached it; re-read it, but
+        # not more often than the minimum refresh interval.
+        if self._clock() - self._fetched_at >= self._min_refresh_interval:
+            return self._verify_cached(check, self._refresh())
+        return False
+
+    def _verify_cached(self, check, current):
+        if check(current):
+            return True
+        previous = self._previous
+        if previous is not None and self._clock() < self._previous_expires_at:
+            return check(previous)
+        return False
+
+    def _refresh(self):
+        with self._lock:
+            value = self._fetch()
+            now = self._clock()
+            if self._value is not None and value != self._value:
+                self._previous = self._value
+                self._previous_expires_at = now + self._grace
+            self._value = value
+            self._fetched_at = now
+            self._expires_at = now + self._ttl
+            self.stats['refreshes'] += 1
+            return value
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+            logger.debug('Secret cache refreshed in background', stats=self.stats)
+        except Exception as e:
+            # Keep serving the cached value; a synchronous fetch happens on expiry.
+            self.stats['refresh_errors'] += 1
+            logger.error('Background secret refresh failed', error=e)
+        finally:
+            self._refreshing = False
+
+
+def _fetch_api_key():
+    with metrics.timer('SecretsManagerLatency'):
+        return secrets_client.get_secret_value(SecretId=API_KEY_SECRET_ID)['SecretString']
+
+
+api_key_cache = SecretCache(_fetch_api_key,
+                            ttl_seconds=SECRET_CACHE_TTL_SECONDS,
+                            refresh_ahead_seconds=SECRET_REFRESH_AHEAD_SECONDS,
+                            grace_seconds=SECRET_ROTATION_GRACE_SECONDS,
+                            min_refresh_interval_seconds=SECRET_MIN_REFRESH_INTERVAL_SECONDS)
+replay_cache = ReplayCache(max_size=REPLAY_CACHE_SIZE)
+
+
+def _header(event, name):
+    headers = event.get('headers') or {}
+    value = headers.get(name)
+    if value is None:
+        # Header names are case-insensitive; HTTP/2 clients send them lower-cased.
+        lowered = name.lower()
+        for key, candidate in headers.items():
+            if key.lower() == lowered:
+                return candidate
+    return value
+
+
+def _raw_body(event):
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        return base64.b64decode(body)
+    return body.encode()
+
+
+def verify_stripe_signature(event, now=None):
+    """Authenticate a webhook by its Stripe-Signature header.
+
+    Runs before the body is decoded. Cheap checks (header shape, timestamp
+    window, replay) come first, so forged or replayed requests are turned away
+    without computing an HMAC or fetching the secret. Returns the raw body.
+    """
+    timestamp, signatures = parse_header(_header(event, SIGNATURE_HEADER))
+    now = time.time() if now is None else now
+    check_timestamp(timestamp, STRIPE_SIGNATURE_TOLERANCE_SECONDS, now)
+    if any(signature in replay_cache for signature in signatures):
+        raise SignatureVerificationError("Signature was already used.")
+    payload = _raw_body(event)
+    if not api_key_cache.verify(lambda secret: signature_matches(secret, timestamp, payload, signatures)):
+        raise SignatureVerificationError("No signature matches the payload.")
+    expires_at = timestamp + STRIPE_SIGNATURE_TOLERANCE_SECONDS
+    for signature in signatures:
+        replay_cache.add(signature, expires_at)
+    return payload
 
-        if api_key != api_key_response['SecretString']:
-            return {
-                'statusCode': 403,
-                'body': json.dumps({'message': 'Forbidden: Invalid API key.'})
-            }
 
-        if not all([order_id, amount_total]):
+def _forbidden(message):
+    metrics.put('AuthFailures', 1, COUNT)
+    return {
+        'statusCode': 403,
+        'body': json.dumps({'message': message})
+    }
+
+
+def _authenticated_body(event):
+    """Decode the body of an authenticated request; returns ``(body, None)``
+    or ``(None, response)`` for a request that is turned away."""
+    if WEBHOOK_AUTH_MODE == 'stripe_signature':
+        try:
+            payload = verify_stripe_signature(event)
+        except SignatureVerificationError as e:
+            logger.warning('Rejected webhook', error=e)
+            return None, _forbidden('Forbidden: Invalid signature.')
+        with metrics.timer('RecordParseTime'):
+            return loads(payload), None
+    with metrics.timer('RecordParseTime'):
+        body = loads(event.get('body', '{}'))
+    if not api_key_cache.matches(body.get('api_key')):
+        return None, _forbidden('Forbidden: Invalid API key.')
+    return body, None
+
+
+def order_message(order):
+    """The message published for an order in a request.
+
+    Raises ``InvalidOrderError`` if a required field is missing, or if the
+    message would not pass the consumers' ``OrderRecord`` validation or has
+    an amount_total that is not positive (as the direct ingestion model
+    requires), so a bad order is refused here instead of dead-lettered.
+    """
+    if not isinstance(order, dict) or not all([order.get('order_id'), order.get('amount_total')]):
+        raise InvalidOrderError('Missing required fields.')
+    message = {
+        'order_id': order['order_id'],
+        'amount_total': order['amount_total']
+    }
+    if order.get('customer_id'):
+        message['customer_id'] = order['customer_id']
+    OrderRecord.from_message(message)
+    if message['amount_total'] <= 0:
+        raise InvalidOrderError(f"Order {message['order_id']} has a non-positive amount_total.")
+    return message
+
+
+def publish_params(message, order):
+    """Extra Publish parameters for a FIFO topic (ARN ending in ``.fifo``).
+
+    Each order is its own message group, so messages of one order are
+    delivered in order while different orders are processed in parallel, and
+    the consumers apply them in turn (see ``OrderRecord.idempotency_key``). A
+    request that names its ``event_id`` (e.g. the Stripe event ID) uses it as
+    the deduplication ID; otherwise the topic deduplicates by content.
+    """
+    if not (SNS_TOPIC_ARN or '').endswith('.fifo'):
+        return {}
+    params = {'MessageGroupId': str(message['order_id'])}
+    event_id = order.get('event_id')
+    if isinstance(event_id, str) and event_id:
+        params['MessageDeduplicationId'] = event_id
+    return params
+
+
+def publish_batch(messages):
+    """Publish ``[(index, message, params), ...]`` with PublishBatch, 10 per
+    call; ``params`` are extra entry fields (see ``publish_params``).
+
+    Returns ``{index: error}`` for the messages SNS did not accept.
+    """
+    failures = {}
+    for start in range(0, len(messages), MAX_PUBLISH_BATCH_SIZE):
+        chunk = messages[start:start + MAX_PUBLISH_BATCH_SIZE]
+        entries = [dict(params, Id=str(index), Message=dumps(message)) for index, message, params in chunk]
+        try:
+            with metrics.timer('SnsPublishLatency'):
+                response = sns_client.publish_batch(TopicArn=SNS_TOPIC_ARN, PublishBatchRequestEntries=entries)
+        except Exception as e:
+            logger.error('Failed to publish %d order(s) to SNS', len(chunk), error=e)
+            failures.update({index: str(e) for index, _, _ in chunk})
+            continue
+        for failed in response.get('Failed', []):
+            failures[int(failed['Id'])] = failed.get('Message') or failed.get('Code')
+    return failures
+
+
+def _batch_response(body):
+    """Validate every order of a batch request, publish the valid ones and
+    report the outcome of each, in request order."""
+    orders = body.get('orders') if isinstance(body, dict) else None
+    if not isinstance(orders, list) or not orders:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'message': 'Expected a non-empty list of orders.'})
+        }
+    if len(orders) > MAX_BATCH_ORDERS:
+        return {
+            'statusCode': 413,
+            'body': json.dumps({'message': f'At most {MAX_BATCH_ORDERS} orders per request.'})
+        }
+    metrics.put('BatchSize', len(orders), COUNT)
+
+    messages, rejected = [], {}
+    for index, order in enumerate(orders):
+        try:
+            message = order_message(order)
+        except InvalidOrderError as e:
+            rejected[index] = str(e)
+            continue
+        messages.append((index, message, publish_params(message, order)))
+    failures = publish_batch(messages)
+    results = []
+    for index, order in enumerate(orders):
+        result = {'index': index, 'order_id': order.get('order_id') if isinstance(order, dict) else None}
+        if index in rejected:
+            result.update(status='rejected', error=rejected[index])
+        elif index in failures:
+            result.update(status='failed', error=failures[index])
+        else:
+            result['status'] = 'published'
+        results.append(result)
+    published = sum(1 for result in results if result['status'] == 'published')
+    logger.info('Published %d of %d order(s) from a batch request', published, len(orders))
+    return {
+        # 207 tells the caller to look at the per-order results.
+        'statusCode': 200 if published == len(orders) else 207,
+        'body': json.dumps({'published': published, 'results': results})
+    }
+
+
+@logger.inject_context
+@metrics.instrument
+def lambda_handler(event, context):
+    try:
+        body, rejected = _authenticated_body(event)
+        if rejected is not None:
+            return rejected
+        if event.get('resource') == BATCH_RESOURCE:
+            return _batch_response(body)
+
+        try:
+            message = order_message(body)
+        except InvalidOrderError as e:
             return {
                 'statusCode': 400,
-                'body': json.dumps({'message': 'Missing required fields.'})
+                'body': json.dumps({'message': str(e)})
             }
 
-        message = {
-            'order_id': order_id,
-            'amount_total': amount_total
-        }
-
-        sns_client.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Message=json.dumps({'default': json.dumps(message)}),
-            MessageStructure='json'
-        )
+        with metrics.timer('SnsPublishLatency'):
+            sns_client.publish(
+                TopicArn=SNS_TOPIC_ARN,
+                Message=dumps(message),
+                **publish_params(message, body)
+            )
         return {
             'statusCode': 200,
             'body': json.dumps({'message': 'Webhook received and published successfully.'})
         }
     except Exception as e:
-        print(f"ERROR: Failed to publish to SNS: {e}")
+        logger.error('Failed to publish to SNS', error=e)
         return {
             'statusCode': 500,
             'body': json.dumps({'message': 'Internal server error while publishing event.'})
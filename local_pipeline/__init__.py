@@ -0,0 +1,5 @@
+"""Offline emulator of the order pipeline for local testing and load tests.
+
+See ``local_pipeline.pipeline`` for the in-process pipeline and
+``python -m local_pipeline --help`` for the load generator.
+"""
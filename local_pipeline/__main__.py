@@ -0,0 +1,51 @@
+"""Run a load test against the local pipeline: ``python -m local_pipeline``."""
+import argparse
+import json
+
+from local_pipeline.load import run_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay synthetic Stripe events through the local pipeline.')
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=500, help='events per second; 0 for as fast as possible')
+    parser.add_argument('--duplicate-rate', type=float, default=0.01,
+                        help='share of events the client sends twice')
+    parser.add_argument('--sns-duplicate-rate', type=float, default=0.01,
+                        help='share of SNS deliveries made twice')
+    parser.add_argument('--initial-stock', type=int, default=1000000,
+                        help='initial stock; lower it to drive orders to the inventory DLQ')
+    parser.add_argument('--visibility-timeout', type=float, default=1.0,
+                        help='queue visibility timeout in seconds, shortened so retries finish quickly')
+    parser.add_argument('--auth-mode', choices=['api_key', 'stripe_signature'], default='api_key')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = run_load(args.events, args.rate, duplicate_rate=args.duplicate_rate,
+                      sns_duplicate_rate=args.sns_duplicate_rate, seed=args.seed,
+                      initial_stock=args.initial_stock, auth_mode=args.auth_mode,
+                      visibility_timeout=args.visibility_timeout)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"posted {report['events_posted']} events in {report['ingest_seconds']}s "
+          f"({report['ingest_rate']}/s); drained in {report['total_seconds']}s "
+          f"({report['throughput']}/s)")
+    print(f"webhook statuses: {report['webhook_statuses']}; published: {report['published']}, "
+          f"SNS duplicates: {report['sns_duplicates']}")
+    print(f"{'queue':<12}{'sent':>8}{'received':>10}{'redelivered':>13}{'deleted':>9}{'dlq':>6}")
+    for name, stats in report['queues'].items():
+        print(f"{name:<12}{stats.get('sent', 0):>8}{stats.get('received', 0):>10}"
+              f"{stats.get('redelivered', 0):>13}{stats.get('deleted', 0):>9}"
+              f"{report['dead_letter_counts'][name]:>6}")
+    print(f"emails sent: {report['emails_sent']} (duplicates: {report['duplicate_emails']}); "
+          f"orders saved: {report['orders_saved']}")
+    print(f"{'stage':<24}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+    for stage, stats in sorted(report['latency_ms'].items()):
+        print(f"{stage:<24}{stats['count']:>8}{stats['p50']:>10}{stats['p90']:>10}{stats['p99']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,643 @@
+"""In-memory stand-ins for the AWS services the handlers call.
+
+Each fake implements the subset of the low-level boto3 client API the
+handlers use, with the same request and response shapes, so it can be put in
+place of a handler's module-level client. They are thread-safe.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+
+def _client_error(code, message, operation, **extra):
+    return ClientError({'Error': {'Code': code, 'Message': message}, **extra}, operation)
+
+
+class ManualClock:
+    """Clock that only moves when told to, for deterministic visibility timeouts."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class _Message:
+    __slots__ = ('message_id', 'body', 'published_at', 'sent_at', 'receive_count', 'receipt_handle',
+                 'visible_at', 'group_id', 'deduplication_id', 'sequence_number')
+
+    def __init__(self, body, published_at, sent_at, group_id=None, deduplication_id=None, sequence_number=None):
+        self.message_id = str(uuid.uuid4())
+        self.body = body
+        self.published_at = published_at
+        self.sent_at = sent_at
+        self.receive_count = 0
+        self.receipt_handle = None
+        self.visible_at = sent_at
+        self.group_id = group_id
+        self.deduplication_id = deduplication_id
+        self.sequence_number = sequence_number
+
+
+class FakeQueue:
+    """SQS queue with visibility timeouts and a redrive policy.
+
+    A message received more than ``max_receive_count`` times is moved to
+    ``dead_letter_queue`` instead of being delivered again, as SQS does.
+
+    A ``fifo`` queue delivers each message group in order: no message of a
+    group is returned while an earlier one is in flight, so a failed message
+    holds back the rest of its group until it is deleted or dead-lettered.
+    Different groups are delivered independently.
+    """
+
+    def __init__(self, name, visibility_timeout, max_receive_count=None, dead_letter_queue=None,
+                 clock=time.monotonic, fifo=False):
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.max_receive_count = max_receive_count
+        self.dead_letter_queue = dead_letter_queue
+        self.fifo = fifo
+        self._clock = clock
+        self._messages = OrderedDict()
+        self._in_flight = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def send(self, body, published_at=None, group_id=None, deduplication_id=None):
+        if self.fifo and not group_id:
+            raise _client_error('MissingParameter', 'The request must contain the parameter MessageGroupId.',
+                                'SendMessage')
+        now = self._clock()
+        with self._lock:
+            self._sequence += 1
+            message = _Message(body, now if published_at is None else published_at, now, group_id,
+                               deduplication_id, str(self._sequence) if self.fifo else None)
+            self._messages[message.message_id] = message
+            self.stats['sent'] += 1
+        return message.message_id
+
+    def receive(self, max_messages=10, visibility_timeout=None):
+        """Return up to ``max_messages`` visible messages as Lambda SQS event
+        records and hide them for the visibility timeout (the queue's, unless
+        ``visibility_timeout`` overrides it)."""
+        now = self._clock()
+        if visibility_timeout is None:
+            visibility_timeout = self.visibility_timeout
+        records = []
+        dead = []
+        # FIFO groups that may not be delivered past this point of the queue.
+        blocked = set()
+        with self._lock:
+            for message in list(self._messages.values()):
+                if len(records) >= max_messages:
+                    break
+                if self.fifo and message.group_id in blocked:
+                    continue
+                if message.visible_at > now:
+                    blocked.add(message.group_id)
+                    continue
+                if self.max_receive_count is not None and message.receive_count >= self.max_receive_count \
+                        and self.dead_letter_queue is not None:
+                    del self._messages[message.message_id]
+                    self._in_flight.pop(message.receipt_handle, None)
+                    dead.append(message)
+                    continue
+                self._in_flight.pop(message.receipt_handle, None)
+                message.receive_count += 1
+                message.receipt_handle = str(uuid.uuid4())
+                message.visible_at = now + visibility_timeout
+                self._in_flight[message.receipt_handle] = message
+                self.stats['received'] += 1
+                if message.receive_count > 1:
+                    self.stats['redelivered'] += 1
+                attributes = {
+                    'ApproximateReceiveCount': str(message.receive_count),
+                    'SentTimestamp': str(int(message.sent_at * 1000)),
+                }
+                if self.fifo:
+                    attributes.update(MessageGroupId=message.group_id,
+                                      MessageDeduplicationId=message.deduplication_id,
+                                      SequenceNumber=message.sequence_number)
+                records.append({
+                    'messageId': message.message_id,
+                    'receiptHandle': message.receipt_handle,
+                    'body': message.body,
+                    'attributes': attributes,
+                    'eventSource': 'aws:sqs',
+                })
+            self.stats['dead_lettered'] += len(dead)
+        for message in dead:
+            self.dead_letter_queue.send(message.body, published_at=message.published_at, group_id=message.group_id,
+                                        deduplication_id=message.deduplication_id)
+        return records
+
+    def delete(self, receipt_handle):
+        """Delete a received message; returns its publish time, or None if the
+        receipt handle is stale (the message became visible again)."""
+        with self._lock:
+            message = self._in_flight.pop(receipt_handle, None)
+            if message is None:
+                return None
+            del self._messages[message.message_id]
+            self.stats['deleted'] += 1
+            return message.published_at
+
+    def change_visibility(self, receipt_handle, timeout):
+        """Make a received message visible ``timeout`` seconds from now; False
+        if the receipt handle is stale."""
+        with self._lock:
+            message = self._in_flight.get(receipt_handle)
+            if message is None:
+                return False
+            message.visible_at = self._clock() + timeout
+            if timeout == 0:
+                del self._in_flight[receipt_handle]
+            return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._messages)
+
+    def visible_count(self):
+        now = self._clock()
+        with self._lock:
+            return sum(1 for message in self._messages.values() if message.visible_at <= now)
+
+    def next_visible_at(self):
+        with self._lock:
+            return min((message.visible_at for message in self._messages.values()), default=None)
+
+
+class FakeSqs:
+    """Low-level SQS client over fake queues, keyed by queue URL.
+
+    ``WaitTimeSeconds`` is accepted but never waited on: an empty queue
+    answers at once.
+    """
+
+    def __init__(self, queues):
+        self.queues = dict(queues)
+
+    def _queue(self, url, operation):
+        if url not in self.queues:
+            raise _client_error('AWS.SimpleQueueService.NonExistentQueue', 'The specified queue does not exist.',
+                                operation)
+        return self.queues[url]
+
+    @staticmethod
+    def _check_batch(entries, operation):
+        if not 1 <= len(entries) <= 10:
+            raise _client_error('AWS.SimpleQueueService.TooManyEntriesInBatchRequest',
+                                'A batch holds 1 to 10 entries.', operation)
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, VisibilityTimeout=None, **_):
+        records = self._queue(QueueUrl, 'ReceiveMessage').receive(MaxNumberOfMessages, VisibilityTimeout)
+        if not records:
+            return {}
+        return {'Messages': [{'MessageId': record['messageId'], 'ReceiptHandle': record['receiptHandle'],
+                              'Body': record['body'], 'Attributes': record['attributes']}
+                             for record in records]}
+
+    def send_message_batch(self, QueueUrl, Entries, **_):
+        queue = self._queue(QueueUrl, 'SendMessageBatch')
+        self._check_batch(Entries, 'SendMessageBatch')
+        return {'Successful': [{'Id': entry['Id'],
+                                'MessageId': queue.send(entry['MessageBody'], group_id=entry.get('MessageGroupId'),
+                                                        deduplication_id=entry.get('MessageDeduplicationId'))}
+                               for entry in Entries],
+                'Failed': []}
+
+    def delete_message_batch(self, QueueUrl, Entries, **_):
+        queue = self._queue(QueueUrl, 'DeleteMessageBatch')
+        self._check_batch(Entries, 'DeleteMessageBatch')
+        response = {'Successful': [], 'Failed': []}
+        for entry in Entries:
+            if queue.delete(entry['ReceiptHandle']) is None:
+                response['Failed'].append({'Id': entry['Id'], 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True})
+            else:
+                response['Successful'].append({'Id': entry['Id']})
+        return response
+
+    def change_message_visibility_batch(self, QueueUrl, Entries, **_):
+        queue = self._queue(QueueUrl, 'ChangeMessageVisibilityBatch')
+        self._check_batch(Entries, 'ChangeMessageVisibilityBatch')
+        response = {'Successful': [], 'Failed': []}
+        for entry in Entries:
+            if queue.change_visibility(entry['ReceiptHandle'], entry['VisibilityTimeout']):
+                response['Successful'].append({'Id': entry['Id']})
+            else:
+                response['Failed'].append({'Id': entry['Id'], 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True})
+        return response
+
+    def get_queue_attributes(self, QueueUrl, **_):
+        queue = self._queue(QueueUrl, 'GetQueueAttributes')
+        visible = queue.visible_count()
+        return {'Attributes': {'ApproximateNumberOfMessages': str(visible),
+                               'ApproximateNumberOfMessagesNotVisible': str(len(queue) - visible)}}
+
+
+class FakeSns:
+    """SNS topic fanning out to queues.
+
+    Queues subscribed with ``raw_message_delivery`` receive the message as
+    published, the others get it inside the standard SNS envelope.
+    ``duplicate_rate`` is the share of deliveries made twice, to exercise the
+    consumers' handling of SNS's at-least-once delivery.
+
+    A topic whose ARN ends in ``.fifo`` is a FIFO topic with content-based
+    deduplication: every publish needs a ``MessageGroupId``, and a message
+    whose deduplication ID was seen in the last five minutes is accepted but
+    not delivered again. FIFO topics deliver exactly once, so
+    ``duplicate_rate`` does not apply.
+    """
+
+    DEDUPLICATION_INTERVAL_SECONDS = 300
+
+    def __init__(self, topic_arn='arn:aws:sns:local:000000000000:NewOrdersTopic', duplicate_rate=0.0,
+                 clock=time.monotonic, rng=None):
+        self.topic_arn = topic_arn
+        self.fifo = topic_arn.endswith('.fifo')
+        self.duplicate_rate = 0.0 if self.fifo else duplicate_rate
+        self.subscriptions = []
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._deduplication_ids = {}
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def subscribe(self, queue, raw_message_delivery=False):
+        self.subscriptions.append((queue, raw_message_delivery))
+
+    def _is_duplicate(self, deduplication_id, now):
+        with self._lock:
+            seen_at = self._deduplication_ids.get(deduplication_id)
+            if seen_at is not None and now - seen_at < self.DEDUPLICATION_INTERVAL_SECONDS:
+                return True
+            self._deduplication_ids[deduplication_id] = now
+            return False
+
+    def publish(self, TopicArn, Message, MessageStructure=None, MessageGroupId=None, MessageDeduplicationId=None,
+                **_):
+        if TopicArn != self.topic_arn:
+            raise _client_error('NotFound', 'Topic does not exist', 'Publish')
+        if self.fifo and not MessageGroupId:
+            raise _client_error('InvalidParameter', 'The MessageGroupId parameter is required for FIFO topics',
+                                'Publish')
+        if MessageStructure == 'json':
+            Message = json.loads(Message)['default']
+        message_id = str(uuid.uuid4())
+        now = self._clock()
+        if self.fifo:
+            MessageDeduplicationId = MessageDeduplicationId or hashlib.sha256(Message.encode()).hexdigest()
+            if self._is_duplicate(MessageDeduplicationId, now):
+                self.stats['deduplicated'] += 1
+                return {'MessageId': message_id}
+        envelope = json.dumps({'Type': 'Notification', 'MessageId': message_id, 'TopicArn': TopicArn,
+                               'Message': Message})
+        self.stats['published'] += 1
+        for queue, raw in self.subscriptions:
+            body = Message if raw else envelope
+            queue.send(body, published_at=now, group_id=MessageGroupId, deduplication_id=MessageDeduplicationId)
+            if self.duplicate_rate and self._rng.random() < self.duplicate_rate:
+                queue.send(body, published_at=now)
+                self.stats['duplicated'] += 1
+        return {'MessageId': message_id}
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries, **_):
+        if not 1 <= len(PublishBatchRequestEntries) <= 10:
+            raise _client_error('TooManyEntriesInBatchRequest', 'A batch holds 1 to 10 entries', 'PublishBatch')
+        successful = []
+        for entry in PublishBatchRequestEntries:
+            response = self.publish(TopicArn, entry['Message'], entry.get('MessageStructure'),
+                                    entry.get('MessageGroupId'), entry.get('MessageDeduplicationId'))
+            successful.append({'Id': entry['Id'], 'MessageId': response['MessageId']})
+        return {'Successful': successful, 'Failed': []}
+
+
+class FakeSecretsManager:
+
+    def __init__(self, secrets):
+        self.secrets = dict(secrets)
+
+    def get_secret_value(self, SecretId, **_):
+        if SecretId not in self.secrets:
+            raise _client_error('ResourceNotFoundException', 'Secret not found', 'GetSecretValue')
+        return {'SecretString': self.secrets[SecretId]}
+
+
+class FakeSes:
+    """Records sent emails per order ID instead of sending them.
+
+    ``throttle_rate`` is the share of SendEmail calls rejected with a
+    Throttling error, as SES does above the account's send rate.
+    """
+
+    def __init__(self, throttle_rate=0.0, rng=None):
+        self.sent = Counter()
+        self.throttle_rate = throttle_rate
+        self.stats = Counter()
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def send_email(self, Message, **_):
+        order_id = Message['Subject']['Data'].rsplit(' - ', 1)[-1]
+        with self._lock:
+            if self.throttle_rate and self._rng.random() < self.throttle_rate:
+                self.stats['throttled'] += 1
+                raise _client_error('Throttling', 'Maximum sending rate exceeded.', 'SendEmail')
+            self.sent[order_id] += 1
+        return {'MessageId': str(uuid.uuid4())}
+
+    def send_bulk_templated_email(self, Destinations, **_):
+        with self._lock:
+            for destination in Destinations:
+                self.sent[json.loads(destination['ReplacementTemplateData'])['order_id']] += 1
+        return {'Status': [{'Status': 'Success', 'MessageId': str(uuid.uuid4())} for _ in Destinations]}
+
+
+_CONDITION_TERM = re.compile(r'\s*(?:(attribute_(?:not_)?exists)\((\w+)\)|(\w+)\s*(<=|>=|<|>|=)\s*(:\w+))\s*$')
+_UPDATE = re.compile(r'\s*SET\s+(.+?)\s*(?:\bREMOVE\s+(\w+(?:\s*,\s*\w+)*))?\s*$')
+_SET_ACTION = re.compile(r'\s*(\w+)\s*=\s*(if_not_exists\((\w+),\s*(:\w+)\)|:\w+|\w+)\s*(?:([+-])\s*(:\w+|\w+))?\s*(?:,|$)')
+_ADD = re.compile(r'\s*ADD\s+((?:\w+\s+:\w+\s*,\s*)*\w+\s+:\w+)\s*$')
+_KEY_CONDITION = re.compile(r'\s*(\w+)\s*=\s*(:\w+)\s*(?:AND\s+(?:(\w+)\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)'
+                            r'|begins_with\((\w+),\s*(:\w+)\)|(\w+)\s*(<=|>=|<|>|=)\s*(:\w+)))?\s*$')
+
+
+def _number(value):
+    return Decimal(value['N'])
+
+
+def _scalar(value):
+    return _number(value) if 'N' in value else value.get('S')
+
+
+def _key(key):
+    """Storage key of an item or key: ``(PK, SK)``, with ``SK`` None on tables without one."""
+    return key['PK']['S'], key['SK']['S'] if 'SK' in key else None
+
+
+class FakeDynamoDB:
+    """DynamoDB tables keyed on ``PK`` and an optional ``SK``, storing items in
+    the wire format.
+
+    Condition and update expressions support what the handlers use:
+    ``attribute_(not_)exists(a)`` and comparisons joined by AND/OR, and
+    ``SET a = [if_not_exists(a, :x) | :x | b] [+|- :y][, ...] [REMOVE c, ...]``
+    or ``ADD a :x[, b :y]`` on numbers. ``query`` supports an equality on the partition key plus one
+    sort key comparison, BETWEEN or ``begins_with``; secondary indexes are
+    named in ``indexes`` as ``{index name: (partition attribute, sort attribute)}``.
+    ``scan`` pages through a table in key order.
+    """
+
+    def __init__(self, indexes=None):
+        self.tables = {}
+        self.indexes = dict(indexes or {})
+        self._lock = threading.RLock()
+        self.stats = Counter()
+
+    def _table(self, name):
+        return self.tables.setdefault(name, {})
+
+    def item(self, table_name, pk, sk=None):
+        """The stored item under ``(pk, sk)``, or None; for assertions."""
+        return self._table(table_name).get((pk, sk))
+
+    def _matches(self, item, condition, values):
+        if not condition:
+            return True
+        for alternative in re.split(r'\s+OR\s+', condition):
+            if all(self._term(item, term, values) for term in re.split(r'\s+AND\s+', alternative)):
+                return True
+        return False
+
+    @staticmethod
+    def _term(item, term, values):
+        match = _CONDITION_TERM.match(term)
+        if not match:
+            raise NotImplementedError(f"Unsupported condition: {term}")
+        function, function_attribute, attribute, operator, placeholder = match.groups()
+        if function:
+            exists = item is not None and function_attribute in item
+            return exists if function == 'attribute_exists' else not exists
+        if item is None or attribute not in item:
+            return False
+        current, expected = item[attribute], values[placeholder]
+        if 'N' in expected:
+            current, expected = _number(current), _number(expected)
+        else:
+            current, expected = current.get('S'), expected.get('S')
+        return {'<': current < expected, '<=': current <= expected, '>': current > expected,
+                '>=': current >= expected, '=': current == expected}[operator]
+
+    @staticmethod
+    def _updated(item, key, expression, values):
+        added = _ADD.match(expression)
+        if added:
+            item = dict(item or key)
+            for action in added.group(1).split(','):
+                attribute, placeholder = action.split()
+                total = _number(item.get(attribute, {'N': '0'})) + _number(values[placeholder])
+                item[attribute] = {'N': str(total)}
+            return item
+        match = _UPDATE.match(expression)
+        if not match:
+            raise NotImplementedError(f"Unsupported update: {expression}")
+        actions, removed = match.groups()
+        item = dict(item or key)
+
+        def operand(token, default_attribute=None, default_value=None):
+            if default_attribute:
+                return item.get(default_attribute, values[default_value])
+            return values[token] if token.startswith(':') else item[token]
+
+        updates = {}
+        position = 0
+        while position < len(actions):
+            action = _SET_ACTION.match(actions, position)
+            if not action:
+                raise NotImplementedError(f"Unsupported update: {expression}")
+            target, base, default_attribute, default_value, operator, other = action.groups()
+            value = operand(base, default_attribute, default_value)
+            if operator:
+                value = _number(value) + (_number(operand(other)) if operator == '+' else -_number(operand(other)))
+                value = {'N': str(value)}
+            updates[target] = value
+            position = action.end()
+        item.update(updates)
+        for attribute in (removed or '').split(','):
+            item.pop(attribute.strip(), None)
+        return item
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeValues=None, **_):
+        with self._lock:
+            self.stats['put_item'] += 1
+            table = self._table(TableName)
+            if not self._matches(table.get(_key(Item)), ConditionExpression, ExpressionAttributeValues or {}):
+                raise _client_error('ConditionalCheckFailedException', 'The conditional request failed', 'PutItem')
+            table[_key(Item)] = Item
+        return {}
+
+    def get_item(self, TableName, Key, **_):
+        with self._lock:
+            self.stats['get_item'] += 1
+            item = self._table(TableName).get(_key(Key))
+        return {'Item': item} if item else {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None,
+                    ExpressionAttributeValues=None, ReturnValues=None, **_):
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            self.stats['update_item'] += 1
+            table = self._table(TableName)
+            current = table.get(_key(Key))
+            if not self._matches(current, ConditionExpression, values):
+                raise _client_error('ConditionalCheckFailedException', 'The conditional request failed',
+                                    'UpdateItem')
+            item = self._updated(current, Key, UpdateExpression, values)
+            table[_key(Key)] = item
+        return {'Attributes': item} if ReturnValues else {}
+
+    def transact_write_items(self, TransactItems, **_):
+        with self._lock:
+            self.stats['transact_write_items'] += 1
+            reasons = []
+            for action in TransactItems:
+                (kind, request), = action.items()
+                key = request['Item'] if kind == 'Put' else request['Key']
+                current = self._table(request['TableName']).get(_key(key))
+                if self._matches(current, request.get('ConditionExpression'),
+                                 request.get('ExpressionAttributeValues', {})):
+                    reasons.append({'Code': 'None'})
+                    continue
+                reason = {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'}
+                if request.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and current:
+                    reason['Item'] = current
+                reasons.append(reason)
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise _client_error('TransactionCanceledException', 'Transaction cancelled',
+                                    'TransactWriteItems', CancellationReasons=reasons)
+            for action in TransactItems:
+                (kind, request), = action.items()
+                table = self._table(request['TableName'])
+                if kind == 'Put':
+                    table[_key(request['Item'])] = request['Item']
+                elif kind == 'Update':
+                    key = request['Key']
+                    table[_key(key)] = self._updated(table.get(_key(key)), key, request['UpdateExpression'],
+                                                     request.get('ExpressionAttributeValues', {}))
+                elif kind == 'Delete':
+                    table.pop(_key(request['Key']), None)
+        return {}
+
+    def batch_write_item(self, RequestItems, **_):
+        with self._lock:
+            self.stats['batch_write_item'] += 1
+            for table_name, requests in RequestItems.items():
+                table = self._table(table_name)
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        table[_key(item)] = item
+                    else:
+                        table.pop(_key(request['DeleteRequest']['Key']), None)
+        return {'UnprocessedItems': {}}
+
+    def batch_get_item(self, RequestItems, **_):
+        responses = {}
+        with self._lock:
+            self.stats['batch_get_item'] += 1
+            for table_name, request in RequestItems.items():
+                table = self._table(table_name)
+                responses[table_name] = [table[_key(key)] for key in request['Keys'] if _key(key) in table]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, IndexName=None,
+              ExclusiveStartKey=None, Limit=None, ScanIndexForward=True, **_):
+        match = _KEY_CONDITION.match(KeyConditionExpression)
+        if not match:
+            raise NotImplementedError(f"Unsupported key condition: {KeyConditionExpression}")
+        (partition_attribute, partition_value, between_attribute, low, high, prefix_attribute, prefix,
+         compare_attribute, operator, operand) = match.groups()
+        values = ExpressionAttributeValues
+        sort_attribute = self.indexes[IndexName][1] if IndexName else 'SK'
+
+        def in_range(item):
+            if between_attribute:
+                return _scalar(values[low]) <= _scalar(item[between_attribute]) <= _scalar(values[high])
+            if prefix_attribute:
+                return item[prefix_attribute]['S'].startswith(values[prefix]['S'])
+            if compare_attribute:
+                return self._term(item, f'{compare_attribute} {operator} {operand}', values)
+            return True
+
+        with self._lock:
+            self.stats['query'] += 1
+            # Items without the index keys are not in a (sparse) index.
+            items = [item for item in self._table(TableName).values()
+                     if item.get(partition_attribute) == values[partition_value]
+                     and (sort_attribute in item or not IndexName)
+                     and in_range(item)]
+        items.sort(key=lambda item: (_scalar(item[sort_attribute]) if sort_attribute in item else '', _key(item)),
+                   reverse=not ScanIndexForward)
+        if ExclusiveStartKey:
+            start = _key(ExclusiveStartKey)
+            items = items[next(i for i, item in enumerate(items) if _key(item) == start) + 1:]
+        response = {'Items': items[:Limit] if Limit else items}
+        if Limit and len(items) > Limit:
+            last = response['Items'][-1]
+            key_attributes = {'PK', 'SK', partition_attribute, sort_attribute}
+            response['LastEvaluatedKey'] = {name: value for name, value in last.items() if name in key_attributes}
+        response['Count'] = len(response['Items'])
+        return response
+
+    def scan(self, TableName, ExclusiveStartKey=None, Limit=None, **_):
+        with self._lock:
+            self.stats['scan'] += 1
+            items = sorted(self._table(TableName).values(), key=_key)
+        if ExclusiveStartKey:
+            start = _key(ExclusiveStartKey)
+            items = [item for item in items if _key(item) > start]
+        response = {'Items': items[:Limit] if Limit else items}
+        if Limit and len(items) > Limit:
+            last = response['Items'][-1]
+            response['LastEvaluatedKey'] = {name: value for name, value in last.items() if name in ('PK', 'SK')}
+        response['Count'] = len(response['Items'])
+        return response
+
+
+class LatencyRecorder:
+    """Collects latency samples (in ms) per stage and reports percentiles."""
+
+    def __init__(self, max_samples=100000):
+        self._samples = {}
+        self._max_samples = max_samples
+        self._lock = threading.Lock()
+
+    def record(self, stage, milliseconds):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self._max_samples)).append(milliseconds)
+
+    def percentiles(self, points=(50, 90, 99)):
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+        report = {}
+        for stage, values in samples.items():
+            report[stage] = {'count': len(values)}
+            for point in points:
+                index = min(len(values) - 1, int(round(point / 100 * (len(values) - 1))))
+                report[stage][f'p{point}'] = round(values[index], 3)
+        return report
@@ -0,0 +1,71 @@
+"""Load generator for the local pipeline.
+
+Posts synthetic Stripe-style orders to ``LocalPipeline`` at a target rate
+from one thread while consumer threads poll the queues, then reports
+throughput, per-stage latency percentiles, duplicate deliveries and DLQ
+counts.
+"""
+import random
+import threading
+import time
+from contextlib import nullcontext
+from unittest.mock import patch
+
+from local_pipeline.pipeline import LocalPipeline
+
+
+def synthetic_orders(count, duplicate_rate=0.0, rng=None):
+    """``count`` orders shaped like the webhook payload; a ``duplicate_rate``
+    share is followed by a resend of the same order, as a retrying client would."""
+    rng = rng or random.Random()
+    for i in range(count):
+        order = {'order_id': f'cs_local_{i}', 'amount_total': rng.randrange(100, 100000)}
+        yield order
+        if duplicate_rate and rng.random() < duplicate_rate:
+            yield order
+
+
+def _consume(pipeline, stop):
+    while True:
+        if not pipeline.pump():
+            if stop.is_set() and not pipeline.pending():
+                return
+            time.sleep(0.001)
+
+
+def run_load(events, rate, duplicate_rate=0.0, sns_duplicate_rate=0.0, seed=0, quiet=True, **pipeline_args):
+    """Replay ``events`` orders at ``rate`` per second (0 for unthrottled) and
+    return the pipeline report with throughput figures added."""
+    rng = random.Random(seed)
+    pipeline = LocalPipeline(duplicate_rate=sns_duplicate_rate, rng=rng, **pipeline_args)
+    stop = threading.Event()
+    with pipeline, patch('builtins.print') if quiet else nullcontext():
+        consumer = threading.Thread(target=_consume, args=(pipeline, stop), daemon=True)
+        started = time.perf_counter()
+        consumer.start()
+        posted = 0
+        for order in synthetic_orders(events, duplicate_rate=duplicate_rate, rng=rng):
+            if rate:
+                # Pace against the schedule so slow posts are caught up.
+                delay = started + posted / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            pipeline.post(order)
+            posted += 1
+        ingest_seconds = time.perf_counter() - started
+        stop.set()
+        consumer.join()
+        # Emails still in the outbox, with 'outbox' email delivery.
+        pipeline.drain()
+        total_seconds = time.perf_counter() - started
+
+    report = pipeline.report()
+    report.update({
+        'events_posted': posted,
+        'ingest_seconds': round(ingest_seconds, 3),
+        'total_seconds': round(total_seconds, 3),
+        'ingest_rate': round(posted / ingest_seconds, 1) if ingest_seconds else None,
+        'throughput': round(posted / total_seconds, 1) if total_seconds else None,
+    })
+    return report
+
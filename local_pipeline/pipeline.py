@@ -0,0 +1,284 @@
+"""The order pipeline wired together in process.
+
+``LocalPipeline`` runs the real handler modules against the fakes in
+``local_pipeline.fakes``: webhook_handler publishes to an in-memory SNS topic
+that fans out to the email, inventory and DB update queues, and each queue
+feeds its consumer handler the way the Lambda SQS event source does, deleting
+the records it reports as processed and leaving failures to become visible
+again. Queue settings come from ``OrderProcessingConfig``, as in the stack.
+In 'outbox' email delivery the email handler fills the outbox table and
+``drain`` runs email_sender_handler until the outbox is empty.
+
+    with LocalPipeline() as pipeline:
+        pipeline.post({'order_id': '1', 'amount_total': 100})
+        pipeline.drain()
+        print(pipeline.report())
+"""
+import json
+import threading
+import time
+from contextlib import ExitStack
+from unittest.mock import patch
+
+from lambda_src.db_update_handler import app as db_update_app
+from lambda_src.email_handler import app as email_app
+from lambda_src.email_sender_handler import app as email_sender_app
+from lambda_src.inventory_handler import app as inventory_app
+from lambda_src.webhook_handler import app as webhook_app
+from local_pipeline.fakes import (
+    FakeDynamoDB, FakeQueue, FakeSecretsManager, FakeSes, FakeSns, LatencyRecorder, ManualClock
+)
+from order_common.idempotency import IdempotencyStore
+from order_common.orders_table import INDEX_KEYS
+from order_common.outbox import INDEX_KEYS as OUTBOX_INDEX_KEYS, EmailOutbox
+from order_common.rate_limit import TokenBucket
+from order_common.stripe_signature import SIGNATURE_HEADER, compute_signature
+from order_processing_stack.config import OrderProcessingConfig
+
+# Matches the redrive policy of the consumer queues in OrderProcessingStack.
+MAX_RECEIVE_COUNT = 2
+ORDERS_TABLE_NAME = 'OrdersTable'
+INVENTORY_TABLE_NAME = 'InventoryTable'
+IDEMPOTENCY_TABLE_NAME = 'IdempotencyTable'
+EMAIL_OUTBOX_TABLE_NAME = 'EmailOutboxTable'
+TOPIC_ARN = 'arn:aws:sns:local:000000000000:NewOrdersTopic'
+FIFO_TOPIC_ARN = f'{TOPIC_ARN}.fifo'
+# Largest batch a FIFO queue event source delivers.
+FIFO_MAX_BATCH_SIZE = 10
+SECRET_ID = 'API_KEY'
+
+
+class Consumer:
+    """Polls one queue and invokes its handler, like a Lambda event source mapping."""
+
+    def __init__(self, name, handler, queue, settings, latencies, clock):
+        self.name = name
+        self.handler = handler
+        self.queue = queue
+        self.settings = settings
+        self.latencies = latencies
+        self._clock = clock
+        self.batch_size = min(settings.batch_size, FIFO_MAX_BATCH_SIZE) if queue.fifo else settings.batch_size
+        self.invocations = 0
+        self.errors = 0
+
+    def poll(self):
+        """Run one batch; returns the number of records handed to the handler."""
+        records = self.queue.receive(self.batch_size)
+        if not records:
+            return 0
+        received_at = self._clock()
+        for record in records:
+            sent_at = int(record['attributes']['SentTimestamp']) / 1000
+            self.latencies.record(f'queue_wait.{self.name}', (received_at - sent_at) * 1000)
+
+        started = time.perf_counter()
+        try:
+            response = self.handler({'Records': records}, None)
+            failed = {failure['itemIdentifier'] for failure in response.get('batchItemFailures', [])}
+        except Exception:
+            # An unhandled error fails the whole batch.
+            self.errors += 1
+            failed = {record['messageId'] for record in records}
+        self.invocations += 1
+        self.latencies.record(f'handler.{self.name}', (time.perf_counter() - started) * 1000)
+
+        deleted_at = self._clock()
+        for record in records:
+            if record['messageId'] in failed:
+                continue
+            published_at = self.queue.delete(record['receiptHandle'])
+            if published_at is not None:
+                self.latencies.record(f'end_to_end.{self.name}', (deleted_at - published_at) * 1000)
+        return len(records)
+
+
+class LocalPipeline:
+    """Context manager that points the handler modules at in-memory services.
+
+    ``clock`` drives queue visibility; with a ``ManualClock``, ``drain`` moves
+    time forward instead of sleeping while messages are invisible. The email
+    handler's SES pacing uses ``ses_send_rate`` rather than the account rate,
+    and ``visibility_timeout`` (seconds) can shorten retries in load tests.
+    ``ses_throttle_rate`` makes SES reject that share of sends as throttled.
+    """
+
+    def __init__(self, config=None, clock=None, duplicate_rate=0.0, auth_mode='api_key',
+                 secret='local-api-key', initial_stock=1000000, ses_send_rate=1000.0, visibility_timeout=None,
+                 rng=None, ses_throttle_rate=0.0):
+        self.config = config or OrderProcessingConfig()
+        self.clock = clock or time.monotonic
+        self.auth_mode = auth_mode
+        self.secret = secret
+        self.initial_stock = initial_stock
+        self.ses_send_rate = ses_send_rate
+        self.latencies = LatencyRecorder()
+        self.webhook_statuses = {}
+        self._lock = threading.Lock()
+        self._stack = None
+
+        # With config.fifo_ordering the topic and queues are FIFO, as in the stack.
+        fifo = self.config.fifo_ordering
+        self.sns = FakeSns(FIFO_TOPIC_ARN if fifo else TOPIC_ARN, duplicate_rate=duplicate_rate,
+                           clock=self.clock, rng=rng)
+        self.dynamodb = FakeDynamoDB(indexes={**INDEX_KEYS, **OUTBOX_INDEX_KEYS})
+        self.outbox = EmailOutbox(self.dynamodb, EMAIL_OUTBOX_TABLE_NAME, clock=self.clock)
+        self.ses = FakeSes(throttle_rate=ses_throttle_rate, rng=rng)
+        self.secrets = FakeSecretsManager({SECRET_ID: secret})
+        self.queues = {}
+        self.dead_letter_queues = {}
+        for name in ('email', 'inventory', 'db_update'):
+            timeout = visibility_timeout or getattr(self.config, name).visibility_timeout_seconds
+            dlq = FakeQueue(f'{name}-dlq', timeout, clock=self.clock, fifo=fifo)
+            queue = FakeQueue(name, timeout, max_receive_count=MAX_RECEIVE_COUNT,
+                              dead_letter_queue=dlq, clock=self.clock, fifo=fifo)
+            self.sns.subscribe(queue, raw_message_delivery=True)
+            self.queues[name] = queue
+            self.dead_letter_queues[name] = dlq
+        self.consumers = [
+            Consumer('email', email_app.lambda_handler, self.queues['email'], self.config.email,
+                     self.latencies, self.clock),
+            Consumer('inventory', inventory_app.lambda_handler, self.queues['inventory'], self.config.inventory,
+                     self.latencies, self.clock),
+            Consumer('db_update', db_update_app.lambda_handler, self.queues['db_update'], self.config.db_update,
+                     self.latencies, self.clock),
+        ]
+
+    def _rate_limiter(self, rate):
+        # On a ManualClock, waiting for tokens moves time forward instead of sleeping.
+        if isinstance(self.clock, ManualClock):
+            return TokenBucket(rate, clock=self.clock, sleep=self.clock.advance)
+        return TokenBucket(rate)
+
+    def _idempotency(self, namespace, settings):
+        return IdempotencyStore(self.dynamodb, IDEMPOTENCY_TABLE_NAME, namespace=namespace,
+                                lease_seconds=settings.timeout_seconds, clock=self.clock)
+
+    def __enter__(self):
+        stack = ExitStack()
+        patches = [
+            patch.multiple(webhook_app, sns_client=self.sns, secrets_client=self.secrets,
+                           SNS_TOPIC_ARN=self.sns.topic_arn, API_KEY_SECRET_ID=SECRET_ID,
+                           WEBHOOK_AUTH_MODE=self.auth_mode),
+            patch.multiple(email_app, ses_client=self.ses,
+                           idempotency=self._idempotency('email', self.config.email),
+                           send_rate_limiter=self._rate_limiter(self.ses_send_rate),
+                           EMAIL_DELIVERY_MODE=self.config.email_delivery_mode, outbox=self.outbox,
+                           EMAIL_SEND_MODE=self.config.email_send_mode,
+                           SES_TEMPLATE_NAME='OrderConfirmation'),
+            patch.multiple(email_sender_app, ses_client=self.ses, outbox=self.outbox,
+                           send_rate_limiter=self._rate_limiter(self.ses_send_rate), SES_SEND_RATE=self.ses_send_rate,
+                           EMAIL_MAX_ATTEMPTS=self.config.email_max_attempts,
+                           EMAIL_RETRY_BASE_SECONDS=self.config.email_retry_base_seconds),
+            patch.multiple(inventory_app, dynamodb=self.dynamodb, INVENTORY_TABLE_NAME=INVENTORY_TABLE_NAME,
+                           INITIAL_STOCK_QUANTITY=self.initial_stock,
+                           idempotency=self._idempotency('inventory', self.config.inventory)),
+            patch.multiple(db_update_app, dynamodb=self.dynamodb, ORDERS_TABLE_NAME=ORDERS_TABLE_NAME,
+                           idempotency=self._idempotency('db_update', self.config.db_update)),
+        ]
+        for p in patches:
+            stack.enter_context(p)
+        webhook_app.api_key_cache.clear()
+        webhook_app.replay_cache.clear()
+        self._stack = stack
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        self._stack = None
+        webhook_app.api_key_cache.clear()
+        webhook_app.replay_cache.clear()
+
+    def webhook_event(self, order):
+        """API Gateway proxy event for ``order``, authenticated for the auth mode."""
+        if self.auth_mode == 'stripe_signature':
+            body = json.dumps(order)
+            timestamp = int(time.time())
+            signature = compute_signature(self.secret, timestamp, body.encode())
+            return {'headers': {SIGNATURE_HEADER: f't={timestamp},v1={signature}'}, 'body': body}
+        return {'body': json.dumps(dict(order, api_key=self.secret))}
+
+    def post(self, order, event=None):
+        """Send one webhook through webhook_handler; returns its response."""
+        started = time.perf_counter()
+        response = webhook_app.lambda_handler(event or self.webhook_event(order), None)
+        self.latencies.record('webhook', (time.perf_counter() - started) * 1000)
+        with self._lock:
+            status = response['statusCode']
+            self.webhook_statuses[status] = self.webhook_statuses.get(status, 0) + 1
+        return response
+
+    def post_batch(self, orders):
+        """Send ``orders`` in one request to POST /webhook/batch; returns its response."""
+        event = dict(self.webhook_event({'orders': list(orders)}), resource=webhook_app.BATCH_RESOURCE)
+        return self.post(None, event)
+
+    def pump(self):
+        """Give every consumer one batch; returns the number of records delivered."""
+        return sum(consumer.poll() for consumer in self.consumers)
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def pending_emails(self):
+        """``next_attempt_at`` of each email waiting in the outbox."""
+        items = self.dynamodb.tables.get(EMAIL_OUTBOX_TABLE_NAME, {}).values()
+        return [float(item['next_attempt_at']['N']) for item in list(items) if 'due_shard' in item]
+
+    def send_emails(self):
+        """Run email_sender_handler once, as its schedule does; returns the
+        number of emails it made an attempt for."""
+        started = time.perf_counter()
+        results = json.loads(email_sender_app.lambda_handler({}, None)['body'])
+        self.latencies.record('handler.email_sender', (time.perf_counter() - started) * 1000)
+        return sum(count for result, count in results.items() if result not in ('skipped', 'error'))
+
+    def drain(self, timeout=None):
+        """Run the consumers until every queue is empty, then the email sender
+        until the outbox is.
+
+        Messages waiting out a visibility timeout, and emails waiting for a
+        retry, are handled once their time comes: a ``ManualClock`` is
+        advanced to that point, a real clock is slept on. ``timeout`` bounds
+        the real time spent.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.pending():
+                if self.pump():
+                    continue
+                waiting = [at for at in (queue.next_visible_at() for queue in self.queues.values())
+                           if at is not None]
+                if not waiting:
+                    # The last messages were just moved to their dead-letter queues.
+                    continue
+            elif self.pending_emails():
+                if self.send_emails():
+                    continue
+                waiting = self.pending_emails()
+            else:
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"{self.pending()} message(s) still queued, "
+                                   f"{len(self.pending_emails())} email(s) in the outbox")
+            wait = max(0.0, min(waiting) - self.clock())
+            if isinstance(self.clock, ManualClock):
+                self.clock.advance(wait)
+            else:
+                time.sleep(min(wait, 0.05))
+
+    def report(self):
+        emails = self.ses.sent
+        return {
+            'webhook_statuses': dict(self.webhook_statuses),
+            'published': self.sns.stats['published'],
+            'sns_duplicates': self.sns.stats['duplicated'],
+            'queues': {name: dict(queue.stats) for name, queue in self.queues.items()},
+            'dead_letter_counts': {name: len(dlq) for name, dlq in self.dead_letter_queues.items()},
+            'handler_errors': {consumer.name: consumer.errors for consumer in self.consumers},
+            'emails_sent': sum(emails.values()),
+            'duplicate_emails': sum(count - 1 for count in emails.values() if count > 1),
+            'emails_pending': len(self.pending_emails()),
+            'orders_saved': len(self.dynamodb.tables.get(ORDERS_TABLE_NAME, {})),
+            'latency_ms': self.latencies.percentiles(),
+        }
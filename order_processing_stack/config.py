@@ -0,0 +1,329 @@
+import json
+from dataclasses import dataclass, field, fields, replace
+from typing import Dict, Optional
+
+# Context key read by OrderProcessingConfig.from_context, e.g.
+#   cdk deploy -c order_processing='{"db_update": {"batch_size": 100, "max_batching_window_seconds": 2}}'
+CONTEXT_KEY = "order_processing"
+
+# AWS recommends a queue visibility timeout of at least six times the function
+# timeout so a message is not redelivered while Lambda is still retrying it.
+VISIBILITY_TIMEOUT_FACTOR = 6
+
+# Time an email handler invocation needs besides waiting for its share of the
+# SES send rate: the SES and DynamoDB calls of one batch.
+EMAIL_SEND_MARGIN_SECONDS = 5
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+# Retention periods CloudWatch Logs accepts, in days (aws_logs.RetentionDays).
+LOG_RETENTION_DAYS = (1, 3, 5, 7, 14, 30, 60, 90, 120, 150, 180, 365, 400, 545, 731, 1096, 1827, 2192, 2557,
+                      2922, 3288, 3653)
+
+# How the functions reach AWS APIs:
+#   nat       - private subnets behind a NAT gateway in a single AZ (original layout)
+#   endpoints - isolated subnets across vpc_max_azs AZs with a DynamoDB gateway
+#               endpoint and interface endpoints for the other services, no NAT;
+#               SES has no API endpoint, so the functions sending email run
+#               outside the VPC
+#   none      - no VPC; the functions reach no private resources
+VPC_MODES = ("nat", "endpoints", "none")
+
+# How POST /webhook reaches SNS:
+#   lambda - through webhook_handler, which checks the api_key field in the body
+#   direct - API Gateway validates the body against a model, requires an
+#            x-api-key header (usage plan) and publishes to SNS itself
+INGESTION_MODES = ("lambda", "direct")
+
+# How webhook_handler authenticates requests ('lambda' ingestion only):
+#   api_key          - api_key field in the JSON body compared with the secret
+#   stripe_signature - Stripe-Signature HMAC over the raw body, with the secret
+#                      holding the endpoint's signing secret
+WEBHOOK_AUTH_MODES = ("api_key", "stripe_signature")
+
+# How order confirmation emails reach SES:
+#   direct - email_handler sends them while it consumes the email queue
+#   outbox - email_handler adds them to an outbox table, and a sender run every
+#            minute sends them at ses_max_send_rate (see order_common.outbox)
+EMAIL_DELIVERY_MODES = ("direct", "outbox")
+
+# How the functions are packaged (see order_processing_stack.packaging):
+#   standard  - Python 3.9 on x86_64 with the runtime's boto3 (original layout)
+#   optimized - Python 3.12 on arm64; the common layer bundles the pinned
+#               lambda_src/common_layer/requirements.txt, trimmed to the AWS
+#               services the handlers call and precompiled, and the handlers
+#               create their clients during init. Bundling needs Docker.
+PACKAGING_MODES = ("standard", "optimized")
+ARCHITECTURES = ("x86_64", "arm64")
+# Functions that are not consumers; their memory and architecture are set in
+# OrderProcessingConfig.functions, the consumers' in their own sections.
+FUNCTION_NAMES = ("webhook", "redrive", "concurrency", "email_sender", "email_events")
+CONSUMER_NAMES = ("email", "inventory", "db_update", "aggregator")
+
+
+def _check_function_settings(memory_size, architecture):
+    if memory_size is not None and not 128 <= memory_size <= 10240:
+        raise ValueError(f"memory_size must be between 128 and 10240, got {memory_size}")
+    if architecture is not None and architecture not in ARCHITECTURES:
+        raise ValueError(f"architecture must be one of {ARCHITECTURES}, got {architecture!r}")
+
+
+@dataclass(frozen=True)
+class FunctionConfig:
+    """Memory (MB) and architecture of one function; None keeps the default
+    of the function and the packaging mode."""
+    memory_size: Optional[int] = None
+    architecture: Optional[str] = None
+
+    def __post_init__(self):
+        _check_function_settings(self.memory_size, self.architecture)
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "FunctionConfig":
+        known = {f.name for f in fields(cls)}
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"Unknown function settings: {sorted(unknown)}")
+        return cls(**values)
+
+
+@dataclass(frozen=True)
+class ConsumerConfig:
+    """Tuning knobs for one SQS-triggered handler and its queue."""
+    batch_size: int = 10
+    max_batching_window_seconds: int = 0
+    max_concurrency: Optional[int] = None
+    reserved_concurrency: Optional[int] = None
+    memory_size: int = 128
+    # x86_64 or arm64; None follows the packaging mode.
+    architecture: Optional[str] = None
+    timeout_seconds: int = 10
+    # Queue latency SLO: alarm when the oldest message is older than this, or when
+    # more than queue_depth_alarm_messages wait for three minutes in a row.
+    max_message_age_seconds: int = 300
+    queue_depth_alarm_messages: int = 1000
+    # Lowest maximum concurrency the concurrency controller may set.
+    min_concurrency: int = 2
+
+    def __post_init__(self):
+        if not 1 <= self.batch_size <= 10000:
+            raise ValueError(f"batch_size must be between 1 and 10000, got {self.batch_size}")
+        if self.batch_size > 10 and self.max_batching_window_seconds < 1:
+            raise ValueError("batch_size above 10 requires max_batching_window_seconds of at least 1")
+        if not 0 <= self.max_batching_window_seconds <= 300:
+            raise ValueError("max_batching_window_seconds must be between 0 and 300")
+        if self.max_concurrency is not None and not 2 <= self.max_concurrency <= 1000:
+            raise ValueError("max_concurrency must be between 2 and 1000")
+        if self.reserved_concurrency is not None and self.max_concurrency is not None \
+                and self.max_concurrency > self.reserved_concurrency:
+            raise ValueError("max_concurrency must not exceed reserved_concurrency")
+        _check_function_settings(self.memory_size, self.architecture)
+        if self.max_message_age_seconds < 60:
+            raise ValueError("max_message_age_seconds must be at least 60")
+        if self.queue_depth_alarm_messages < 1:
+            raise ValueError("queue_depth_alarm_messages must be at least 1")
+        if not 2 <= self.min_concurrency <= 1000:
+            raise ValueError("min_concurrency must be between 2 and 1000")
+        if self.max_concurrency is not None and self.min_concurrency > self.max_concurrency:
+            raise ValueError("min_concurrency must not exceed max_concurrency")
+
+    @property
+    def visibility_timeout_seconds(self) -> int:
+        # A batch can wait up to the batching window before the function runs.
+        return VISIBILITY_TIMEOUT_FACTOR * self.timeout_seconds + self.max_batching_window_seconds
+
+    @property
+    def concurrency_ceiling(self) -> int:
+        # The concurrency controller never goes above a configured cap.
+        ceiling = self.max_concurrency or self.reserved_concurrency or 1000
+        return max(self.min_concurrency, min(ceiling, 1000))
+
+    @classmethod
+    def from_dict(cls, values: dict, defaults: "ConsumerConfig") -> "ConsumerConfig":
+        known = {f.name for f in fields(cls)}
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"Unknown consumer settings: {sorted(unknown)}")
+        return replace(defaults, **values)
+
+
+@dataclass(frozen=True)
+class OrderProcessingConfig:
+    """Settings for OrderProcessingStack.
+
+    Email throughput is bound by SES, so it keeps small batches and a
+    concurrency cap to split the send rate over. Inventory and DB updates
+    coalesce work per batch, so they wait briefly for larger batches.
+    """
+    email: ConsumerConfig = field(default_factory=lambda: ConsumerConfig(
+        max_concurrency=2, timeout_seconds=30))
+    inventory: ConsumerConfig = field(default_factory=lambda: ConsumerConfig(
+        batch_size=50, max_batching_window_seconds=1))
+    db_update: ConsumerConfig = field(default_factory=lambda: ConsumerConfig(
+        batch_size=100, max_batching_window_seconds=2))
+    # The OrdersTable stream consumer; larger batches mean fewer writes per total.
+    # max_concurrency, the queue alarms and the concurrency controller do not
+    # apply to stream event sources.
+    aggregator: ConsumerConfig = field(default_factory=lambda: ConsumerConfig(
+        batch_size=500, max_batching_window_seconds=5))
+    # 'bulk' sends each email batch with SendBulkTemplatedEmail, 'single' one SendEmail per order.
+    email_send_mode: str = "bulk"
+    # 'direct' or 'outbox' (see EMAIL_DELIVERY_MODES); outbox delivery adds a
+    # table, a sender and an SES configuration set, so it is opt-in.
+    email_delivery_mode: str = "direct"
+    # Account-wide SES maximum send rate (emails/s); split across the email
+    # handler's maximum (or reserved) concurrency in 'direct' delivery, used by
+    # the one sender in 'outbox' delivery.
+    ses_max_send_rate: float = 1.0
+    # Outbox sends of one email before it is marked failed, and the first retry
+    # delay in seconds; each retry waits about twice as long as the one before.
+    email_max_attempts: int = 8
+    email_retry_base_seconds: int = 30
+    # Handler log level; full events are only logged at DEBUG, for this share of invocations.
+    log_level: str = "INFO"
+    event_log_sample_rate: float = 0.1
+    # Days the functions' log groups keep their logs.
+    log_retention_days: int = 30
+    # p99 alarm thresholds for downstream calls (SNS, SES, DynamoDB) and cold-start init.
+    latency_alarm_p99_ms: float = 1000.0
+    init_duration_alarm_p99_ms: float = 3000.0
+    vpc_mode: str = "nat"
+    # Number of AZs spanned in 'endpoints' mode.
+    vpc_max_azs: int = 2
+    ingestion_mode: str = "lambda"
+    webhook_auth_mode: str = "api_key"
+    # Maximum age of a signed request, in seconds; also how long replays are remembered.
+    stripe_signature_tolerance_seconds: int = 300
+    # Buckets each day's orders are spread over in the OrdersTable date and status
+    # indexes. Raise it for more than ~1000 orders/s; lowering it hides written orders.
+    orders_index_shard_count: int = 4
+    # Keep the original OrdersTable (orders and stock counters under a PK-only
+    # key) next to OrdersTableV2 and InventoryTable until it has been backfilled
+    # with ``python -m lambda_src.backfill_orders``. The table is retained, not
+    # deleted, when this is turned off.
+    legacy_orders_table: bool = True
+    # Deploy the upgrade with the inventory queue's event source disabled, so
+    # no stock is sold from InventoryTable before the backfill has copied the
+    # original counters into it; orders wait in the queue. Turn it off after
+    # the backfill.
+    inventory_backfill_pending: bool = False
+    # Defaults of the DLQ redrive function: messages/s sent back and concurrent receivers.
+    redrive_rate_per_second: float = 50.0
+    redrive_concurrency: int = 4
+    # FIFO topic and queues with one message group per order: messages of an
+    # order are delivered in order, different orders in parallel. The DB update
+    # and inventory consumers apply every event of an order in turn (they are
+    # idempotent per deduplication ID), so its latest state is the one kept; the
+    # email consumer still sends one confirmation per order.
+    # FIFO event sources take at most 10 records per batch and no batching window.
+    fifo_ordering: bool = False
+    # Adjust the SQS consumers' maximum concurrency every minute from queue depth,
+    # message age and downstream throttling (see order_common.concurrency).
+    concurrency_control: bool = True
+    packaging_mode: str = "standard"
+    # Memory and architecture per function in FUNCTION_NAMES, e.g.
+    #   {"webhook": {"memory_size": 512, "architecture": "arm64"}}
+    functions: Dict[str, FunctionConfig] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.email_send_mode not in ("bulk", "single"):
+            raise ValueError(f"email_send_mode must be 'bulk' or 'single', got {self.email_send_mode!r}")
+        if self.email_delivery_mode not in EMAIL_DELIVERY_MODES:
+            raise ValueError(f"email_delivery_mode must be one of {EMAIL_DELIVERY_MODES}, "
+                             f"got {self.email_delivery_mode!r}")
+        if self.ses_max_send_rate <= 0:
+            raise ValueError("ses_max_send_rate must be positive")
+        if self.email_delivery_mode == "direct":
+            self._check_email_send_rate()
+        if self.email_max_attempts < 1:
+            raise ValueError("email_max_attempts must be at least 1")
+        if self.email_retry_base_seconds < 1:
+            raise ValueError("email_retry_base_seconds must be at least 1")
+        if self.log_level not in LOG_LEVELS:
+            raise ValueError(f"log_level must be one of {LOG_LEVELS}, got {self.log_level!r}")
+        if not 0 <= self.event_log_sample_rate <= 1:
+            raise ValueError("event_log_sample_rate must be between 0 and 1")
+        if self.log_retention_days not in LOG_RETENTION_DAYS:
+            raise ValueError(f"log_retention_days must be one of {LOG_RETENTION_DAYS}, "
+                             f"got {self.log_retention_days!r}")
+        if self.latency_alarm_p99_ms <= 0 or self.init_duration_alarm_p99_ms <= 0:
+            raise ValueError("alarm thresholds must be positive")
+        if self.vpc_mode not in VPC_MODES:
+            raise ValueError(f"vpc_mode must be one of {VPC_MODES}, got {self.vpc_mode!r}")
+        if self.vpc_max_azs < 1:
+            raise ValueError("vpc_max_azs must be at least 1")
+        if self.ingestion_mode not in INGESTION_MODES:
+            raise ValueError(f"ingestion_mode must be one of {INGESTION_MODES}, got {self.ingestion_mode!r}")
+        if self.webhook_auth_mode not in WEBHOOK_AUTH_MODES:
+            raise ValueError(f"webhook_auth_mode must be one of {WEBHOOK_AUTH_MODES}, "
+                             f"got {self.webhook_auth_mode!r}")
+        if self.stripe_signature_tolerance_seconds <= 0:
+            raise ValueError("stripe_signature_tolerance_seconds must be positive")
+        if self.orders_index_shard_count < 1:
+            raise ValueError("orders_index_shard_count must be at least 1")
+        if self.redrive_rate_per_second <= 0:
+            raise ValueError("redrive_rate_per_second must be positive")
+        if self.redrive_concurrency < 1:
+            raise ValueError("redrive_concurrency must be at least 1")
+        if self.packaging_mode not in PACKAGING_MODES:
+            raise ValueError(f"packaging_mode must be one of {PACKAGING_MODES}, got {self.packaging_mode!r}")
+        unknown = set(self.functions) - set(FUNCTION_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown functions {sorted(unknown)}; expected some of {FUNCTION_NAMES} "
+                             f"(consumers are set in their own sections)")
+
+    def function_config(self, name: str) -> FunctionConfig:
+        """Memory and architecture of function ``name``, from its consumer
+        section or ``functions``; the architecture defaults to the packaging
+        mode's."""
+        if name in CONSUMER_NAMES:
+            consumer = getattr(self, name)
+            settings = FunctionConfig(consumer.memory_size, consumer.architecture)
+        else:
+            settings = self.functions.get(name, FunctionConfig())
+        if settings.architecture is None:
+            default = "arm64" if self.packaging_mode == "optimized" else "x86_64"
+            settings = replace(settings, architecture=default)
+        return settings
+
+    def _check_email_send_rate(self):
+        # Each email handler instance sends at its share of the SES rate, so a
+        # batch may wait batch_size / share seconds for it before sending.
+        if self.email.max_concurrency is None and self.email.reserved_concurrency is None:
+            raise ValueError("direct email delivery splits ses_max_send_rate across instances; "
+                             "set email.max_concurrency or email.reserved_concurrency")
+        wait = self.email.batch_size / self.ses_send_rate_per_instance
+        if wait + EMAIL_SEND_MARGIN_SECONDS > self.email.timeout_seconds:
+            raise ValueError(f"email.timeout_seconds must be at least {wait + EMAIL_SEND_MARGIN_SECONDS:g}: "
+                             f"a batch of {self.email.batch_size} can wait {wait:g}s for its share of "
+                             f"ses_max_send_rate; lower email.batch_size or email.max_concurrency")
+
+    @property
+    def ses_send_rate_per_instance(self) -> float:
+        instances = self.email.max_concurrency or self.email.reserved_concurrency
+        return self.ses_max_send_rate / instances
+
+    @classmethod
+    def from_context(cls, context) -> "OrderProcessingConfig":
+        """Build a config from the ``order_processing`` CDK context value.
+
+        Missing settings keep their defaults; consumer sections are merged key by key.
+        """
+        if isinstance(context, str):
+            # Values passed with ``cdk -c`` arrive as strings.
+            context = json.loads(context)
+        context = context or {}
+        defaults = cls()
+        known = {f.name for f in fields(cls)}
+        unknown = set(context) - known
+        if unknown:
+            raise ValueError(f"Unknown settings in '{CONTEXT_KEY}' context: {sorted(unknown)}")
+        values = {}
+        for name, value in context.items():
+            default = getattr(defaults, name)
+            if isinstance(default, ConsumerConfig):
+                value = ConsumerConfig.from_dict(value, default)
+            elif name == "functions":
+                value = {function: FunctionConfig.from_dict(settings) for function, settings in value.items()}
+            values[name] = value
+        return replace(defaults, **values)
@@ -1,3 +1,6 @@
+import json
+from typing import Dict, Optional, Tuple
+
 from aws_cdk import (
     Stack,
     Duration,
@@ -12,6 +15,9 @@ from aws_cdk import (
     aws_dynamodb as dynamodb,
     aws_secretsmanager as secretsmanager,
     aws_cloudwatch as cloudwatch,
+    aws_logs as logs,
+    aws_events as events,
+    aws_events_targets as events_targets,
     aws_lambda_event_sources,
     CfnParameter,
     aws_ses as ses,
@@ -19,11 +25,69 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+from order_processing_stack.config import CONTEXT_KEY, LOG_RETENTION_DAYS, ConsumerConfig, OrderProcessingConfig
+from order_processing_stack.packaging import ARCHITECTURES, RUNTIMES, common_layer_code
+
+# CloudWatch namespace of the handlers' EMF metrics (see order_common.metrics).
+METRICS_NAMESPACE = "OrderProcessing"
+# config.log_retention_days -> RetentionDays; both list the periods shortest first.
+LOG_RETENTION = dict(zip(LOG_RETENTION_DAYS, [days for days in logs.RetentionDays
+                                              if days != logs.RetentionDays.INFINITE]))
+# Downstream call latencies each handler reports, keyed by its Service dimension.
+DOWNSTREAM_LATENCY_METRICS = {
+    "webhook": ["SnsPublishLatency", "SecretsManagerLatency"],
+    "email": ["SesLatency", "IdempotencyLatency", "OutboxLatency"],
+    "email_sender": ["SesLatency", "OutboxLatency"],
+    "email_events": ["OutboxLatency"],
+    "inventory": ["DynamoDBLatency", "IdempotencyLatency"],
+    "db_update": ["DynamoDBLatency", "IdempotencyLatency"],
+    "aggregator": ["DynamoDBLatency"],
+}
+# The concurrency controller scales a consumer up once its oldest message is
+# this share of max_message_age_seconds old, ahead of the SLO alarm.
+CONCURRENCY_TARGET_AGE_FRACTION = 0.5
+# Retries of a failed OrdersTable stream batch before it goes to the aggregator DLQ.
+AGGREGATOR_RETRY_ATTEMPTS = 10
+# Global secondary indexes of OrdersTable as {name: (partition key, sort key)};
+# must match INDEX_KEYS in order_common.orders_table.
+ORDERS_TABLE_INDEXES = {
+    "ByDate": ("GSI1PK", "created_at"),
+    "ByCustomer": ("GSI2PK", "created_at"),
+    "ByStatus": ("GSI3PK", "created_at"),
+}
+# Index of the email outbox table the sender reads due emails from, as
+# {name: (partition key, sort key)}; must match INDEX_KEYS in order_common.outbox.
+EMAIL_OUTBOX_INDEXES = {
+    "ByDueTime": ("due_shard", "next_attempt_at"),
+}
+# Largest batch a FIFO queue event source accepts.
+FIFO_MAX_BATCH_SIZE = 10
+# Interface endpoints created in the 'endpoints' VPC mode; DynamoDB uses a gateway
+# endpoint. The SES endpoint service only serves SMTP, not the SES API the email
+# functions call, so they run outside the VPC in that mode (see _ses_network).
+INTERFACE_ENDPOINT_SERVICES = {
+    "SnsEndpoint": ec2.InterfaceVpcEndpointAwsService.SNS,
+    "SqsEndpoint": ec2.InterfaceVpcEndpointAwsService.SQS,
+    "SecretsManagerEndpoint": ec2.InterfaceVpcEndpointAwsService.SECRETS_MANAGER,
+}
+# Interface endpoints the concurrency controller needs in the 'endpoints' VPC mode.
+CONCURRENCY_CONTROL_ENDPOINT_SERVICES = {
+    "CloudWatchEndpoint": ec2.InterfaceVpcEndpointAwsService.CLOUDWATCH_MONITORING,
+    "LambdaEndpoint": ec2.InterfaceVpcEndpointAwsService.LAMBDA_,
+}
+
 
 class OrderProcessingStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str,
+                 config: Optional[OrderProcessingConfig] = None, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
+        # Common layers by architecture, created for the first function that needs one.
+        self._common_layers: Dict[str, _lambda.LayerVersion] = {}
+
+        # Per-consumer tuning; an explicit config wins over the CDK context.
+        if config is None:
+            config = OrderProcessingConfig.from_context(self.node.try_get_context(CONTEXT_KEY))
 
         # CloudFormation Parameters
         email_sender_param = CfnParameter(self, "EmailSender",
@@ -41,100 +105,154 @@ class OrderProcessingStack(Stack):
                                            description="The value for the API_KEY secret."
                                            )
 
-        # VPC with public and private subnets + NAT Gateway
-        vpc = ec2.Vpc(self, "OrderProcessingVpc",
-                      max_azs=1,
-                      nat_gateways=1,
-                      subnet_configuration=[
-                          ec2.SubnetConfiguration(
-                              name="public-subnet",
-                              subnet_type=ec2.SubnetType.PUBLIC,
-                              cidr_mask=24
-                          ),
-                          ec2.SubnetConfiguration(
-                              name="private-subnet",
-                              subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS,
-                              cidr_mask=24
-                          ),
-                      ]
-                      )
+        vpc, vpc_subnets = self._network(config)
 
-        # DynamoDB Table
-        orders_table = dynamodb.Table(self, "OrdersTable",
+        # Orders, one item per order (see order_common.orders_table), with indexes
+        # for reporting by day, customer and status. A new construct ID: changing
+        # the key schema of the original OrdersTable would replace it.
+        orders_table = dynamodb.Table(self, "OrdersTableV2",
                                       partition_key=dynamodb.Attribute(name="PK",
                                                                        type=dynamodb.AttributeType.STRING),
+                                      sort_key=dynamodb.Attribute(name="SK", type=dynamodb.AttributeType.STRING),
                                       billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                                      stream=dynamodb.StreamViewType.NEW_IMAGE,
                                       removal_policy=RemovalPolicy.DESTROY
                                       )
+        for index_name, (partition_key, sort_key) in ORDERS_TABLE_INDEXES.items():
+            orders_table.add_global_secondary_index(
+                index_name=index_name,
+                partition_key=dynamodb.Attribute(name=partition_key, type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(name=sort_key, type=dynamodb.AttributeType.STRING),
+            )
+
+        # Stock counters, one row per SKU shard
+        inventory_table = dynamodb.Table(self, "InventoryTable",
+                                         partition_key=dynamodb.Attribute(name="PK",
+                                                                          type=dynamodb.AttributeType.STRING),
+                                         billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                                         removal_policy=RemovalPolicy.DESTROY
+                                         )
+
+        if config.legacy_orders_table:
+            # The original table (PK only), holding orders and stock counters from
+            # before OrdersTableV2 and InventoryTable; kept with its schema so it is
+            # not replaced, until order_common.migration has copied it over.
+            dynamodb.Table(self, "OrdersTable",
+                           partition_key=dynamodb.Attribute(name="PK", type=dynamodb.AttributeType.STRING),
+                           billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                           removal_policy=RemovalPolicy.RETAIN
+                           )
+
+        # Running order totals per minute, hour and day (see order_common.aggregates),
+        # plus the aggregator's batch markers, expired by DynamoDB TTL
+        aggregates_table = dynamodb.Table(self, "OrderAggregatesTable",
+                                          partition_key=dynamodb.Attribute(name="PK",
+                                                                           type=dynamodb.AttributeType.STRING),
+                                          billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                                          time_to_live_attribute="expires_at",
+                                          removal_policy=RemovalPolicy.DESTROY
+                                          )
+
+        # Idempotency records for the SQS consumers, expired by DynamoDB TTL
+        idempotency_table = dynamodb.Table(self, "IdempotencyTable",
+                                           partition_key=dynamodb.Attribute(name="PK",
+                                                                            type=dynamodb.AttributeType.STRING),
+                                           billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                                           time_to_live_attribute="expires_at",
+                                           removal_policy=RemovalPolicy.DESTROY
+                                           )
 
         # SNS Topic and SQS Queues (Fan-out pattern)
+        # In FIFO mode webhook_handler publishes each order as its own message
+        # group; the topic deduplicates by content unless an event_id is given.
+        fifo_topic_props = {"fifo": True, "content_based_deduplication": True} if config.fifo_ordering else {}
         order_events_topic = sns.Topic(self, "NewOrdersTopic",
-                                       display_name="New Order Events Topic"
+                                       display_name="New Order Events Topic",
+                                       **fifo_topic_props
                                        )
 
-        email_queue_dlq = sqs.Queue(self, "EmailQueueDLQ")
+        # FIFO queues deduplicate and limit throughput per message group (order),
+        # so they scale with the number of orders in flight.
+        fifo_queue_props = {
+            "fifo": True,
+            "deduplication_scope": sqs.DeduplicationScope.MESSAGE_GROUP,
+            "fifo_throughput_limit": sqs.FifoThroughputLimit.PER_MESSAGE_GROUP_ID,
+        } if config.fifo_ordering else {}
+
+        email_queue_dlq = sqs.Queue(self, "EmailQueueDLQ", **fifo_queue_props)
         email_queue = sqs.Queue(self, "EmailQueue",
-                                visibility_timeout=Duration.seconds(60),
+                                visibility_timeout=Duration.seconds(config.email.visibility_timeout_seconds),
                                 dead_letter_queue=sqs.DeadLetterQueue(
                                     max_receive_count=2,
                                     queue=email_queue_dlq
-                                )
+                                ),
+                                **fifo_queue_props
                                 )
 
-        inventory_queue_dlq = sqs.Queue(self, "InventoryQueueDLQ")
+        inventory_queue_dlq = sqs.Queue(self, "InventoryQueueDLQ", **fifo_queue_props)
         inventory_queue = sqs.Queue(self, "InventoryQueue",
-                                    visibility_timeout=Duration.seconds(60),
+                                    visibility_timeout=Duration.seconds(config.inventory.visibility_timeout_seconds),
                                     dead_letter_queue=sqs.DeadLetterQueue(
                                         max_receive_count=2,
                                         queue=inventory_queue_dlq
-                                    )
+                                    ),
+                                    **fifo_queue_props
                                     )
 
-        db_update_queue_dlq = sqs.Queue(self, "DbUpdateQueueDLQ")
+        db_update_queue_dlq = sqs.Queue(self, "DbUpdateQueueDLQ", **fifo_queue_props)
         db_update_queue = sqs.Queue(self, "DbUpdateQueue",
-                                    visibility_timeout=Duration.seconds(60),
+                                    visibility_timeout=Duration.seconds(config.db_update.visibility_timeout_seconds),
                                     dead_letter_queue=sqs.DeadLetterQueue(
                                         max_receive_count=2,
                                         queue=db_update_queue_dlq
-                                    )
+                                    ),
+                                    **fifo_queue_props
                                     )
 
-        order_events_topic.add_subscription(subs.SqsSubscription(email_queue))
-        order_events_topic.add_subscription(subs.SqsSubscription(inventory_queue))
-        order_events_topic.add_subscription(subs.SqsSubscription(db_update_queue))
+        # Raw delivery puts the order JSON itself in the SQS body instead of the
+        # SNS envelope, so consumers parse each message once.
+        order_events_topic.add_subscription(subs.SqsSubscription(email_queue, raw_message_delivery=True))
+        order_events_topic.add_subscription(subs.SqsSubscription(inventory_queue, raw_message_delivery=True))
+        order_events_topic.add_subscription(subs.SqsSubscription(db_update_queue, raw_message_delivery=True))
 
-        # Secrets Manager for API Key
-        api_key_secret = secretsmanager.Secret(self, "ApiKeySecret",
-                                               secret_name="API_KEY",
-                                               secret_string_value=SecretValue.unsafe_plain_text(
-                                                   api_key_value_param.value_as_string),
-                                               description="API key for authenticating incoming webhooks"
-                                               )
+        # In 'direct' ingestion mode API Gateway publishes to SNS itself and there
+        # is no webhook Lambda.
+        webhook_handler_lambda = None
+        if config.ingestion_mode == "lambda":
+            # Secrets Manager for API Key
+            api_key_secret = secretsmanager.Secret(self, "ApiKeySecret",
+                                                   secret_name="API_KEY",
+                                                   secret_string_value=SecretValue.unsafe_plain_text(
+                                                       api_key_value_param.value_as_string),
+                                                   description="API key or Stripe signing secret for "
+                                                               "authenticating incoming webhooks"
+                                                   )
 
-        # Create Webhook Handler Lambda
-        webhook_handler_role = iam.Role(self, "WebhookHandlerRole",
-                                        assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
-                                        managed_policies=[
-                                            iam.ManagedPolicy.from_aws_managed_policy_name(
-                                                "service-role/AWSLambdaBasicExecutionRole"),
-                                            iam.ManagedPolicy.from_aws_managed_policy_name(
-                                                "service-role/AWSLambdaVPCAccessExecutionRole")
-                                        ]
-                                        )
-        api_key_secret.grant_read(webhook_handler_role)
-        order_events_topic.grant_publish(webhook_handler_role)
-        webhook_handler_lambda = _lambda.Function(self, "WebhookHandlerLambda",
-                                                  runtime=_lambda.Runtime.PYTHON_3_9,
-                                                  code=_lambda.Code.from_asset("lambda_src/webhook_handler"),
-                                                  handler="app.lambda_handler",
-                                                  vpc=vpc,
-                                                  vpc_subnets=ec2.SubnetSelection(
-                                                      subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
-                                                  role=webhook_handler_role,
-                                                  environment={
-                                                      "SNS_TOPIC_ARN": order_events_topic.topic_arn
-                                                  }
-                                                  )
+            # Create Webhook Handler Lambda
+            webhook_handler_role = iam.Role(self, "WebhookHandlerRole",
+                                            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                                            managed_policies=[
+                                                iam.ManagedPolicy.from_aws_managed_policy_name(
+                                                    "service-role/AWSLambdaBasicExecutionRole"),
+                                                iam.ManagedPolicy.from_aws_managed_policy_name(
+                                                    "service-role/AWSLambdaVPCAccessExecutionRole")
+                                            ]
+                                            )
+            api_key_secret.grant_read(webhook_handler_role)
+            order_events_topic.grant_publish(webhook_handler_role)
+            webhook_handler_lambda = self._handler_function("WebhookHandlerLambda", "webhook", config,
+                                                            vpc=vpc,
+                                                            vpc_subnets=vpc_subnets,
+                                                            role=webhook_handler_role,
+                                                            environment={
+                                                                "SNS_TOPIC_ARN": order_events_topic.topic_arn,
+                                                                "API_KEY_SECRET_ID": api_key_secret.secret_name,
+                                                                "SECRET_CACHE_TTL_SECONDS": "300",
+                                                                "WEBHOOK_AUTH_MODE": config.webhook_auth_mode,
+                                                                "STRIPE_SIGNATURE_TOLERANCE_SECONDS": str(
+                                                                    config.stripe_signature_tolerance_seconds)
+                                                            }
+                                                            )
 
         # Create Email Handler Lambda
         email_handler_role = iam.Role(self, "EmailHandlerRole", assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
@@ -143,12 +261,25 @@ class OrderProcessingStack(Stack):
                                           iam.ManagedPolicy.from_aws_managed_policy_name(
                                               "service-role/AWSLambdaVPCAccessExecutionRole")])
         email_queue.grant_consume_messages(email_handler_role)
+        idempotency_table.grant_read_write_data(email_handler_role)
 
         email_handler_role.add_to_policy(iam.PolicyStatement(
-            actions=["ses:SendEmail", "ses:SendRawEmail"],
+            actions=["ses:SendEmail", "ses:SendRawEmail", "ses:SendBulkTemplatedEmail"],
             resources=["*"]
         ))
 
+        # Order confirmation template used by bulk sending
+        order_confirmation_template = ses.CfnTemplate(self, "OrderConfirmationTemplate",
+                                                      template=ses.CfnTemplate.TemplateProperty(
+                                                          template_name=f"{self.stack_name}-OrderConfirmation",
+                                                          subject_part="Order Confirmation - {{order_id}}",
+                                                          text_part="Your order {{order_id}} has been successfully processed.",
+                                                          html_part="<html><body><h1>Order Confirmation</h1><p>Your order "
+                                                                    "<strong>{{order_id}}</strong> has been successfully "
+                                                                    "processed.</p></body></html>"
+                                                      )
+                                                      )
+
         # Verify email identities in SES Sandbox
         sender_email_identity = ses.EmailIdentity(self, "SenderEmailIdentity",
                                                   identity=ses.Identity.email(email_sender_param.value_as_string)
@@ -158,20 +289,31 @@ class OrderProcessingStack(Stack):
                                                      identity=ses.Identity.email(email_recipient_param.value_as_string)
                                                      )
 
-        email_handler_lambda = _lambda.Function(self, "EmailHandlerLambda",
-                                                runtime=_lambda.Runtime.PYTHON_3_9,
-                                                code=_lambda.Code.from_asset("lambda_src/email_handler"),
-                                                handler="app.lambda_handler",
-                                                vpc=vpc,
-                                                vpc_subnets=ec2.SubnetSelection(
-                                                    subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
-                                                role=email_handler_role,
-                                                environment={
-                                                    "SENDER_EMAIL": email_sender_param.value_as_string,
-                                                    "RECIPIENT_EMAIL": email_recipient_param.value_as_string
-                                                }
-                                                )
-        email_handler_lambda.add_event_source(aws_lambda_event_sources.SqsEventSource(email_queue))
+        ses_vpc, ses_vpc_subnets = self._ses_network(config, vpc, vpc_subnets)
+        email_handler_lambda = self._handler_function("EmailHandlerLambda", "email", config,
+                                                      timeout=Duration.seconds(config.email.timeout_seconds),
+                                                      reserved_concurrent_executions=config.email.reserved_concurrency,
+                                                      vpc=ses_vpc,
+                                                      vpc_subnets=ses_vpc_subnets,
+                                                      role=email_handler_role,
+                                                      environment={
+                                                          "SENDER_EMAIL": email_sender_param.value_as_string,
+                                                          "RECIPIENT_EMAIL": email_recipient_param.value_as_string,
+                                                          "IDEMPOTENCY_TABLE_NAME": idempotency_table.table_name,
+                                                          "IDEMPOTENCY_LEASE_SECONDS": str(config.email.timeout_seconds),
+                                                          "EMAIL_DELIVERY_MODE": config.email_delivery_mode,
+                                                          "EMAIL_SEND_MODE": config.email_send_mode,
+                                                          "SES_TEMPLATE_NAME": order_confirmation_template.ref,
+                                                          "SES_SEND_RATE": str(config.ses_send_rate_per_instance)
+                                                      }
+                                                      )
+        email_event_source = self._sqs_event_source(email_queue, config.email)
+        email_handler_lambda.add_event_source(email_event_source)
+        email_outbox_functions = {}
+        if config.email_delivery_mode == "outbox":
+            email_outbox_functions = self._email_outbox(email_handler_lambda, email_sender_param.value_as_string,
+                                                        email_recipient_param.value_as_string, vpc, vpc_subnets,
+                                                        config)
 
         # Create Inventory Handler Lambda
         inventory_handler_role = iam.Role(self, "InventoryHandlerRole",
@@ -181,21 +323,25 @@ class OrderProcessingStack(Stack):
                                               iam.ManagedPolicy.from_aws_managed_policy_name(
                                                   "service-role/AWSLambdaVPCAccessExecutionRole")])
         inventory_queue.grant_consume_messages(inventory_handler_role)
-        orders_table.grant_read_write_data(inventory_handler_role)
-
-        inventory_handler_lambda = _lambda.Function(self, "InventoryHandlerLambda",
-                                                    runtime=_lambda.Runtime.PYTHON_3_9,
-                                                    code=_lambda.Code.from_asset("lambda_src/inventory_handler"),
-                                                    handler="app.lambda_handler",
-                                                    vpc=vpc,
-                                                    vpc_subnets=ec2.SubnetSelection(
-                                                        subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
-                                                    role=inventory_handler_role,
-                                                    environment={
-                                                        "ORDERS_TABLE_NAME": orders_table.table_name
-                                                    }
-                                                    )
-        inventory_handler_lambda.add_event_source(aws_lambda_event_sources.SqsEventSource(inventory_queue))
+        inventory_table.grant_read_write_data(inventory_handler_role)
+        idempotency_table.grant_read_write_data(inventory_handler_role)
+
+        inventory_handler_lambda = self._handler_function("InventoryHandlerLambda", "inventory", config,
+                                                          timeout=Duration.seconds(config.inventory.timeout_seconds),
+                                                          reserved_concurrent_executions=config.inventory.reserved_concurrency,
+                                                          vpc=vpc,
+                                                          vpc_subnets=vpc_subnets,
+                                                          role=inventory_handler_role,
+                                                          environment={
+                                                              "INVENTORY_TABLE_NAME": inventory_table.table_name,
+                                                              "INVENTORY_SHARD_COUNT": "1",
+                                                              "IDEMPOTENCY_TABLE_NAME": idempotency_table.table_name,
+                                                              "IDEMPOTENCY_LEASE_SECONDS": str(config.inventory.timeout_seconds)
+                                                          }
+                                                          )
+        inventory_event_source = self._sqs_event_source(inventory_queue, config.inventory,
+                                                        enabled=not config.inventory_backfill_pending)
+        inventory_handler_lambda.add_event_source(inventory_event_source)
 
         # Create DB Update Handler Lambda
         db_update_handler_role = iam.Role(self, "DbUpdateHandlerRole",
@@ -206,32 +352,113 @@ class OrderProcessingStack(Stack):
                                                   "service-role/AWSLambdaVPCAccessExecutionRole")])
         db_update_queue.grant_consume_messages(db_update_handler_role)
         orders_table.grant_write_data(db_update_handler_role)
+        idempotency_table.grant_read_write_data(db_update_handler_role)
+
+        db_update_handler_lambda = self._handler_function("DbUpdateHandlerLambda", "db_update", config,
+                                                          timeout=Duration.seconds(config.db_update.timeout_seconds),
+                                                          reserved_concurrent_executions=config.db_update.reserved_concurrency,
+                                                          vpc=vpc,
+                                                          vpc_subnets=vpc_subnets,
+                                                          role=db_update_handler_role,
+                                                          environment={
+                                                              "ORDERS_TABLE_NAME": orders_table.table_name,
+                                                              "ORDERS_INDEX_SHARD_COUNT": str(
+                                                                  config.orders_index_shard_count),
+                                                              "IDEMPOTENCY_TABLE_NAME": idempotency_table.table_name,
+                                                              "IDEMPOTENCY_LEASE_SECONDS": str(config.db_update.timeout_seconds)
+                                                          }
+                                                          )
+        db_update_event_source = self._sqs_event_source(db_update_queue, config.db_update)
+        db_update_handler_lambda.add_event_source(db_update_event_source)
+
+        # Create Aggregator Lambda, fed by the OrdersTable stream
+        aggregator_handler_role = iam.Role(self, "AggregatorHandlerRole",
+                                           assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                                           managed_policies=[iam.ManagedPolicy.from_aws_managed_policy_name(
+                                               "service-role/AWSLambdaBasicExecutionRole"),
+                                               iam.ManagedPolicy.from_aws_managed_policy_name(
+                                                   "service-role/AWSLambdaVPCAccessExecutionRole")])
+        aggregates_table.grant_read_write_data(aggregator_handler_role)
+        aggregator_dlq = sqs.Queue(self, "AggregatorDLQ")
 
-        db_update_handler_lambda = _lambda.Function(self, "DbUpdateHandlerLambda",
-                                                    runtime=_lambda.Runtime.PYTHON_3_9,
-                                                    code=_lambda.Code.from_asset("lambda_src/db_update_handler"),
-                                                    handler="app.lambda_handler",
-                                                    vpc=vpc,
-                                                    vpc_subnets=ec2.SubnetSelection(
-                                                        subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
-                                                    role=db_update_handler_role,
-                                                    environment={
-                                                        "ORDERS_TABLE_NAME": orders_table.table_name
-                                                    }
-                                                    )
-        db_update_handler_lambda.add_event_source(aws_lambda_event_sources.SqsEventSource(db_update_queue))
+        aggregator_handler_lambda = self._handler_function("AggregatorHandlerLambda", "aggregator", config,
+                                                           timeout=Duration.seconds(config.aggregator.timeout_seconds),
+                                                           reserved_concurrent_executions=config.aggregator.reserved_concurrency,
+                                                           vpc=vpc,
+                                                           vpc_subnets=vpc_subnets,
+                                                           role=aggregator_handler_role,
+                                                           environment={
+                                                               "AGGREGATES_TABLE_NAME": aggregates_table.table_name
+                                                           }
+                                                           )
+        # Only new orders count; updates and the table's other items are filtered
+        # out before the function is invoked.
+        aggregator_handler_lambda.add_event_source(aws_lambda_event_sources.DynamoEventSource(
+            orders_table,
+            starting_position=_lambda.StartingPosition.TRIM_HORIZON,
+            batch_size=config.aggregator.batch_size,
+            max_batching_window=Duration.seconds(config.aggregator.max_batching_window_seconds)
+            if config.aggregator.max_batching_window_seconds else None,
+            retry_attempts=AGGREGATOR_RETRY_ATTEMPTS,
+            on_failure=aws_lambda_event_sources.SqsDlq(aggregator_dlq),
+            filters=[_lambda.FilterCriteria.filter({
+                "eventName": _lambda.FilterRule.is_equal("INSERT"),
+                "dynamodb": {"NewImage": {"SK": {"S": _lambda.FilterRule.is_equal("order")}}},
+            })]
+        ))
+
+        # Create DLQ Redrive Lambda, invoked by hand with {"queue": "email", ...}
+        # (see order_common.redrive)
+        redrive_queues = {
+            "email": (email_queue_dlq, email_queue),
+            "inventory": (inventory_queue_dlq, inventory_queue),
+            "db_update": (db_update_queue_dlq, db_update_queue),
+        }
+        redrive_handler_role = iam.Role(self, "RedriveHandlerRole",
+                                        assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                                        managed_policies=[iam.ManagedPolicy.from_aws_managed_policy_name(
+                                            "service-role/AWSLambdaBasicExecutionRole"),
+                                            iam.ManagedPolicy.from_aws_managed_policy_name(
+                                                "service-role/AWSLambdaVPCAccessExecutionRole")])
+        for dlq, source in redrive_queues.values():
+            dlq.grant_consume_messages(redrive_handler_role)
+            source.grant_send_messages(redrive_handler_role)
+
+        self._handler_function("RedriveHandlerLambda", "redrive", config,
+                               default_memory_size=256,
+                               timeout=Duration.minutes(15),
+                               vpc=vpc,
+                               vpc_subnets=vpc_subnets,
+                               role=redrive_handler_role,
+                               environment={
+                                   "REDRIVE_QUEUES": self.to_json_string({
+                                       name: {"dlq": dlq.queue_url, "source": source.queue_url}
+                                       for name, (dlq, source) in redrive_queues.items()
+                                   }),
+                                   "REDRIVE_RATE": str(config.redrive_rate_per_second),
+                                   "REDRIVE_CONCURRENCY": str(config.redrive_concurrency),
+                                   "METRICS_NAMESPACE": METRICS_NAMESPACE,
+                                   "LOG_LEVEL": config.log_level,
+                               }
+                               )
 
         # Create API Gateway for webhook
-        api = apigw.LambdaRestApi(self, "StripeWebhookApi",
-                                  handler=webhook_handler_lambda,
-                                  proxy=False,
-                                  default_cors_preflight_options=apigw.CorsOptions(
-                                      allow_origins=apigw.Cors.ALL_ORIGINS,
-                                      allow_methods=apigw.Cors.ALL_METHODS
-                                  )
-                                  )
-        webhook_resource = api.root.add_resource("webhook")
-        webhook_resource.add_method("POST")
+        if webhook_handler_lambda is not None:
+            api = apigw.LambdaRestApi(self, "StripeWebhookApi",
+                                      handler=webhook_handler_lambda,
+                                      proxy=False,
+                                      default_cors_preflight_options=apigw.CorsOptions(
+                                          allow_origins=apigw.Cors.ALL_ORIGINS,
+                                          allow_methods=apigw.Cors.ALL_METHODS
+                                      )
+                                      )
+            webhook_resource = api.root.add_resource("webhook")
+            webhook_resource.add_method("POST")
+            # Up to WEBHOOK_MAX_BATCH_ORDERS orders per request, published 10 per PublishBatch
+            webhook_resource.add_resource("batch").add_method("POST")
+        else:
+            api = self._direct_webhook_api(order_events_topic, api_key_value_param.value_as_string,
+                                           config.fifo_ordering)
 
         # Add CloudWatch Alarms for DLQs
         dlq_email_alarm = cloudwatch.Alarm(self, "EmailDLQAlarm",
@@ -260,3 +487,484 @@ class OrderProcessingStack(Stack):
                                                alarm_description="Alarm if there are messages in the Inventory DLQ",
                                                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
                                                )
+
+        dlq_aggregator_alarm = cloudwatch.Alarm(self, "AggregatorDLQAlarm",
+                                                metric=aggregator_dlq.metric("ApproximateNumberOfMessagesVisible"),
+                                                threshold=0,
+                                                evaluation_periods=1,
+                                                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                                                alarm_description="Alarm if OrdersTable stream batches failed aggregation",
+                                                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+                                                )
+
+        # Latency SLO alarms on the consumer queues, and the controller that
+        # adjusts the consumers' concurrency to their backlog
+        consumers = {
+            "email": (email_queue, email_event_source, config.email),
+            "inventory": (inventory_queue, inventory_event_source, config.inventory),
+            "db_update": (db_update_queue, db_update_event_source, config.db_update),
+        }
+        for service, (queue, _, consumer) in consumers.items():
+            alarm_prefix = "".join(part.title() for part in service.split("_"))
+            cloudwatch.Alarm(self, f"{alarm_prefix}QueueAgeAlarm",
+                             metric=queue.metric_approximate_age_of_oldest_message(
+                                 statistic="Maximum", period=Duration.minutes(1)),
+                             threshold=consumer.max_message_age_seconds,
+                             evaluation_periods=1,
+                             comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                             alarm_description=f"Oldest message in the {service} queue is older than its SLO",
+                             treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+                             )
+            cloudwatch.Alarm(self, f"{alarm_prefix}QueueDepthAlarm",
+                             metric=queue.metric_approximate_number_of_messages_visible(
+                                 statistic="Maximum", period=Duration.minutes(1)),
+                             threshold=consumer.queue_depth_alarm_messages,
+                             evaluation_periods=3,
+                             comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                             alarm_description=f"Messages are backing up in the {service} queue",
+                             treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+                             )
+        if config.concurrency_control:
+            self._concurrency_controller(consumers, vpc, vpc_subnets, config)
+
+        handler_functions = {
+            "email": email_handler_lambda,
+            "inventory": inventory_handler_lambda,
+            "db_update": db_update_handler_lambda,
+            "aggregator": aggregator_handler_lambda,
+        }
+        handler_functions.update(email_outbox_functions)
+        if webhook_handler_lambda is not None:
+            handler_functions["webhook"] = webhook_handler_lambda
+        self._add_handler_observability(handler_functions, config)
+
+    def _add_handler_observability(self, functions: Dict[str, _lambda.Function],
+                                   config: OrderProcessingConfig) -> None:
+        """Configure the handlers' EMF metrics and logging, and add a dashboard and
+        p99 alarms on cold starts and downstream latency per handler."""
+        dashboard = cloudwatch.Dashboard(self, "OrderProcessingDashboard",
+                                         dashboard_name=f"{self.stack_name}-handlers")
+        for service, function in functions.items():
+            function.add_environment("METRICS_NAMESPACE", METRICS_NAMESPACE)
+            function.add_environment("LOG_LEVEL", config.log_level)
+            function.add_environment("EVENT_LOG_SAMPLE_RATE", str(config.event_log_sample_rate))
+
+            title = service.replace("_", " ").title()
+            init_duration = self._handler_metric(service, "InitDuration", "p99")
+            latencies = [self._handler_metric(service, name, "p99")
+                         for name in DOWNSTREAM_LATENCY_METRICS[service]]
+            dashboard.add_widgets(
+                cloudwatch.GraphWidget(title=f"{title}: cold starts",
+                                       left=[self._handler_metric(service, "ColdStart", "Sum")],
+                                       right=[init_duration]),
+                cloudwatch.GraphWidget(title=f"{title}: downstream latency p99 (ms)",
+                                       left=latencies),
+                cloudwatch.GraphWidget(title=f"{title}: batch size and parse time",
+                                       left=[self._handler_metric(service, "BatchSize", "Average"),
+                                             self._handler_metric(service, "BatchSize", "Maximum")],
+                                       right=[self._handler_metric(service, "RecordParseTime", "p99")]),
+            )
+
+            alarm_prefix = "".join(part.title() for part in service.split("_"))
+            cloudwatch.Alarm(self, f"{alarm_prefix}InitDurationP99Alarm",
+                             metric=init_duration,
+                             threshold=config.init_duration_alarm_p99_ms,
+                             evaluation_periods=3,
+                             comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                             alarm_description=f"p99 init duration of the {service} handler is too high",
+                             treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+                             )
+            for metric_name, metric in zip(DOWNSTREAM_LATENCY_METRICS[service], latencies):
+                cloudwatch.Alarm(self, f"{alarm_prefix}{metric_name}P99Alarm",
+                                 metric=metric,
+                                 threshold=config.latency_alarm_p99_ms,
+                                 evaluation_periods=3,
+                                 comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                                 alarm_description=f"p99 {metric_name} of the {service} handler is too high",
+                                 treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+                                 )
+
+    def _email_outbox(self, email_handler: _lambda.Function, sender_email: str, recipient_email: str,
+                      vpc: Optional[ec2.Vpc], vpc_subnets: Optional[ec2.SubnetSelection],
+                      config: OrderProcessingConfig) -> Dict[str, _lambda.Function]:
+        """Outbox email delivery (see order_common.outbox): ``email_handler``
+        adds emails to an outbox table, a sender run every minute sends them at
+        the SES send rate, and an events handler records the deliveries, bounces
+        and complaints SES reports through a configuration set.
+
+        Returns the two new functions keyed by their metrics Service name.
+        """
+        outbox_table = dynamodb.Table(self, "EmailOutboxTable",
+                                      partition_key=dynamodb.Attribute(name="PK",
+                                                                       type=dynamodb.AttributeType.STRING),
+                                      billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                                      time_to_live_attribute="expires_at",
+                                      removal_policy=RemovalPolicy.DESTROY
+                                      )
+        for index_name, (partition_key, sort_key) in EMAIL_OUTBOX_INDEXES.items():
+            # Sparse: only pending emails have the keys. The sender needs no other attributes.
+            outbox_table.add_global_secondary_index(
+                index_name=index_name,
+                partition_key=dynamodb.Attribute(name=partition_key, type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(name=sort_key, type=dynamodb.AttributeType.NUMBER),
+                projection_type=dynamodb.ProjectionType.INCLUDE,
+                non_key_attributes=["order_id", "created_at"],
+            )
+        outbox_table.grant_write_data(email_handler.role)
+        email_handler.add_environment("EMAIL_OUTBOX_TABLE_NAME", outbox_table.table_name)
+
+        email_events_topic = sns.Topic(self, "EmailEventsTopic", display_name="SES Email Events Topic")
+        configuration_set = ses.ConfigurationSet(self, "EmailConfigurationSet")
+        configuration_set.add_event_destination("EmailEventsDestination",
+                                                destination=ses.EventDestination.sns_topic(email_events_topic),
+                                                events=[ses.EmailSendingEvent.DELIVERY,
+                                                        ses.EmailSendingEvent.BOUNCE,
+                                                        ses.EmailSendingEvent.COMPLAINT,
+                                                        ses.EmailSendingEvent.REJECT,
+                                                        ses.EmailSendingEvent.RENDERING_FAILURE]
+                                                )
+
+        sender_role = iam.Role(self, "EmailSenderHandlerRole",
+                               assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                               managed_policies=[iam.ManagedPolicy.from_aws_managed_policy_name(
+                                   "service-role/AWSLambdaBasicExecutionRole"),
+                                   iam.ManagedPolicy.from_aws_managed_policy_name(
+                                       "service-role/AWSLambdaVPCAccessExecutionRole")])
+        outbox_table.grant_read_write_data(sender_role)
+        sender_role.add_to_policy(iam.PolicyStatement(
+            actions=["ses:SendEmail", "ses:SendRawEmail"],
+            resources=["*"]
+        ))
+        ses_vpc, ses_vpc_subnets = self._ses_network(config, vpc, vpc_subnets)
+        sender = self._handler_function("EmailSenderHandlerLambda", "email_sender", config,
+                                        timeout=Duration.seconds(60),
+                                        # One sender paces all sends at the account's SES rate.
+                                        reserved_concurrent_executions=1,
+                                        vpc=ses_vpc,
+                                        vpc_subnets=ses_vpc_subnets,
+                                        role=sender_role,
+                                        environment={
+                                            "SENDER_EMAIL": sender_email,
+                                            "RECIPIENT_EMAIL": recipient_email,
+                                            "EMAIL_OUTBOX_TABLE_NAME": outbox_table.table_name,
+                                            "SES_CONFIGURATION_SET": configuration_set.configuration_set_name,
+                                            "SES_SEND_RATE": str(config.ses_max_send_rate),
+                                            "EMAIL_MAX_ATTEMPTS": str(config.email_max_attempts),
+                                            "EMAIL_RETRY_BASE_SECONDS": str(config.email_retry_base_seconds),
+                                        }
+                                        )
+        events.Rule(self, "EmailSenderSchedule",
+                    schedule=events.Schedule.rate(Duration.minutes(1)),
+                    targets=[events_targets.LambdaFunction(sender)]
+                    )
+
+        events_role = iam.Role(self, "EmailEventsHandlerRole",
+                               assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                               managed_policies=[iam.ManagedPolicy.from_aws_managed_policy_name(
+                                   "service-role/AWSLambdaBasicExecutionRole"),
+                                   iam.ManagedPolicy.from_aws_managed_policy_name(
+                                       "service-role/AWSLambdaVPCAccessExecutionRole")])
+        outbox_table.grant_read_write_data(events_role)
+        events_handler = self._handler_function("EmailEventsHandlerLambda", "email_events", config,
+                                                vpc=vpc,
+                                                vpc_subnets=vpc_subnets,
+                                                role=events_role,
+                                                environment={
+                                                    "EMAIL_OUTBOX_TABLE_NAME": outbox_table.table_name,
+                                                }
+                                                )
+        email_events_topic.add_subscription(subs.LambdaSubscription(events_handler))
+
+        cloudwatch.Alarm(self, "EmailSendFailuresAlarm",
+                         metric=self._handler_metric("email_sender", "EmailsFailed", "Sum"),
+                         threshold=0,
+                         evaluation_periods=1,
+                         comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                         alarm_description="Outbox emails were given up on after permanent errors or retries",
+                         treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+                         )
+        # The email queue drains at once in outbox mode; the outbox delay is the email SLO.
+        cloudwatch.Alarm(self, "EmailOutboxDelayAlarm",
+                         metric=self._handler_metric("email_sender", "OutboxDelay", "p99"),
+                         threshold=config.email.max_message_age_seconds * 1000,
+                         evaluation_periods=1,
+                         comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                         alarm_description="Emails wait in the outbox longer than the email SLO",
+                         treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+                         )
+        return {"email_sender": sender, "email_events": events_handler}
+
+    def _concurrency_controller(self, consumers: Dict[str, tuple],
+                                vpc: Optional[ec2.Vpc], vpc_subnets: Optional[ec2.SubnetSelection],
+                                config: OrderProcessingConfig) -> _lambda.Function:
+        """Function run every minute that sets the MaximumConcurrency of each
+        consumer's event source mapping (see order_common.concurrency).
+
+        The controller changes the mappings outside CloudFormation; a deployment
+        resets them to ``max_concurrency`` until the next run.
+        """
+        role = iam.Role(self, "ConcurrencyHandlerRole",
+                        assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                        managed_policies=[iam.ManagedPolicy.from_aws_managed_policy_name(
+                            "service-role/AWSLambdaBasicExecutionRole"),
+                            iam.ManagedPolicy.from_aws_managed_policy_name(
+                                "service-role/AWSLambdaVPCAccessExecutionRole")])
+        role.add_to_policy(iam.PolicyStatement(
+            actions=["cloudwatch:GetMetricData"],
+            resources=["*"]
+        ))
+        role.add_to_policy(iam.PolicyStatement(
+            actions=["lambda:GetEventSourceMapping", "lambda:UpdateEventSourceMapping"],
+            resources=[event_source.event_source_mapping_arn for _, event_source, _ in consumers.values()]
+        ))
+
+        function = self._handler_function("ConcurrencyHandlerLambda", "concurrency", config,
+                                          timeout=Duration.seconds(30),
+                                          # Runs must not overlap and undo each other's updates.
+                                          reserved_concurrent_executions=1,
+                                          vpc=vpc,
+                                          vpc_subnets=vpc_subnets,
+                                          role=role,
+                                          environment={
+                                              "CONSUMERS": self.to_json_string({
+                                                  service: {
+                                                      "queue": queue.queue_name,
+                                                      "mapping": event_source.event_source_mapping_id,
+                                                      "minimum": consumer.min_concurrency,
+                                                      "maximum": consumer.concurrency_ceiling,
+                                                      "batch_size": consumer.batch_size,
+                                                      "target_age_seconds": consumer.max_message_age_seconds
+                                                      * CONCURRENCY_TARGET_AGE_FRACTION,
+                                                  }
+                                                  for service, (queue, event_source, consumer) in consumers.items()
+                                              }),
+                                              "METRICS_NAMESPACE": METRICS_NAMESPACE,
+                                              "LOG_LEVEL": config.log_level,
+                                          }
+                                          )
+        events.Rule(self, "ConcurrencyControlSchedule",
+                    schedule=events.Schedule.rate(Duration.minutes(1)),
+                    targets=[events_targets.LambdaFunction(function)]
+                    )
+        return function
+
+    def _handler_function(self, construct_id: str, service: str, config: OrderProcessingConfig,
+                          default_memory_size: Optional[int] = None, **props) -> _lambda.Function:
+        """Function running ``lambda_src/{service}_handler`` with the shared
+        layer, packaged for ``config.packaging_mode`` with the memory and
+        architecture configured for ``service``. ``props`` are passed on."""
+        settings = config.function_config(service)
+        function = _lambda.Function(self, construct_id,
+                                    runtime=RUNTIMES[config.packaging_mode],
+                                    architecture=ARCHITECTURES[settings.architecture],
+                                    memory_size=settings.memory_size or default_memory_size,
+                                    code=_lambda.Code.from_asset(f"lambda_src/{service}_handler",
+                                                                 exclude=["**/__pycache__"]),
+                                    handler="app.lambda_handler",
+                                    layers=[self._common_layer(config, settings.architecture)],
+                                    log_retention=LOG_RETENTION[config.log_retention_days],
+                                    **props
+                                    )
+        if config.packaging_mode == "optimized":
+            # Create the boto3 clients during init (see order_common.aws).
+            function.add_environment("PREWARM_CLIENTS", "true")
+        return function
+
+    def _common_layer(self, config: OrderProcessingConfig, architecture: str) -> _lambda.LayerVersion:
+        """Shared handler code (order_common), mounted at /opt/python. Optimized
+        packaging bundles native wheels, so it builds one layer per architecture."""
+        if config.packaging_mode != "optimized":
+            architecture = "any"
+        layer = self._common_layers.get(architecture)
+        if layer is None:
+            construct_id = "OrderCommonLayer" if architecture == "any" else f"OrderCommonLayer{architecture.title()}"
+            layer = _lambda.LayerVersion(self, construct_id,
+                                         code=common_layer_code(config.packaging_mode, architecture),
+                                         compatible_runtimes=[RUNTIMES[config.packaging_mode]],
+                                         description="Shared code for the order processing handlers"
+                                         )
+            self._common_layers[architecture] = layer
+        return layer
+
+    @staticmethod
+    def _handler_metric(service: str, metric_name: str, statistic: str) -> cloudwatch.Metric:
+        return cloudwatch.Metric(namespace=METRICS_NAMESPACE,
+                                 metric_name=metric_name,
+                                 dimensions_map={"Service": service},
+                                 statistic=statistic,
+                                 period=Duration.minutes(5)
+                                 )
+
+    def _direct_webhook_api(self, topic: sns.ITopic, api_key_value: str, fifo: bool = False) -> apigw.RestApi:
+        """REST API whose POST /webhook publishes the validated order straight to
+        ``topic`` through an SNS service integration, with no Lambda in the path.
+        A ``fifo`` topic gets the order ID as the message group.
+
+        Callers authenticate with an API Gateway API key (``x-api-key`` header)
+        tied to a usage plan instead of an ``api_key`` field in the body.
+        """
+        api = apigw.RestApi(self, "StripeWebhookApi",
+                            default_cors_preflight_options=apigw.CorsOptions(
+                                allow_origins=apigw.Cors.ALL_ORIGINS,
+                                allow_methods=apigw.Cors.ALL_METHODS
+                            )
+                            )
+        api.add_gateway_response("MissingRequiredFields",
+                                 type=apigw.ResponseType.BAD_REQUEST_BODY,
+                                 status_code="400",
+                                 templates={"application/json": '{"message": "Missing required fields."}'}
+                                 )
+
+        order_model = api.add_model("WebhookOrderModel",
+                                    content_type="application/json",
+                                    schema=apigw.JsonSchema(
+                                        schema=apigw.JsonSchemaVersion.DRAFT4,
+                                        type=apigw.JsonSchemaType.OBJECT,
+                                        required=["order_id", "amount_total"],
+                                        properties={
+                                            "order_id": apigw.JsonSchema(type=apigw.JsonSchemaType.STRING,
+                                                                         min_length=1),
+                                            "amount_total": apigw.JsonSchema(type=apigw.JsonSchemaType.NUMBER,
+                                                                             minimum=0,
+                                                                             exclusive_minimum=True),
+                                            "customer_id": apigw.JsonSchema(type=apigw.JsonSchemaType.STRING),
+                                        }
+                                    )
+                                    )
+        body_validator = api.add_request_validator("WebhookBodyValidator", validate_request_body=True)
+
+        integration_role = iam.Role(self, "WebhookSnsIntegrationRole",
+                                    assumed_by=iam.ServicePrincipal("apigateway.amazonaws.com"))
+        topic.grant_publish(integration_role)
+        # Publish only the fields the Lambda path forwards, as the same JSON message:
+        # customer_id only when it is given and not empty.
+        # Velocity escapes a double quote inside a double-quoted string by doubling it.
+        publish_template = (
+            '#set($message = "{""order_id"": $input.json(\'$.order_id\'), '
+            '""amount_total"": $input.json(\'$.amount_total\')")\n'
+            '#if($input.path(\'$.customer_id\') != "")\n'
+            '#set($message = "$message, ""customer_id"": $input.json(\'$.customer_id\')")\n'
+            '#end\n'
+            '#set($message = "$message}")\n'
+            f"Action=Publish&TopicArn=$util.urlEncode('{topic.topic_arn}')&Message=$util.urlEncode($message)"
+        )
+        if fifo:
+            publish_template += "&MessageGroupId=$util.urlEncode($input.path('$.order_id'))"
+        integration = apigw.AwsIntegration(
+            service="sns",
+            action="Publish",
+            integration_http_method="POST",
+            options=apigw.IntegrationOptions(
+                credentials_role=integration_role,
+                passthrough_behavior=apigw.PassthroughBehavior.NEVER,
+                request_parameters={
+                    "integration.request.header.Content-Type": "'application/x-www-form-urlencoded'"
+                },
+                request_templates={"application/json": publish_template},
+                integration_responses=[
+                    apigw.IntegrationResponse(
+                        status_code="200",
+                        response_templates={"application/json": json.dumps(
+                            {"message": "Webhook received and published successfully."})}
+                    ),
+                    apigw.IntegrationResponse(
+                        status_code="500",
+                        selection_pattern="[45]\\d{2}",
+                        response_templates={"application/json": json.dumps(
+                            {"message": "Internal server error while publishing event."})}
+                    ),
+                ]
+            )
+        )
+        api.root.add_resource("webhook").add_method(
+            "POST", integration,
+            api_key_required=True,
+            request_models={"application/json": order_model},
+            request_validator=body_validator,
+            method_responses=[apigw.MethodResponse(status_code="200"), apigw.MethodResponse(status_code="500")]
+        )
+
+        api_key = api.add_api_key("WebhookApiKey", value=api_key_value)
+        usage_plan = api.add_usage_plan("WebhookUsagePlan",
+                                        api_stages=[apigw.UsagePlanPerApiStage(api=api, stage=api.deployment_stage)])
+        usage_plan.add_api_key(api_key)
+        return api
+
+    def _network(self, config: OrderProcessingConfig) -> Tuple[Optional[ec2.Vpc], Optional[ec2.SubnetSelection]]:
+        """Create the VPC for ``config.vpc_mode`` and return it with the subnets
+        the functions run in, or ``(None, None)`` to run them outside a VPC."""
+        if config.vpc_mode == "none":
+            return None, None
+
+        if config.vpc_mode == "nat":
+            # VPC with public and private subnets + NAT Gateway
+            vpc = ec2.Vpc(self, "OrderProcessingVpc",
+                          max_azs=1,
+                          nat_gateways=1,
+                          subnet_configuration=[
+                              ec2.SubnetConfiguration(
+                                  name="public-subnet",
+                                  subnet_type=ec2.SubnetType.PUBLIC,
+                                  cidr_mask=24
+                              ),
+                              ec2.SubnetConfiguration(
+                                  name="private-subnet",
+                                  subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS,
+                                  cidr_mask=24
+                              ),
+                          ]
+                          )
+            return vpc, ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS)
+
+        # Isolated subnets in several AZs; AWS APIs are reached through VPC endpoints.
+        vpc = ec2.Vpc(self, "OrderProcessingVpc",
+                      max_azs=config.vpc_max_azs,
+                      nat_gateways=0,
+                      subnet_configuration=[
+                          ec2.SubnetConfiguration(
+                              name="isolated-subnet",
+                              subnet_type=ec2.SubnetType.PRIVATE_ISOLATED,
+                              cidr_mask=24
+                          ),
+                      ]
+                      )
+        vpc_subnets = ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_ISOLATED)
+        vpc.add_gateway_endpoint("DynamoDbEndpoint",
+                                 service=ec2.GatewayVpcEndpointAwsService.DYNAMODB,
+                                 subnets=[vpc_subnets]
+                                 )
+        endpoint_services = dict(INTERFACE_ENDPOINT_SERVICES)
+        if config.concurrency_control:
+            endpoint_services.update(CONCURRENCY_CONTROL_ENDPOINT_SERVICES)
+        for endpoint_id, service in endpoint_services.items():
+            vpc.add_interface_endpoint(endpoint_id,
+                                       service=service,
+                                       subnets=vpc_subnets,
+                                       private_dns_enabled=True
+                                       )
+        return vpc, vpc_subnets
+
+    @staticmethod
+    def _ses_network(config: OrderProcessingConfig, vpc: Optional[ec2.Vpc],
+                     vpc_subnets: Optional[ec2.SubnetSelection]
+                     ) -> Tuple[Optional[ec2.Vpc], Optional[ec2.SubnetSelection]]:
+        """The network of a function that calls the SES API: the functions' VPC,
+        except in 'endpoints' mode, whose isolated subnets cannot reach SES."""
+        if config.vpc_mode == "endpoints":
+            return None, None
+        return vpc, vpc_subnets
+
+    @staticmethod
+    def _sqs_event_source(queue: sqs.Queue, consumer: ConsumerConfig,
+                          enabled: bool = True) -> aws_lambda_event_sources.SqsEventSource:
+        # FIFO event sources take at most 10 records and have no batching window.
+        fifo = bool(queue.fifo)
+        return aws_lambda_event_sources.SqsEventSource(
+            queue,
+            batch_size=min(consumer.batch_size, FIFO_MAX_BATCH_SIZE) if fifo else consumer.batch_size,
+            max_batching_window=Duration.seconds(consumer.max_batching_window_seconds)
+            if consumer.max_batching_window_seconds and not fifo else None,
+            max_concurrency=consumer.max_concurrency,
+            report_batch_item_failures=True,
+            enabled=enabled
+        )
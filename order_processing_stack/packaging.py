@@ -0,0 +1,49 @@
+"""Runtimes, architectures and the common layer of each packaging mode
+(see PACKAGING_MODES in order_processing_stack.config)."""
+from aws_cdk import BundlingOptions, aws_lambda as _lambda
+
+# aws-cdk-lib 2.100 predates the Python 3.12 runtime constant.
+PYTHON_3_12 = _lambda.Runtime("python3.12", _lambda.RuntimeFamily.PYTHON, supports_inline_code=True)
+
+RUNTIMES = {
+    "standard": _lambda.Runtime.PYTHON_3_9,
+    "optimized": PYTHON_3_12,
+}
+ARCHITECTURES = {
+    "x86_64": _lambda.Architecture.X86_64,
+    "arm64": _lambda.Architecture.ARM_64,
+}
+COMMON_LAYER_PATH = "lambda_src/common_layer"
+# AWS services the handlers create clients for (order_common.aws.lazy_client).
+# The optimized layer keeps only their botocore models; sts stays for credential providers.
+BUNDLED_AWS_SERVICES = (
+    "cloudwatch", "dynamodb", "lambda", "secretsmanager", "ses", "sns", "sqs", "sts",
+)
+
+# Run in the runtime's build image, with the layer directory as /asset-input.
+# Lambda cannot write __pycache__ under /opt, so the layer ships bytecode that
+# is used without checking source timestamps (the zip does not keep them).
+_BUNDLE_COMMAND = " && ".join([
+    "pip install --no-cache-dir -r requirements.txt -t /asset-output/python",
+    "cp -r python/order_common /asset-output/python/",
+    "rm -rf /asset-output/python/boto3/data /asset-output/python/bin",
+    "cd /asset-output/python/botocore/data",
+    "for d in */; do case ' {keep} ' in *\" ${{d%/}} \"*) ;; *) rm -rf \"$d\" ;; esac; done",
+    "cd /asset-output/python",
+    "find . -name __pycache__ -prune -exec rm -rf {{}} +",
+    "python -m compileall -q --invalidation-mode unchecked-hash .",
+])
+
+
+def common_layer_code(packaging_mode: str, architecture: str) -> _lambda.Code:
+    """Code of the common layer: the order_common sources as they are, or in
+    'optimized' packaging bundled with the pinned requirements for one
+    architecture (orjson is a native wheel)."""
+    if packaging_mode != "optimized":
+        return _lambda.Code.from_asset(COMMON_LAYER_PATH, exclude=["requirements.txt", "**/__pycache__"])
+    runtime = RUNTIMES[packaging_mode]
+    return _lambda.Code.from_asset(COMMON_LAYER_PATH, bundling=BundlingOptions(
+        image=runtime.bundling_image,
+        platform=ARCHITECTURES[architecture].docker_platform,
+        command=["bash", "-c", _BUNDLE_COMMAND.format(keep=" ".join(BUNDLED_AWS_SERVICES))],
+    ))
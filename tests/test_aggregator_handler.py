@@ -0,0 +1,100 @@
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+
+from lambda_src.aggregator_handler import app
+from local_pipeline.fakes import FakeDynamoDB
+from order_common.aggregates import get_totals
+from order_common.dynamo import to_item
+from order_common.orders_table import order_item
+
+TABLE = 'aggregates'
+
+
+def _insert(sequence_number, order_id, created_at, amount_total=100):
+    return {
+        'eventName': 'INSERT',
+        'dynamodb': {
+            'SequenceNumber': str(sequence_number),
+            'NewImage': to_item(order_item(order_id, amount_total, created_at=created_at)),
+        },
+    }
+
+
+class TestAggregatorHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.dynamodb = FakeDynamoDB()
+        patcher = patch.multiple(app, dynamodb=self.dynamodb, AGGREGATES_TABLE_NAME=TABLE)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _totals(self, period, start):
+        return get_totals(self.dynamodb, TABLE, period, start)
+
+    def test_orders_are_added_to_minute_hour_and_day_totals(self):
+        records = [
+            _insert(1, 'a', '2026-03-01T10:00:05.000Z', 100),
+            _insert(2, 'b', '2026-03-01T10:00:59.000Z', 250),
+            _insert(3, 'c', '2026-03-01T11:30:00.000Z', 50),
+        ]
+
+        app.lambda_handler({'Records': records}, None)
+
+        self.assertEqual(self._totals('minute', '2026-03-01T10:00'), {'order_count': 2, 'amount_total': 350})
+        self.assertEqual(self._totals('hour', '2026-03-01T11'), {'order_count': 1, 'amount_total': 50})
+        self.assertEqual(self._totals('day', '2026-03-01'), {'order_count': 3, 'amount_total': 400})
+        self.assertEqual(self._totals('day', '2026-03-02'), {'order_count': 0, 'amount_total': 0})
+        # One transaction for the whole batch.
+        self.assertEqual(self.dynamodb.stats['transact_write_items'], 1)
+
+    def test_redelivered_batch_is_not_counted_twice(self):
+        event = {'Records': [_insert(1, 'a', '2026-03-01T10:00:00.000Z'), _insert(2, 'b', '2026-03-01T10:00:00.000Z')]}
+
+        app.lambda_handler(event, None)
+        app.lambda_handler(event, None)
+
+        self.assertEqual(self._totals('day', '2026-03-01')['order_count'], 2)
+
+    def test_updates_and_other_items_are_ignored(self):
+        modify = dict(_insert(2, 'a', '2026-03-01T10:00:00.000Z'), eventName='MODIFY')
+        other = _insert(3, 'x', '2026-03-01T10:00:00.000Z')
+        other['dynamodb']['NewImage']['SK'] = {'S': 'email'}
+        backfilled = _insert(4, 'y', '2026-03-01T10:00:00.000Z')
+        backfilled['dynamodb']['NewImage']['backfilled'] = {'BOOL': True}
+
+        app.lambda_handler({'Records': [_insert(1, 'a', '2026-03-01T10:00:00.000Z'), modify, other, backfilled]},
+                           None)
+
+        self.assertEqual(self._totals('day', '2026-03-01'), {'order_count': 1, 'amount_total': 100})
+
+    def test_batches_spanning_many_periods_are_split_deterministically(self):
+        # 60 distinct minutes, hours and days need 180 updates: more than one transaction.
+        records = [_insert(i, str(i), f'2026-03-{i % 28 + 1:02d}T{i % 24:02d}:{i:02d}:00.000Z', Decimal('1.5'))
+                   for i in range(60)]
+        chunks = [[r['dynamodb']['SequenceNumber'] for r in chunk] for chunk, _ in app.chunk_records(records)]
+
+        app.lambda_handler({'Records': records}, None)
+        app.lambda_handler({'Records': records}, None)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(chunks, [[r['dynamodb']['SequenceNumber'] for r in chunk]
+                                  for chunk, _ in app.chunk_records(records)])
+        self.assertTrue(all(len(totals) <= app.MAX_BUCKET_UPDATES for _, totals in app.chunk_records(records)))
+        total = sum(self._totals('day', f'2026-03-{day:02d}')['amount_total'] for day in range(1, 29))
+        self.assertEqual(total, Decimal('90'))
+
+    @patch('lambda_src.aggregator_handler.app.time.sleep')
+    def test_conflicting_transactions_are_retried(self, mock_sleep):
+        conflict = app.ClientError({'Error': {'Code': 'TransactionCanceledException', 'Message': 'conflict'},
+                                    'CancellationReasons': [{'Code': 'None'}, {'Code': 'TransactionConflict'}]},
+                                   'TransactWriteItems')
+        with patch.object(self.dynamodb, 'transact_write_items', side_effect=[conflict, {}]) as mock:
+            app.lambda_handler({'Records': [_insert(1, 'a', '2026-03-01T10:00:00.000Z')]}, None)
+
+        self.assertEqual(mock.call_count, 2)
+        mock_sleep.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
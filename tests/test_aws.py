@@ -0,0 +1,67 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+import lambda_src  # noqa: F401  Puts the shared layer on sys.path.
+from order_common import aws
+
+
+class TestLazyClient(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.dict(aws._clients, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        session = patch.object(aws, '_session', None)
+        session.start()
+        self.addCleanup(session.stop)
+
+    @patch.object(aws, '_create_session')
+    def test_client_is_created_on_first_use_and_shared(self, mock_create_session):
+        session = mock_create_session.return_value
+        client = aws.lazy_client('sqs')
+
+        session.client.assert_not_called()
+        client.send_message(QueueUrl='q', MessageBody='{}')
+        aws.lazy_client('sqs').delete_message(QueueUrl='q', ReceiptHandle='r')
+
+        session.client.assert_called_once_with('sqs', config=aws.client_config())
+        session.client.return_value.send_message.assert_called_once()
+        session.client.return_value.delete_message.assert_called_once()
+
+    @patch.object(aws, 'get_client')
+    def test_prewarm_only_creates_clients_when_enabled(self, mock_get_client):
+        aws.prewarm(aws.lazy_client('ses'), 'dynamodb')
+        mock_get_client.assert_not_called()
+
+        mock_get_client.side_effect = [MagicMock(), Exception('no region')]
+        with patch.object(aws, 'PREWARM_CLIENTS', True), patch('builtins.print'):
+            aws.prewarm(aws.lazy_client('ses'), 'dynamodb')
+
+        self.assertEqual([c.args for c in mock_get_client.call_args_list], [('ses',), ('dynamodb',)])
+
+    @patch.object(aws, 'get_client')
+    def test_private_attributes_do_not_create_a_client(self, mock_get_client):
+        client = aws.lazy_client('ses')
+
+        self.assertFalse(hasattr(client, '_is_coroutine'))
+        MagicMock(spec=client)
+        mock_get_client.assert_not_called()
+
+
+class TestIsThrottlingError(unittest.TestCase):
+
+    def test_throttling_codes_are_recognised(self):
+        for code in ('Throttling', 'ProvisionedThroughputExceededException', 'ThrottlingException'):
+            with self.subTest(code=code):
+                self.assertTrue(aws.is_throttling_error(ClientError({'Error': {'Code': code}}, 'Op')))
+
+    def test_other_errors_are_not_throttling(self):
+        self.assertFalse(aws.is_throttling_error(
+            ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')))
+        self.assertFalse(aws.is_throttling_error(ValueError('Throttling')))
+
+
+if __name__ == '__main__':
+    unittest.main()
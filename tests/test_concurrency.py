@@ -0,0 +1,133 @@
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from lambda_src.concurrency_handler import app
+from order_common.concurrency import (ControlSettings, QueueSample, metric_queries, next_concurrency,
+                                      samples_from_metric_data, simulate)
+
+SETTINGS = ControlSettings(minimum=2, maximum=20, batch_size=10, target_age_seconds=60)
+START = datetime(2026, 10, 17, 9, 0, tzinfo=timezone.utc)
+
+# A flash sale on the email queue, one sample per minute: the backlog builds,
+# SES starts throttling, and the queue drains.
+FLASH_SALE = [
+    QueueSample(visible=0, age_seconds=0),
+    QueueSample(visible=40, age_seconds=10),
+    QueueSample(visible=300, age_seconds=45),
+    QueueSample(visible=600, age_seconds=90),
+    QueueSample(visible=900, age_seconds=150),
+    QueueSample(visible=700, age_seconds=160, throttles=12),
+    QueueSample(visible=500, age_seconds=120),
+    QueueSample(visible=200, age_seconds=70, throttles=3),
+    QueueSample(visible=60, age_seconds=30),
+    QueueSample(visible=0, age_seconds=0),
+]
+
+
+def _metric_data(series):
+    """GetMetricData results for the email consumer, newest first as CloudWatch returns them."""
+    timestamps = [START + timedelta(minutes=i) for i in range(len(series))][::-1]
+    samples = series[::-1]
+    results = []
+    for prefix, field in (('visible', 'visible'), ('age', 'age_seconds'), ('throttles', 'throttles')):
+        points = [(t, getattr(s, field)) for t, s in zip(timestamps, samples)
+                  if prefix != 'throttles' or s.throttles]
+        results.append({'Id': f'{prefix}_email', 'Timestamps': [t for t, _ in points],
+                        'Values': [float(v) for _, v in points], 'StatusCode': 'Complete'})
+    return results
+
+
+class TestNextConcurrency(unittest.TestCase):
+
+    def test_recorded_flash_sale(self):
+        self.assertEqual(simulate(FLASH_SALE, SETTINGS, initial=5), [5, 5, 8, 12, 18, 9, 14, 7, 7, 7])
+
+    def test_stays_within_bounds(self):
+        backlog = [QueueSample(visible=10000, age_seconds=600)] * 10
+        throttled = [QueueSample(visible=10000, age_seconds=600, throttles=50)] * 10
+
+        self.assertEqual(simulate(backlog, SETTINGS, initial=2)[-1], 20)
+        self.assertEqual(simulate(throttled, SETTINGS, initial=20)[-1], 2)
+
+    def test_unlimited_mapping_starts_from_maximum(self):
+        self.assertEqual(next_concurrency(None, QueueSample(visible=0, age_seconds=0), SETTINGS), 20)
+        self.assertEqual(next_concurrency(None, QueueSample(0, 0, throttles=1), SETTINGS), 10)
+
+    def test_depth_beyond_one_batch_per_instance_scales_up(self):
+        self.assertEqual(next_concurrency(4, QueueSample(visible=40, age_seconds=5), SETTINGS), 4)
+        self.assertEqual(next_concurrency(4, QueueSample(visible=41, age_seconds=5), SETTINGS), 6)
+
+
+class TestMetricData(unittest.TestCase):
+
+    def test_queries_cover_queue_and_throttle_metrics(self):
+        queries = metric_queries({'db_update': {'queue': 'DbUpdateQueue'}}, 'OrderProcessing')
+
+        self.assertEqual([q['Id'] for q in queries], ['visible_db_update', 'age_db_update', 'throttles_db_update'])
+        throttles = queries[2]['MetricStat']
+        self.assertEqual(throttles['Metric']['Dimensions'], [{'Name': 'Service', 'Value': 'db_update'}])
+        self.assertEqual(throttles['Stat'], 'Sum')
+
+    def test_sample_is_the_newest_minute_with_queue_depth(self):
+        samples = samples_from_metric_data(_metric_data(FLASH_SALE[:6]), {'email': {}, 'inventory': {}})
+
+        self.assertEqual(samples, {'email': QueueSample(visible=700, age_seconds=160, throttles=12)})
+
+    def test_minute_without_throttles_counts_zero(self):
+        samples = samples_from_metric_data(_metric_data(FLASH_SALE[:7]), {'email': {}})
+
+        self.assertEqual(samples['email'].throttles, 0)
+
+
+class TestConcurrencyHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.cloudwatch = MagicMock()
+        self.lambda_client = MagicMock()
+        consumer = {'queue': 'EmailQueue', 'mapping': 'uuid-email', 'minimum': 2, 'maximum': 20,
+                    'batch_size': 10, 'target_age_seconds': 60}
+        patcher = patch.multiple(app, cloudwatch=self.cloudwatch, lambda_client=self.lambda_client,
+                                 CONSUMERS={'email': consumer}, consumer_metrics={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        print_patcher = patch('builtins.print')
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def test_backlog_raises_the_mapping_concurrency(self):
+        self.cloudwatch.get_metric_data.return_value = {'MetricDataResults': _metric_data(FLASH_SALE[:4])}
+        self.lambda_client.get_event_source_mapping.return_value = {'ScalingConfig': {'MaximumConcurrency': 8}}
+
+        response = app.lambda_handler({}, None)
+
+        self.lambda_client.update_event_source_mapping.assert_called_once_with(
+            UUID='uuid-email', ScalingConfig={'MaximumConcurrency': 12})
+        self.assertEqual(json.loads(response['body']), {'email': 12})
+
+    def test_unchanged_concurrency_is_not_written(self):
+        self.cloudwatch.get_metric_data.return_value = {'MetricDataResults': _metric_data(FLASH_SALE[:2])}
+        self.lambda_client.get_event_source_mapping.return_value = {'ScalingConfig': {'MaximumConcurrency': 8}}
+
+        app.lambda_handler({}, None)
+
+        self.lambda_client.update_event_source_mapping.assert_not_called()
+
+    def test_missing_metrics_and_update_errors_leave_the_mapping_alone(self):
+        self.cloudwatch.get_metric_data.return_value = {'MetricDataResults': []}
+        self.assertEqual(json.loads(app.lambda_handler({}, None)['body']), {})
+        self.lambda_client.get_event_source_mapping.assert_not_called()
+
+        self.cloudwatch.get_metric_data.return_value = {'MetricDataResults': _metric_data(FLASH_SALE[:6])}
+        self.lambda_client.get_event_source_mapping.return_value = {}
+        self.lambda_client.update_event_source_mapping.side_effect = ClientError(
+            {'Error': {'Code': 'ResourceInUseException'}}, 'UpdateEventSourceMapping')
+
+        self.assertEqual(json.loads(app.lambda_handler({}, None)['body']), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
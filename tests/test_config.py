@@ -0,0 +1,145 @@
+import unittest
+
+from order_processing_stack.config import ConsumerConfig, FunctionConfig, OrderProcessingConfig
+
+
+class TestOrderProcessingConfig(unittest.TestCase):
+
+    def test_from_context_defaults(self):
+        config = OrderProcessingConfig.from_context(None)
+
+        self.assertEqual(config, OrderProcessingConfig())
+        self.assertEqual(config.email.batch_size, 10)
+        self.assertEqual(config.db_update.max_batching_window_seconds, 2)
+
+    def test_from_context_merges_consumer_settings(self):
+        config = OrderProcessingConfig.from_context({
+            'email': {'max_concurrency': 5, 'reserved_concurrency': 10},
+            'db_update': {'batch_size': 500},
+            'ses_max_send_rate': 14,
+        })
+
+        self.assertEqual(config.email.max_concurrency, 5)
+        self.assertEqual(config.email.batch_size, 10)
+        self.assertEqual(config.db_update.batch_size, 500)
+        # Settings not given keep the consumer's own default.
+        self.assertEqual(config.db_update.max_batching_window_seconds, 2)
+        self.assertEqual(config.inventory, OrderProcessingConfig().inventory)
+
+    def test_from_context_accepts_json_string(self):
+        config = OrderProcessingConfig.from_context('{"inventory": {"memory_size": 512}}')
+
+        self.assertEqual(config.inventory.memory_size, 512)
+
+    def test_from_context_rejects_unknown_keys(self):
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'shipping': {}})
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'email': {'batchsize': 5}})
+
+    def test_visibility_timeout_is_derived_from_timeout_and_batching_window(self):
+        consumer = ConsumerConfig(batch_size=100, max_batching_window_seconds=5, timeout_seconds=30)
+
+        self.assertEqual(consumer.visibility_timeout_seconds, 6 * 30 + 5)
+
+    def test_invalid_consumer_settings(self):
+        with self.assertRaises(ValueError):
+            ConsumerConfig(batch_size=50)
+        with self.assertRaises(ValueError):
+            ConsumerConfig(max_concurrency=1)
+        with self.assertRaises(ValueError):
+            ConsumerConfig(max_concurrency=20, reserved_concurrency=10)
+
+    def test_ses_send_rate_is_split_across_email_instances(self):
+        config = OrderProcessingConfig.from_context({
+            'ses_max_send_rate': 14,
+            'email': {'max_concurrency': 7},
+        })
+
+        self.assertEqual(config.ses_send_rate_per_instance, 2)
+        self.assertEqual(OrderProcessingConfig().ses_send_rate_per_instance, 0.5)
+
+    def test_email_batches_cannot_outwait_the_timeout_in_direct_delivery(self):
+        # Default: 10 emails at 0.5/s per instance wait up to 20s of the 30s timeout.
+        config = OrderProcessingConfig()
+        self.assertGreaterEqual(config.email.timeout_seconds,
+                                config.email.batch_size / config.ses_send_rate_per_instance)
+
+        for settings in ({'email': {'timeout_seconds': 10}},
+                         {'email': {'max_concurrency': 10}},
+                         {'email': {'max_concurrency': None}}):
+            with self.subTest(settings=settings), self.assertRaises(ValueError):
+                OrderProcessingConfig.from_context(settings)
+        # The outbox sender paces itself; the email handler does not call SES.
+        OrderProcessingConfig.from_context({'email_delivery_mode': 'outbox', 'email': {'max_concurrency': None}})
+
+    def test_invalid_email_send_mode(self):
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'email_send_mode': 'batch'})
+
+    def test_invalid_email_delivery_settings(self):
+        for settings in ({'email_delivery_mode': 'queue'}, {'email_max_attempts': 0},
+                         {'email_retry_base_seconds': 0}):
+            with self.subTest(settings=settings), self.assertRaises(ValueError):
+                OrderProcessingConfig.from_context(settings)
+
+    def test_function_settings_follow_the_packaging_mode(self):
+        config = OrderProcessingConfig.from_context({
+            'packaging_mode': 'optimized',
+            'email': {'memory_size': 256, 'architecture': 'x86_64'},
+            'functions': {'webhook': {'memory_size': 512}},
+        })
+
+        self.assertEqual(config.function_config('email'), FunctionConfig(256, 'x86_64'))
+        self.assertEqual(config.function_config('webhook'), FunctionConfig(512, 'arm64'))
+        self.assertEqual(config.function_config('redrive'), FunctionConfig(None, 'arm64'))
+        self.assertEqual(OrderProcessingConfig().function_config('inventory'), FunctionConfig(128, 'x86_64'))
+
+    def test_invalid_packaging_settings(self):
+        for settings in ({'packaging_mode': 'zip'}, {'functions': {'email': {'memory_size': 256}}},
+                         {'functions': {'webhook': {'memory': 256}}},
+                         {'functions': {'webhook': {'architecture': 'arm'}}},
+                         {'inventory': {'memory_size': 64}}):
+            with self.subTest(settings=settings), self.assertRaises(ValueError):
+                OrderProcessingConfig.from_context(settings)
+
+    def test_invalid_logging_settings(self):
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'log_level': 'TRACE'})
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'event_log_sample_rate': 2})
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'log_retention_days': 10})
+
+    def test_invalid_vpc_mode(self):
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'vpc_mode': 'private'})
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'ingestion_mode': 'http'})
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'webhook_auth_mode': 'basic'})
+
+    def test_invalid_orders_index_shard_count(self):
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'orders_index_shard_count': 0})
+
+    def test_invalid_redrive_settings(self):
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'redrive_rate_per_second': 0})
+        with self.assertRaises(ValueError):
+            OrderProcessingConfig.from_context({'redrive_concurrency': 0})
+
+    def test_concurrency_ceiling_follows_configured_caps(self):
+        self.assertEqual(ConsumerConfig().concurrency_ceiling, 1000)
+        self.assertEqual(ConsumerConfig(reserved_concurrency=20).concurrency_ceiling, 20)
+        self.assertEqual(ConsumerConfig(max_concurrency=5, reserved_concurrency=20).concurrency_ceiling, 5)
+
+    def test_invalid_queue_slo_settings(self):
+        for settings in ({'max_message_age_seconds': 30}, {'queue_depth_alarm_messages': 0},
+                         {'min_concurrency': 1}, {'min_concurrency': 10, 'max_concurrency': 5}):
+            with self.subTest(settings=settings), self.assertRaises(ValueError):
+                OrderProcessingConfig.from_context({'email': settings})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,49 @@
 import json
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 
 from lambda_src.db_update_handler import app
+from order_common.dynamo import to_item
+from order_common.orders_table import order_item
+
+CREATED_AT = '2026-01-02T03:04:05.678Z'
+
+
+def _event(*order_ids):
+    return {
+        'Records': [
+            {
+                'messageId': f'm{order_id}',
+                'body': json.dumps({
+                    'Message': json.dumps({
+                        'order_id': order_id,
+                        'amount_total': 100
+                    })
+                })
+            }
+            for order_id in order_ids
+        ]
+    }
+
+
+def _unprocessed(order_id):
+    return [{'PutRequest': {'Item': to_item(order_item(order_id, 100, created_at=CREATED_AT))}}]
 
 
 class TestDbUpdateHandler(unittest.TestCase):
 
-    @patch('boto3.resource')
-    def test_lambda_handler_success(self, mock_boto_resource):
-        # Mock DynamoDB table
-        mock_table = MagicMock()
-        mock_boto_resource.return_value.Table.return_value = mock_table
+    def setUp(self):
+        app.idempotency.clear()
+        app.ORDERS_TABLE_NAME = 'test_table'
+        dynamodb = patch.object(app, 'dynamodb')
+        self.mock_dynamodb = dynamodb.start()
+        self.addCleanup(dynamodb.stop)
+        self.mock_dynamodb.batch_write_item.return_value = {'UnprocessedItems': {}}
+        timestamp = patch.object(app, 'timestamp', return_value=CREATED_AT)
+        timestamp.start()
+        self.addCleanup(timestamp.stop)
+
+    def test_lambda_handler_success(self):
 
         # Mock event
         event = {
@@ -27,21 +59,37 @@ class TestDbUpdateHandler(unittest.TestCase):
             ]
         }
 
-        # Set environment variable
-        app.ORDERS_TABLE_NAME = 'test_table'
-        app.table = mock_table
-
         # Call the handler
         response = app.lambda_handler(event, None)
 
         # Assertions
         self.assertEqual(response['statusCode'], 200)
-        mock_table.put_item.assert_called_once()
+        self.assertEqual(response['batchItemFailures'], [])
+        self.mock_dynamodb.put_item.assert_not_called()
+        self.mock_dynamodb.batch_write_item.assert_called_once_with(RequestItems={
+            'test_table': _unprocessed('123')
+        })
+        item = _unprocessed('123')[0]['PutRequest']['Item']
+        self.assertEqual((item['PK'], item['SK']), ({'S': 'order#123'}, {'S': 'order'}))
+        self.assertEqual(item['status'], {'S': 'placed'})
+        self.assertEqual(item['created_at'], {'S': CREATED_AT})
+        self.assertRegex(item['GSI1PK']['S'], r'^date#2026-01-02#[0-3]$')
+        self.assertNotIn('GSI2PK', item)
+
+    def test_customer_orders_are_indexed_by_customer(self):
+        event = {'Records': [{'messageId': 'm1', 'body': json.dumps(
+            {'order_id': '1', 'amount_total': 100, 'customer_id': 'cus_1'})}]}
+
+        app.lambda_handler(event, None)
+
+        item, = [r['PutRequest']['Item']
+                 for r in self.mock_dynamodb.batch_write_item.call_args.kwargs['RequestItems']['test_table']]
+        self.assertEqual(item['customer_id'], {'S': 'cus_1'})
+        self.assertEqual(item['GSI2PK'], {'S': 'customer#cus_1'})
 
     def test_lambda_handler_no_table(self):
         # Unset environment variable
         app.ORDERS_TABLE_NAME = None
-        app.table = None
 
         # Call the handler
         response = app.lambda_handler({}, None)
@@ -49,7 +97,85 @@ class TestDbUpdateHandler(unittest.TestCase):
         # Assertions
         self.assertEqual(response['statusCode'], 500)
 
+    def test_lambda_handler_reports_undecodable_records(self):
+        event = _event('1')
+        event['Records'].append({'messageId': 'bad', 'body': 'not json'})
+
+        response = app.lambda_handler(event, None)
+
+        self.assertEqual(response['batchItemFailures'], [{'itemIdentifier': 'bad'}])
+        self.mock_dynamodb.batch_write_item.assert_called_once()
+
+    def test_fifo_records_behind_a_failure_in_their_group_are_held_back(self):
+        event = _event('1', '2')
+        event['Records'].insert(0, {'messageId': 'bad', 'body': 'not json'})
+        groups = {'bad': '1', 'm1': '1', 'm2': '2'}
+        for record in event['Records']:
+            record['attributes'] = {'MessageGroupId': groups[record['messageId']]}
+
+        response = app.lambda_handler(event, None)
+
+        self.assertEqual(sorted(f['itemIdentifier'] for f in response['batchItemFailures']), ['bad', 'm1'])
+        written = self.mock_dynamodb.batch_write_item.call_args.kwargs['RequestItems']['test_table']
+        self.assertEqual([r['PutRequest']['Item']['order_id']['S'] for r in written], ['2'])
+
+    def test_lambda_handler_writes_in_chunks_of_25(self):
+
+        # The duplicate order '0' is written once.
+        response = app.lambda_handler(_event(*[str(i) for i in range(60)], '0'), None)
+
+        self.assertEqual(response['statusCode'], 200)
+        sizes = sorted(len(c.kwargs['RequestItems']['test_table'])
+                       for c in self.mock_dynamodb.batch_write_item.call_args_list)
+        self.assertEqual(sizes, [10, 25, 25])
+
+    def test_duplicate_orders_across_batches_are_written_once(self):
+
+        app.lambda_handler(_event('1', '2'), None)
+        response = app.lambda_handler(_event('2'), None)
+
+        self.assertEqual(response['batchItemFailures'], [])
+        self.mock_dynamodb.batch_write_item.assert_called_once()
+
+    @patch('lambda_src.db_update_handler.app.time.sleep')
+    def test_lambda_handler_retries_partial_unprocessed_items(self, mock_sleep):
+        unprocessed = _unprocessed('2')
+        self.mock_dynamodb.batch_write_item.side_effect = [
+            {'UnprocessedItems': {'test_table': unprocessed}},
+            {'UnprocessedItems': {}},
+        ]
+
+        response = app.lambda_handler(_event('1', '2'), None)
+
+        self.assertEqual(response['statusCode'], 200)
+        calls = self.mock_dynamodb.batch_write_item.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[1].kwargs['RequestItems'], {'test_table': unprocessed})
+        mock_sleep.assert_called_once()
+
+    @patch('lambda_src.db_update_handler.app.time.sleep')
+    def test_unprocessed_items_are_reported_as_throttles(self, mock_sleep):
+        self.mock_dynamodb.batch_write_item.side_effect = [
+            {'UnprocessedItems': {'test_table': _unprocessed('2')}},
+            {'UnprocessedItems': {}},
+        ]
+
+        with patch.object(app.metrics, 'put') as mock_put:
+            app.lambda_handler(_event('1', '2'), None)
+
+        mock_put.assert_any_call('Throttles', 1, 'Count')
+
+    @patch('lambda_src.db_update_handler.app.time.sleep')
+    def test_lambda_handler_reports_items_left_unprocessed(self, mock_sleep):
+        unprocessed = _unprocessed('2')
+        self.mock_dynamodb.batch_write_item.return_value = {'UnprocessedItems': {'test_table': unprocessed}}
+
+        response = app.lambda_handler(_event('1', '2'), None)
+
+        self.assertEqual(response['batchItemFailures'], [{'itemIdentifier': 'm2'}])
+        self.assertEqual(self.mock_dynamodb.batch_write_item.call_count, app.BATCH_WRITE_MAX_ATTEMPTS)
+        self.assertEqual(mock_sleep.call_count, app.BATCH_WRITE_MAX_ATTEMPTS - 1)
+
 
 if __name__ == '__main__':
     unittest.main()
-
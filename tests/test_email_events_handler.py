@@ -0,0 +1,59 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from lambda_src.email_events_handler import app
+from local_pipeline.fakes import FakeDynamoDB
+from order_common.outbox import OUTBOX_TAG, EmailOutbox, tag_value
+
+
+def _notification(event_type, order_id, message_id='ses-1'):
+    mail = {'messageId': message_id, 'tags': {'ses:configuration-set': ['order-emails']}}
+    if order_id is not None:
+        mail['tags'][OUTBOX_TAG] = [tag_value(order_id)]
+    return {'Sns': {'Message': json.dumps({'eventType': event_type, 'mail': mail})}}
+
+
+class TestEmailEventsHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.dynamodb = FakeDynamoDB()
+        self.outbox = EmailOutbox(self.dynamodb, 'outbox', clock=lambda: 1000.0)
+        for order_id in ('1', '2'):
+            self.outbox.add(order_id)
+            self.outbox.mark_sent(order_id, f'ses-{order_id}')
+        patcher = patch.object(app, 'outbox', self.outbox)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        print_patcher = patch('builtins.print')
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def _status(self, order_id):
+        return self.dynamodb.item('outbox', f'email#{order_id}')['delivery_status']['S']
+
+    def test_delivery_status_follows_ses_events(self):
+        response = app.lambda_handler({'Records': [
+            _notification('Send', '1', 'ses-1'),
+            _notification('Delivery', '1', 'ses-1'),
+            _notification('Bounce', '2', 'ses-2'),
+        ]}, None)
+
+        self.assertEqual(json.loads(response['body']), {'delivered': 1, 'bounced': 1})
+        self.assertEqual((self._status('1'), self._status('2')), ('delivered', 'bounced'))
+
+    def test_untagged_and_stale_events_are_ignored(self):
+        app.lambda_handler({'Records': [_notification('Complaint', '1', 'ses-1')]}, None)
+
+        response = app.lambda_handler({'Records': [
+            _notification('Delivery', None),
+            _notification('Delivery', '1', 'ses-1'),
+            _notification('Delivery', '2', 'ses-old'),
+        ]}, None)
+
+        self.assertEqual(json.loads(response['body']), {})
+        self.assertEqual((self._status('1'), self._status('2')), ('complained', 'sent'))
+
+
+if __name__ == '__main__':
+    unittest.main()
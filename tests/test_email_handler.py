@@ -4,10 +4,19 @@ import unittest
 from unittest.mock import MagicMock, patch
 
 from lambda_src.email_handler import app
+from local_pipeline.fakes import FakeDynamoDB
+from order_common.outbox import EmailOutbox
 
 
 class TestEmailHandler(unittest.TestCase):
 
+    def setUp(self):
+        app.idempotency.clear()
+        limiter = patch.object(app, 'send_rate_limiter', MagicMock())
+        self.mock_rate_limiter = limiter.start()
+        self.mock_rate_limiter.acquire.return_value = 0.0
+        self.addCleanup(limiter.stop)
+
     @patch('lambda_src.email_handler.app.ses_client')
     @patch.dict(os.environ, {
         "SENDER_EMAIL": "sender@example.com",
@@ -37,8 +46,127 @@ class TestEmailHandler(unittest.TestCase):
 
         # Assertions
         self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(response['batchItemFailures'], [])
         mock_ses_client.send_email.assert_called_once()
 
+    @patch('lambda_src.email_handler.app.ses_client')
+    def test_lambda_handler_reports_only_failed_records(self, mock_ses_client):
+        mock_ses_client.send_email.side_effect = [
+            {'MessageId': 'ses-1'},
+            Exception('Throttling'),
+            {'MessageId': 'ses-3'},
+        ]
+        event = {
+            'Records': [
+                {'messageId': f'm{i}', 'body': json.dumps({'Message': json.dumps({'order_id': str(i)})})}
+                for i in range(1, 4)
+            ]
+        }
+
+        response = app.lambda_handler(event, None)
+
+        self.assertEqual(response['batchItemFailures'], [{'itemIdentifier': 'm2'}])
+        self.assertEqual(mock_ses_client.send_email.call_count, 3)
+
+    @patch('lambda_src.email_handler.app.ses_client')
+    def test_duplicate_orders_within_and_across_batches_are_sent_once(self, mock_ses_client):
+        mock_ses_client.send_email.return_value = {'MessageId': 'ses-id'}
+
+        def event(*order_ids):
+            return {'Records': [
+                {'messageId': f'm{i}', 'body': json.dumps({'Message': json.dumps({'order_id': order_id})})}
+                for i, order_id in enumerate(order_ids)
+            ]}
+
+        first = app.lambda_handler(event('1', '2', '1'), None)
+        second = app.lambda_handler(event('2', '3'), None)
+
+        self.assertEqual(first['batchItemFailures'], [])
+        self.assertEqual(second['batchItemFailures'], [])
+        subjects = [c.kwargs['Message']['Subject']['Data'] for c in mock_ses_client.send_email.call_args_list]
+        self.assertEqual(subjects, ['Order Confirmation - 1', 'Order Confirmation - 2', 'Order Confirmation - 3'])
+
+    @patch('lambda_src.email_handler.app.ses_client')
+    def test_failed_order_is_not_marked_processed(self, mock_ses_client):
+        mock_ses_client.send_email.side_effect = [Exception('Throttling'), {'MessageId': 'ses-id'}]
+        event = {'Records': [
+            {'messageId': 'm1', 'body': json.dumps({'Message': json.dumps({'order_id': '1'})})}
+        ]}
+
+        self.assertEqual(app.lambda_handler(event, None)['batchItemFailures'], [{'itemIdentifier': 'm1'}])
+        self.assertEqual(app.lambda_handler(event, None)['batchItemFailures'], [])
+        self.assertEqual(mock_ses_client.send_email.call_count, 2)
+
+    @patch.object(app, 'EMAIL_SEND_MODE', 'bulk')
+    @patch.object(app, 'SES_TEMPLATE_NAME', 'OrderConfirmation')
+    @patch('lambda_src.email_handler.app.ses_client')
+    def test_bulk_mode_sends_batch_in_one_call_and_maps_failures(self, mock_ses_client):
+        mock_ses_client.send_bulk_templated_email.return_value = {'Status': [
+            {'Status': 'Success', 'MessageId': 'ses-1'},
+            {'Status': 'MessageRejected', 'Error': 'Email address is not verified.'},
+            {'Status': 'Success', 'MessageId': 'ses-3'},
+        ]}
+        event = {'Records': [
+            {'messageId': f'm{i}', 'body': json.dumps({'Message': json.dumps({'order_id': str(i)})})}
+            for i in range(1, 4)
+        ]}
+
+        response = app.lambda_handler(event, None)
+
+        self.assertEqual(response['batchItemFailures'], [{'itemIdentifier': 'm2'}])
+        mock_ses_client.send_email.assert_not_called()
+        mock_ses_client.send_bulk_templated_email.assert_called_once()
+        kwargs = mock_ses_client.send_bulk_templated_email.call_args.kwargs
+        self.assertEqual(kwargs['Template'], 'OrderConfirmation')
+        self.assertEqual([json.loads(d['ReplacementTemplateData'])['order_id'] for d in kwargs['Destinations']],
+                         ['1', '2', '3'])
+        self.mock_rate_limiter.acquire.assert_called_once_with(3)
+
+    @patch.object(app, 'EMAIL_SEND_MODE', 'bulk')
+    @patch('lambda_src.email_handler.app.ses_client')
+    def test_bulk_mode_chunks_destinations_and_fails_rejected_calls(self, mock_ses_client):
+        mock_ses_client.send_bulk_templated_email.side_effect = [
+            {'Status': [{'Status': 'Success'}] * 50},
+            Exception('Throttling'),
+        ]
+
+        failures = app.send_order_emails_bulk([str(i) for i in range(60)])
+
+        self.assertEqual(sorted(failures), list(range(50, 60)))
+        self.assertEqual(mock_ses_client.send_bulk_templated_email.call_count, 2)
+
+
+@patch.object(app, 'EMAIL_DELIVERY_MODE', 'outbox')
+class TestEmailHandlerOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.dynamodb = FakeDynamoDB()
+        for name, value in (('outbox', EmailOutbox(self.dynamodb, 'outbox', clock=lambda: 1000.0)),
+                            ('ses_client', MagicMock())):
+            patcher = patch.object(app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _event(self, *order_ids):
+        return {'Records': [{'messageId': f'm{i}', 'body': json.dumps({'order_id': order_id})}
+                            for i, order_id in enumerate(order_ids)]}
+
+    def test_orders_are_queued_once_without_calling_ses(self):
+        first = app.lambda_handler(self._event('1', '2', '1'), None)
+        second = app.lambda_handler(self._event('2', '3'), None)
+
+        self.assertEqual((first['batchItemFailures'], second['batchItemFailures']), ([], []))
+        self.assertEqual(sorted(self.dynamodb.tables['outbox']), [('email#1', None), ('email#2', None),
+                                                                  ('email#3', None)])
+        self.assertEqual(self.dynamodb.item('outbox', 'email#1')['delivery_status'], {'S': 'pending'})
+        app.ses_client.send_email.assert_not_called()
+
+    def test_outbox_errors_fail_the_record(self):
+        with patch.object(app.outbox, 'add', side_effect=[True, Exception('ProvisionedThroughputExceeded')]):
+            response = app.lambda_handler(self._event('1', '2'), None)
+
+        self.assertEqual(response['batchItemFailures'], [{'itemIdentifier': 'm1'}])
+
 
 if __name__ == '__main__':
     unittest.main()
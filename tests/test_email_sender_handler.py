@@ -0,0 +1,100 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from lambda_src.email_sender_handler import app
+from local_pipeline.fakes import FakeDynamoDB, ManualClock
+from order_common.outbox import INDEX_KEYS, OUTBOX_TAG, EmailOutbox, order_id_from_tag
+
+
+def _error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'SendEmail')
+
+
+class TestEmailSenderHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = ManualClock(1000.0)
+        self.dynamodb = FakeDynamoDB(indexes=INDEX_KEYS)
+        self.outbox = EmailOutbox(self.dynamodb, 'outbox', clock=self.clock)
+        self.ses = MagicMock()
+        self.ses.send_email.side_effect = lambda **kwargs: {'MessageId': f"ses-{len(self.ses.send_email.mock_calls)}"}
+        self.limiter = MagicMock()
+        self.limiter.acquire.return_value = 0.0
+        patcher = patch.multiple(app, outbox=self.outbox, ses_client=self.ses, send_rate_limiter=self.limiter,
+                                 SES_CONFIGURATION_SET='order-emails', EMAIL_MAX_ATTEMPTS=3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        print_patcher = patch('builtins.print')
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def _status(self, order_id):
+        return self.dynamodb.item('outbox', f'email#{order_id}')['delivery_status']['S']
+
+    def _run(self):
+        return json.loads(app.lambda_handler({}, None)['body'])
+
+    def test_due_emails_are_sent_paced_and_tagged(self):
+        for order_id in ('1', '2', '3'):
+            self.outbox.add(order_id)
+
+        self.assertEqual(self._run(), {'sent': 3})
+
+        self.assertEqual(self.limiter.acquire.call_count, 3)
+        request = self.ses.send_email.call_args.kwargs
+        self.assertEqual(request['ConfigurationSetName'], 'order-emails')
+        tag, = request['Tags']
+        self.assertEqual(tag['Name'], OUTBOX_TAG)
+        self.assertIn(order_id_from_tag(tag['Value']), {'1', '2', '3'})
+        self.assertEqual({self._status(order_id) for order_id in ('1', '2', '3')}, {'sent'})
+        self.assertEqual(self._run(), {})
+
+    def test_throttled_sends_are_retried_with_backoff(self):
+        self.outbox.add('1')
+        self.outbox.add('2')
+        self.ses.send_email.side_effect = [_error('Throttling'), {'MessageId': 'ses-2'}, {'MessageId': 'ses-1'}]
+
+        first = self._run()
+        self.assertEqual(first, {'throttled': 1, 'sent': 1})
+        # The sender paused for a second's worth of sends after the throttle.
+        self.limiter.acquire.assert_any_call(app.SES_SEND_RATE)
+        self.assertEqual(self._run(), {})
+
+        self.clock.advance(app.EMAIL_RETRY_BASE_SECONDS)
+        self.assertEqual(self._run(), {'sent': 1})
+        items = [self.dynamodb.item('outbox', f'email#{order_id}') for order_id in ('1', '2')]
+        self.assertEqual([item['delivery_status']['S'] for item in items], ['sent', 'sent'])
+        self.assertEqual(sorted(item['attempts']['N'] for item in items), ['1', '2'])
+
+    def test_permanent_errors_and_exhausted_retries_fail_the_email(self):
+        self.outbox.add('rejected')
+        self.outbox.add('flaky')
+
+        def send_email(Message, **_):
+            if Message['Subject']['Data'].endswith('rejected'):
+                raise _error('MessageRejected')
+            raise _error('ServiceUnavailable')
+        self.ses.send_email.side_effect = send_email
+
+        results = []
+        for _ in range(3):
+            results.append(self._run())
+            self.clock.advance(3600)
+
+        self.assertEqual(results, [{'failed': 1, 'retry': 1}, {'retry': 1}, {'failed': 1}])
+        self.assertEqual((self._status('rejected'), self._status('flaky')), ('failed', 'failed'))
+
+    def test_stops_before_the_invocation_times_out(self):
+        self.outbox.add('1')
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = app.STOP_MARGIN_SECONDS * 1000
+
+        self.assertEqual(json.loads(app.lambda_handler({}, context)['body']), {})
+        self.ses.send_email.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+
+import lambda_src  # noqa: F401  Puts the shared layer on sys.path.
+from order_common.idempotency import IdempotencyStore
+
+
+def _cancelled(*reasons):
+    return ClientError({
+        'Error': {'Code': 'TransactionCanceledException', 'Message': 'cancelled'},
+        'CancellationReasons': list(reasons),
+    }, 'TransactWriteItems')
+
+
+def _taken(status):
+    return {'Code': 'ConditionalCheckFailed', 'Item': {'status': {'S': status}}}
+
+
+class TestIdempotencyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dynamodb = MagicMock()
+        self.dynamodb.batch_write_item.return_value = {'UnprocessedItems': {}}
+        self.store = IdempotencyStore(self.dynamodb, 'idempotency', namespace='email', clock=lambda: 1000)
+
+    def test_claims_batch_in_one_transaction_and_drops_duplicates_in_batch(self):
+        claimed, busy = self.store.claim_many(['1', '2', '1', None])
+
+        self.assertEqual((claimed, busy), ({'1', '2'}, set()))
+        self.dynamodb.transact_write_items.assert_called_once()
+        actions = self.dynamodb.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual([a['Put']['Item']['PK']['S'] for a in actions], ['email#1', 'email#2'])
+        self.assertEqual(actions[0]['Put']['Item']['status'], {'S': 'IN_PROGRESS'})
+        self.assertEqual(actions[0]['Put']['TableName'], 'idempotency')
+
+    def test_completed_keys_are_skipped_without_dynamodb_call(self):
+        self.store.claim_many(['1'])
+        self.store.complete(['1'])
+        self.dynamodb.transact_write_items.reset_mock()
+
+        claimed, busy = self.store.claim_many(['1'])
+
+        self.assertEqual((claimed, busy), (set(), set()))
+        self.dynamodb.transact_write_items.assert_not_called()
+
+    def test_keys_taken_in_table_are_split_into_duplicates_and_busy(self):
+        self.dynamodb.transact_write_items.side_effect = [
+            _cancelled({'Code': 'None'}, _taken('COMPLETED'), _taken('IN_PROGRESS')),
+            None,
+        ]
+
+        claimed, busy = self.store.claim_many(['1', '2', '3'])
+
+        self.assertEqual((claimed, busy), ({'1'}, {'3'}))
+        retry = self.dynamodb.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual([a['Put']['Item']['PK']['S'] for a in retry], ['email#1'])
+        # The completed key is now known locally.
+        self.assertEqual(self.store.claim_many(['2']), (set(), set()))
+
+    def test_other_cancellations_are_raised(self):
+        self.dynamodb.transact_write_items.side_effect = _cancelled({'Code': 'TransactionConflict'})
+
+        with self.assertRaises(ClientError):
+            self.store.claim_many(['1'])
+
+    def test_complete_and_release_write_in_batches(self):
+        self.store.complete([str(i) for i in range(30)])
+        self.store.release(['x'])
+
+        calls = self.dynamodb.batch_write_item.call_args_list
+        self.assertEqual([len(c.kwargs['RequestItems']['idempotency']) for c in calls], [25, 5, 1])
+        self.assertEqual(calls[0].kwargs['RequestItems']['idempotency'][0]['PutRequest']['Item'],
+                         {'PK': {'S': 'email#0'}, 'status': {'S': 'COMPLETED'},
+                          'expires_at': {'N': str(1000 + 24 * 3600)}})
+        self.assertEqual(calls[2].kwargs['RequestItems']['idempotency'],
+                         [{'DeleteRequest': {'Key': {'PK': {'S': 'email#x'}}}}])
+
+    def test_in_memory_only_store(self):
+        store = IdempotencyStore(None, None, namespace='db_update', cache_size=2)
+
+        self.assertEqual(store.claim_many(['1', '1', '2']), ({'1', '2'}, set()))
+        store.complete(['1', '2', '3'])
+        # The oldest completed key was evicted from the LRU.
+        self.assertEqual(store.claim_many(['1', '3']), ({'1'}, set()))
+
+
+if __name__ == '__main__':
+    unittest.main()
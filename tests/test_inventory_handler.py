@@ -2,21 +2,31 @@ import json
 import unittest
 from unittest.mock import MagicMock, patch
 
+from botocore.exceptions import ClientError
+
 from lambda_src.inventory_handler import app
+from local_pipeline.fakes import FakeDynamoDB
+
+
+def _conditional_check_failed():
+    return ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'failed'}}, 'UpdateItem')
+
+
+def _updated(stock_quantity):
+    return {'Attributes': {'stock_quantity': {'N': str(stock_quantity)}}}
 
 
 class TestInventoryHandler(unittest.TestCase):
 
-    @patch('boto3.resource')
-    def test_lambda_handler_success(self, mock_boto_resource):
-        # Mock DynamoDB table
-        mock_table = MagicMock()
-        mock_boto_resource.return_value.Table.return_value = mock_table
-        mock_table.get_item.return_value = {
-            'Item': {
-                'stock_quantity': 100
-            }
-        }
+    def setUp(self):
+        app.idempotency.clear()
+        app.INVENTORY_TABLE_NAME = 'test_table'
+        patcher = patch.object(app, 'dynamodb')
+        self.mock_dynamodb = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lambda_handler_success(self):
+        self.mock_dynamodb.update_item.return_value = _updated(99)
 
         # Mock event
         event = {
@@ -31,18 +41,167 @@ class TestInventoryHandler(unittest.TestCase):
             ]
         }
 
-        # Set environment variable
-        app.ORDERS_TABLE_NAME = 'test_table'
-        app.table = mock_table
-
         # Call the handler
         response = app.lambda_handler(event, None)
 
         # Assertions
         self.assertEqual(response['statusCode'], 200)
-        mock_table.put_item.assert_called_once_with(Item={'PK': 'inventory', 'stock_quantity': 99})
+        self.mock_dynamodb.get_item.assert_not_called()
+        self.mock_dynamodb.put_item.assert_not_called()
+        self.mock_dynamodb.update_item.assert_called_once()
+        kwargs = self.mock_dynamodb.update_item.call_args.kwargs
+        self.assertEqual(kwargs['TableName'], 'test_table')
+        self.assertEqual(kwargs['Key'], {'PK': {'S': 'inventory'}})
+        self.assertEqual(kwargs['ExpressionAttributeValues'], {':initial': {'N': '100'}, ':qty': {'N': '1'}})
+        self.assertIn('stock_quantity >= :qty', kwargs['ConditionExpression'])
+
+    def test_lambda_handler_reports_out_of_stock_records(self):
+        self.mock_dynamodb.update_item.side_effect = _conditional_check_failed()
+
+        event = {'Records': [{'messageId': 'm1', 'body': json.dumps({'Message': json.dumps({'order_id': '123'})})}]}
+
+        response = app.lambda_handler(event, None)
+
+        self.assertEqual(response['batchItemFailures'], [{'itemIdentifier': 'm1'}])
+
+    def test_lambda_handler_coalesces_orders_per_sku(self):
+        orders = [
+            {'order_id': '1', 'items': [{'sku': 'A', 'quantity': 2}, {'sku': 'B', 'quantity': 1}]},
+            {'order_id': '2', 'items': [{'sku': 'A', 'quantity': 3}]},
+            {'order_id': '3'},
+        ]
+        event = {'Records': [
+            {'messageId': f'm{i}', 'body': json.dumps({'Message': json.dumps(order)})}
+            for i, order in enumerate(orders)
+        ]}
+
+        response = app.lambda_handler(event, None)
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(response['batchItemFailures'], [])
+        self.mock_dynamodb.update_item.assert_not_called()
+        self.mock_dynamodb.transact_write_items.assert_called_once()
+        actions = self.mock_dynamodb.transact_write_items.call_args.kwargs['TransactItems']
+        net = {a['Update']['Key']['PK']['S']: a['Update']['ExpressionAttributeValues'][':qty']['N'] for a in actions}
+        self.assertEqual(net, {'inventory#A': '5', 'inventory#B': '1', 'inventory': '1'})
+
+    def test_lambda_handler_reports_only_undecodable_records(self):
+        self.mock_dynamodb.update_item.return_value = _updated(99)
+
+        event = {'Records': [
+            {'messageId': 'good', 'body': json.dumps({'Message': json.dumps({'order_id': '1'})})},
+            {'messageId': 'bad', 'body': 'not json'},
+        ]}
+
+        response = app.lambda_handler(event, None)
+
+        self.assertEqual(response['batchItemFailures'], [{'itemIdentifier': 'bad'}])
+        self.mock_dynamodb.update_item.assert_called_once()
+
+    def test_orders_held_by_another_invocation_are_retried(self):
+        self.mock_dynamodb.update_item.return_value = _updated(99)
+        idempotency_client = MagicMock()
+        idempotency_client.batch_write_item.return_value = {'UnprocessedItems': {}}
+        idempotency_client.transact_write_items.side_effect = [
+            ClientError({
+                'Error': {'Code': 'TransactionCanceledException', 'Message': 'cancelled'},
+                'CancellationReasons': [
+                    {'Code': 'None'},
+                    {'Code': 'ConditionalCheckFailed', 'Item': {'status': {'S': 'IN_PROGRESS'}}},
+                    {'Code': 'ConditionalCheckFailed', 'Item': {'status': {'S': 'COMPLETED'}}},
+                ]
+            }, 'TransactWriteItems'),
+            None,
+        ]
+        event = {'Records': [
+            {'messageId': f'm{order_id}', 'body': json.dumps({'Message': json.dumps({'order_id': order_id})})}
+            for order_id in ('1', '2', '3')
+        ]}
+        store = app.IdempotencyStore(idempotency_client, 'idempotency', namespace='inventory')
+
+        with patch.object(app, 'idempotency', store):
+            response = app.lambda_handler(event, None)
+
+        # Order 2 is in flight elsewhere, order 3 was already applied.
+        self.assertEqual(response['batchItemFailures'], [{'itemIdentifier': 'm2'}])
+        self.mock_dynamodb.update_item.assert_called_once()
+        self.assertEqual(self.mock_dynamodb.update_item.call_args.kwargs['ExpressionAttributeValues'][':qty'],
+                         {'N': '1'})
+
+    def test_cancelled_transaction_falls_back_to_per_order_updates(self):
+        self.mock_dynamodb.update_item.side_effect = [
+            _updated(1),
+            _conditional_check_failed(),
+            _updated(0),
+        ]
+        self.mock_dynamodb.transact_write_items.side_effect = ClientError(
+            {'Error': {'Code': 'TransactionCanceledException', 'Message': 'cancelled'}}, 'TransactWriteItems')
+
+        failed = app.apply_inventory_updates({'m1': {'A': 1}, 'm2': {'A': 5}, 'm3': {'B': 1}})
+
+        self.assertEqual(failed, {'m2'})
+        self.assertEqual(self.mock_dynamodb.update_item.call_count, 3)
+
+    def test_a_rejected_order_takes_none_of_its_skus(self):
+        dynamodb = FakeDynamoDB()
+        dynamodb.put_item(TableName='test_table', Item={'PK': {'S': 'inventory#A'}, 'stock_quantity': {'N': '10'}})
+        dynamodb.put_item(TableName='test_table', Item={'PK': {'S': 'inventory#B'}, 'stock_quantity': {'N': '0'}})
+
+        with patch.object(app, 'dynamodb', dynamodb):
+            failed = app.apply_inventory_updates({'m1': {'A': 2, 'B': 1}, 'm2': {'A': 3}})
+            # A retry of m1 must not take A again.
+            retried = app.apply_inventory_updates({'m1': {'A': 2, 'B': 1}})
+
+        self.assertEqual((failed, retried), ({'m1'}, {'m1'}))
+        self.assertEqual(dynamodb.item('test_table', 'inventory#A')['stock_quantity'], {'N': '7'})
+
+    def test_invalid_line_items_fail_their_record(self):
+        self.mock_dynamodb.update_item.return_value = _updated(99)
+        orders = [
+            {'order_id': '1', 'items': [{'sku': 'A', 'quantity': 0}]},
+            {'order_id': '2', 'items': [{'sku': 'A', 'quantity': -1}]},
+            {'order_id': '3', 'items': [{'sku': f'sku-{i}'} for i in range(app.MAX_TRANSACTION_ITEMS + 1)]},
+            {'order_id': '4', 'items': [{'sku': 'A', 'quantity': 2}]},
+        ]
+        event = {'Records': [
+            {'messageId': f'm{i}', 'body': json.dumps({'Message': json.dumps(order)})}
+            for i, order in enumerate(orders)
+        ]}
+
+        response = app.lambda_handler(event, None)
+
+        self.assertEqual({f['itemIdentifier'] for f in response['batchItemFailures']}, {'m0', 'm1', 'm2'})
+        self.mock_dynamodb.update_item.assert_called_once()
+        self.assertEqual(self.mock_dynamodb.update_item.call_args.kwargs['ExpressionAttributeValues'][':qty'],
+                         {'N': '2'})
+
+    @patch.object(app, 'INVENTORY_SHARD_COUNT', 4)
+    @patch('lambda_src.inventory_handler.app.random.randrange', return_value=2)
+    def test_decrement_falls_through_exhausted_shards(self, _mock_randrange):
+        self.mock_dynamodb.update_item.side_effect = [
+            _conditional_check_failed(),
+            _updated(24),
+        ]
+
+        shard, new_stock = app.decrement_stock()
+
+        self.assertEqual((shard, new_stock), (3, 24))
+        keys = [c.kwargs['Key']['PK']['S'] for c in self.mock_dynamodb.update_item.call_args_list]
+        self.assertEqual(keys, ['inventory#2', 'inventory#3'])
+
+    @patch.object(app, 'INVENTORY_SHARD_COUNT', 3)
+    def test_get_stock_quantity_sums_shards(self):
+        self.mock_dynamodb.batch_get_item.return_value = {
+            'Responses': {'test_table': [
+                {'PK': {'S': 'inventory#0'}, 'stock_quantity': {'N': '10'}},
+                {'PK': {'S': 'inventory#2'}, 'stock_quantity': {'N': '5'}},
+            ]},
+            'UnprocessedKeys': {}
+        }
+
+        # Shard 1 was never written, so it still holds its initial 33 items.
+        self.assertEqual(app.get_stock_quantity(), 10 + 33 + 5)
 
 
 if __name__ == '__main__':
     unittest.main()
-
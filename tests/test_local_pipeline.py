@@ -0,0 +1,229 @@
+import json
+import random
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from local_pipeline.fakes import FakeQueue, ManualClock
+from local_pipeline.load import run_load
+from local_pipeline.pipeline import INVENTORY_TABLE_NAME, ORDERS_TABLE_NAME, LocalPipeline
+from order_common.orders_table import get_order
+from order_processing_stack.config import OrderProcessingConfig
+
+
+class TestFakeQueue(unittest.TestCase):
+
+    def test_unacknowledged_messages_reappear_then_go_to_the_dlq(self):
+        clock = ManualClock()
+        dlq = FakeQueue('dlq', 30, clock=clock)
+        queue = FakeQueue('q', 30, max_receive_count=2, dead_letter_queue=dlq, clock=clock)
+        queue.send('hello')
+
+        first = queue.receive()
+        self.assertEqual(len(first), 1)
+        self.assertEqual(queue.receive(), [])
+
+        clock.advance(30)
+        second = queue.receive()
+        self.assertEqual(second[0]['attributes']['ApproximateReceiveCount'], '2')
+        # The first receipt handle is stale once the message was received again.
+        self.assertIsNone(queue.delete(first[0]['receiptHandle']))
+
+        clock.advance(30)
+        self.assertEqual(queue.receive(), [])
+        self.assertEqual((len(queue), len(dlq)), (0, 1))
+
+    def test_fifo_groups_are_delivered_in_order(self):
+        clock = ManualClock()
+        queue = FakeQueue('q.fifo', 30, clock=clock, fifo=True)
+        for body, group in (('a1', 'a'), ('a2', 'a'), ('b1', 'b'), ('a3', 'a'), ('b2', 'b')):
+            queue.send(body, group_id=group)
+
+        first = queue.receive(2)
+        self.assertEqual([r['body'] for r in first], ['a1', 'a2'])
+        # Group a is in flight; group b is not held back by it.
+        second = queue.receive()
+        self.assertEqual([r['body'] for r in second], ['b1', 'b2'])
+        for record in [first[1]] + second:
+            queue.delete(record['receiptHandle'])
+        self.assertEqual(queue.receive(), [])
+
+        # a1 was never deleted: it comes back before a3.
+        clock.advance(30)
+        self.assertEqual([r['body'] for r in queue.receive()], ['a1', 'a3'])
+
+    def test_fifo_groups_are_processed_in_parallel_and_in_order(self):
+        # Time never passes: a failed record is released explicitly, as the
+        # visibility timeout would, so no record can time out mid-test.
+        queue = FakeQueue('q.fifo', 30, clock=ManualClock(), fifo=True)
+        for seq in range(5):
+            for group in range(8):
+                queue.send(str(seq), group_id=str(group))
+        processed = {str(group): [] for group in range(8)}
+        failed_once = set()
+        lock = threading.Lock()
+        holding = [0]
+        overlapped = threading.Event()
+
+        def work():
+            while len(queue):
+                records = queue.receive(4)
+                if not records:
+                    time.sleep(0.001)
+                    continue
+                with lock:
+                    holding[0] += 1
+                    if holding[0] > 1:
+                        overlapped.set()
+                # Hold the records until another worker holds some too.
+                overlapped.wait(5)
+                failed_groups = set()
+                for record in records:
+                    group = record['attributes']['MessageGroupId']
+                    if group not in failed_groups and record['body'] == '2' and group not in failed_once:
+                        failed_once.add(group)
+                        failed_groups.add(group)
+                    if group in failed_groups:
+                        queue.change_visibility(record['receiptHandle'], 0)
+                        continue
+                    processed[group].append(int(record['body']))
+                    queue.delete(record['receiptHandle'])
+                with lock:
+                    holding[0] -= 1
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for future in [executor.submit(work) for _ in range(4)]:
+                future.result()
+
+        self.assertEqual(processed, {str(group): [0, 1, 2, 3, 4] for group in range(8)})
+        self.assertTrue(overlapped.is_set())
+
+
+class TestLocalPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = ManualClock(1000.0)
+
+    def _orders(self, count):
+        return [{'order_id': str(i), 'amount_total': 100} for i in range(count)]
+
+    def test_orders_reach_every_consumer_once(self):
+        with LocalPipeline(clock=self.clock, duplicate_rate=1.0, rng=random.Random(0)) as pipeline:
+            for order in self._orders(25):
+                self.assertEqual(pipeline.post(order)['statusCode'], 200)
+            pipeline.post(self._orders(1)[0])  # A client retry of order 0.
+            pipeline.drain()
+            report = pipeline.report()
+
+        # Every delivery was duplicated by SNS and order 0 was posted twice.
+        self.assertEqual(report['queues']['email']['sent'], 52)
+        self.assertEqual((report['emails_sent'], report['duplicate_emails']), (25, 0))
+        self.assertEqual(report['orders_saved'], 25)
+        stock = pipeline.dynamodb.item(INVENTORY_TABLE_NAME, 'inventory')['stock_quantity']['N']
+        self.assertEqual(int(stock), 1000000 - 25)
+        self.assertEqual(report['dead_letter_counts'], {'email': 0, 'inventory': 0, 'db_update': 0})
+
+    def test_batch_webhook_publishes_every_order(self):
+        with LocalPipeline(clock=self.clock) as pipeline:
+            response = pipeline.post_batch(self._orders(25))
+            pipeline.drain()
+            report = pipeline.report()
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(pipeline.sns.stats['published'], 25)
+        self.assertEqual((report['orders_saved'], report['emails_sent']), (25, 25))
+
+    def test_fifo_ordering(self):
+        config = OrderProcessingConfig(fifo_ordering=True)
+        with LocalPipeline(config=config, clock=self.clock, duplicate_rate=1.0, rng=random.Random(0)) as pipeline:
+            orders = self._orders(30)
+            for order in orders[:25]:
+                pipeline.post(order)
+            pipeline.post(orders[0])  # A client retry, dropped by content-based deduplication.
+            pipeline.post_batch(orders[25:])
+            pipeline.drain()
+            report = pipeline.report()
+
+        self.assertEqual(pipeline.sns.stats['deduplicated'], 1)
+        self.assertEqual(report['queues']['email']['sent'], 30)
+        self.assertEqual((report['orders_saved'], report['emails_sent']), (30, 30))
+        self.assertEqual({consumer.batch_size for consumer in pipeline.consumers}, {10})
+
+    def test_fifo_order_updates_leave_the_latest_state(self):
+        config = OrderProcessingConfig(fifo_ordering=True)
+        with LocalPipeline(config=config, clock=self.clock) as pipeline:
+            def publish(order_id, amount_total, items):
+                message = {'order_id': order_id, 'amount_total': amount_total, 'items': items}
+                pipeline.sns.publish(TopicArn=pipeline.sns.topic_arn, Message=json.dumps(message),
+                                     MessageGroupId=order_id)
+
+            # Order 1 is created and updated in one batch, order 2 in two.
+            publish('1', 100, [{'sku': 'A', 'quantity': 2}])
+            publish('1', 150, [{'sku': 'A', 'quantity': 5}, {'sku': 'B', 'quantity': 1}])
+            publish('2', 60, [{'sku': 'A', 'quantity': 3}])
+            pipeline.drain()
+            publish('2', 30, [{'sku': 'A', 'quantity': 1}])
+            pipeline.drain()
+            report = pipeline.report()
+
+        self.assertEqual([get_order(pipeline.dynamodb, ORDERS_TABLE_NAME, order_id)['amount_total']
+                          for order_id in ('1', '2')], [150, 30])
+        stock = {sku: int(pipeline.dynamodb.item(INVENTORY_TABLE_NAME, f'inventory#{sku}')['stock_quantity']['N'])
+                 for sku in ('A', 'B')}
+        self.assertEqual(stock, {'A': 1000000 - 5 - 1, 'B': 1000000 - 1})
+        # The confirmation email is sent once per order.
+        self.assertEqual((report['emails_sent'], report['duplicate_emails']), (2, 0))
+
+    def test_outbox_decouples_the_email_queue_from_ses_throttling(self):
+        config = OrderProcessingConfig(email_delivery_mode='outbox')
+        with LocalPipeline(config=config, clock=self.clock, ses_throttle_rate=0.5,
+                           rng=random.Random(1)) as pipeline:
+            for order in self._orders(20):
+                pipeline.post(order)
+            while pipeline.pending():
+                pipeline.pump()
+            # The email queue drained before any email was sent.
+            self.assertEqual((len(pipeline.queues['email']), len(pipeline.pending_emails())), (0, 20))
+            pipeline.drain()
+            report = pipeline.report()
+
+        self.assertGreater(pipeline.ses.stats['throttled'], 0)
+        self.assertEqual((report['emails_sent'], report['duplicate_emails'], report['emails_pending']), (20, 0, 0))
+        self.assertEqual(report['queues']['email'].get('redelivered', 0), 0)
+        self.assertEqual(report['dead_letter_counts']['email'], 0)
+
+    def test_failing_records_are_retried_then_dead_lettered(self):
+        config = OrderProcessingConfig()
+        with LocalPipeline(config=config, clock=self.clock, initial_stock=3) as pipeline:
+            for order in self._orders(5):
+                pipeline.post(order)
+            pipeline.drain()
+            report = pipeline.report()
+
+        self.assertEqual(report['queues']['inventory']['redelivered'], 2)
+        self.assertEqual(report['dead_letter_counts']['inventory'], 2)
+        self.assertEqual(report['dead_letter_counts']['email'], 0)
+        # Retries waited out the visibility timeout on the manual clock.
+        self.assertGreaterEqual(self.clock(), 1000.0 + 2 * config.inventory.visibility_timeout_seconds)
+
+    def test_signed_webhooks(self):
+        with LocalPipeline(clock=self.clock, auth_mode='stripe_signature') as pipeline:
+            order = self._orders(1)[0]
+            self.assertEqual(pipeline.post(order)['statusCode'], 200)
+            forged = pipeline.webhook_event(order)
+            forged['body'] = forged['body'].replace('100', '1')
+            self.assertEqual(pipeline.post(order, event=forged)['statusCode'], 403)
+
+    def test_run_load_reports_throughput_and_latency(self):
+        report = run_load(200, rate=0, duplicate_rate=0.05, sns_duplicate_rate=0.05, visibility_timeout=0.1)
+
+        self.assertEqual(report['orders_saved'], 200)
+        self.assertEqual(report['duplicate_emails'], 0)
+        self.assertGreater(report['events_posted'], 200)
+        self.assertIn('p99', report['latency_ms']['end_to_end.email'])
+        self.assertGreater(report['throughput'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
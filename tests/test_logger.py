@@ -0,0 +1,71 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+import lambda_src  # noqa: F401  Puts the shared layer on sys.path.
+from order_common.logger import Logger
+
+
+class TestLogger(unittest.TestCase):
+
+    def _lines(self, mock_print):
+        return [json.loads(c.args[0]) for c in mock_print.call_args_list]
+
+    @patch('builtins.print')
+    def test_writes_one_json_object_per_line(self, mock_print):
+        logger = Logger('email', clock=lambda: 12.5)
+
+        logger.error('Failed to send %d email(s)', 2, order_id='cs_1', error=ValueError('boom'))
+
+        self.assertEqual(self._lines(mock_print), [{
+            'level': 'ERROR', 'timestamp': 12500, 'logger': 'email',
+            'message': 'Failed to send 2 email(s)', 'order_id': 'cs_1', 'error': 'boom',
+        }])
+
+    @patch('builtins.print')
+    def test_lines_below_the_level_are_not_formatted(self, mock_print):
+        logger = Logger('email', level='INFO')
+        expensive = MagicMock()
+
+        logger.debug('Sending email', recipient=expensive)
+
+        mock_print.assert_not_called()
+        expensive.assert_not_called()
+
+    @patch('builtins.print')
+    def test_request_id_and_bound_fields_are_added_to_every_line(self, mock_print):
+        logger = Logger('email')
+        layer_logger = Logger('order_common.aws')
+
+        @logger.inject_context
+        def handler(event, context):
+            with logger.bind(message_id='m-1', order_id='cs_1'):
+                logger.info('Email sent')
+                layer_logger.warning('Could not prewarm the ses client')
+            logger.info('Batch done')
+
+        handler({}, MagicMock(aws_request_id='req-1'))
+        logger.info('Outside an invocation')
+
+        lines = self._lines(mock_print)
+        self.assertEqual([line.get('request_id') for line in lines], ['req-1', 'req-1', 'req-1', None])
+        self.assertEqual([line.get('order_id') for line in lines], ['cs_1', 'cs_1', None, None])
+        self.assertEqual(lines[1]['logger'], 'order_common.aws')
+
+    @patch('builtins.print')
+    def test_events_are_only_logged_at_debug_level_when_sampled(self, mock_print):
+        handler = Logger('email', level='INFO', sample_rate=1.0).inject_context(lambda event, context: None)
+        handler({'order_id': '1'}, None)
+        mock_print.assert_not_called()
+
+        handler = Logger('email', level='DEBUG', sample_rate=0.5).inject_context(lambda event, context: None)
+        with patch('order_common.logger.random.random', side_effect=[0.7, 0.2]):
+            handler({'order_id': '1'}, None)
+            mock_print.assert_not_called()
+            handler({'order_id': '1'}, None)
+        (line,) = self._lines(mock_print)
+        self.assertEqual((line['message'], line['event']), ('Received event', {'order_id': '1'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
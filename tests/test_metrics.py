@@ -0,0 +1,92 @@
+import ast
+import json
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import lambda_src  # noqa: F401  Puts the shared layer on sys.path.
+from order_common.metrics import Metrics
+
+HANDLERS = sorted(Path(lambda_src.__file__).parent.glob('*_handler/app.py'))
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.metrics = Metrics('email', namespace='Test', clock=self.clock)
+
+    def _documents(self, mock_print):
+        return [json.loads(c.args[0]) for c in mock_print.call_args_list]
+
+    @patch('builtins.print')
+    def test_flush_writes_emf_document(self, mock_print):
+        with self.metrics.timer('SesLatency'):
+            self.clock.now += 0.25
+        self.metrics.put('BatchSize', 3, 'Count')
+
+        self.metrics.flush()
+
+        [document] = self._documents(mock_print)
+        directive = document['_aws']['CloudWatchMetrics'][0]
+        self.assertEqual(directive['Namespace'], 'Test')
+        self.assertEqual(directive['Dimensions'], [['Service']])
+        self.assertEqual(directive['Metrics'], [{'Name': 'SesLatency', 'Unit': 'Milliseconds'},
+                                                {'Name': 'BatchSize', 'Unit': 'Count'}])
+        self.assertEqual((document['Service'], document['SesLatency'], document['BatchSize']), ('email', 250.0, 3))
+
+        # Values are reset after a flush.
+        mock_print.reset_mock()
+        self.metrics.flush()
+        mock_print.assert_not_called()
+
+    @patch('builtins.print')
+    def test_flush_splits_more_than_100_values(self, mock_print):
+        for i in range(150):
+            self.metrics.put('DynamoDBLatency', i)
+        self.metrics.put('BatchSize', 150, 'Count')
+
+        self.metrics.flush()
+
+        first, second = self._documents(mock_print)
+        self.assertEqual(len(first['DynamoDBLatency']), 100)
+        self.assertEqual(first['BatchSize'], 150)
+        self.assertEqual(second['DynamoDBLatency'], list(range(100, 150)))
+        self.assertNotIn('BatchSize', second)
+
+    @patch('builtins.print')
+    def test_instrument_records_cold_start_once(self, mock_print):
+        handler = self.metrics.instrument(lambda event, context: 'ok')
+
+        self.assertEqual(handler({'Records': [{}, {}]}, None), 'ok')
+        self.assertEqual(handler({'Records': [{}]}, None), 'ok')
+
+        cold, warm = self._documents(mock_print)
+        self.assertEqual((cold['ColdStart'], cold['BatchSize']), (1, 2))
+        self.assertIn('InitDuration', cold)
+        self.assertEqual((warm['ColdStart'], warm['BatchSize']), (0, 1))
+        self.assertNotIn('InitDuration', warm)
+
+    def test_handlers_import_order_common_before_the_sdk(self):
+        # InitDuration starts at the first order_common import, so SDK
+        # imports made ahead of it would go unmeasured.
+        for path in HANDLERS:
+            with self.subTest(handler=path.parent.name):
+                modules = [node.module if isinstance(node, ast.ImportFrom) else node.names[0].name
+                           for node in ast.parse(path.read_text()).body
+                           if isinstance(node, (ast.Import, ast.ImportFrom))]
+                layer_and_sdk = [m for m in modules if m.split('.')[0] in ('order_common', 'boto3', 'botocore')]
+                self.assertTrue(layer_and_sdk[0].startswith('order_common'), layer_and_sdk)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from unittest.mock import patch
+
+from lambda_src.inventory_handler import app as inventory_app
+from local_pipeline.fakes import FakeDynamoDB
+from order_common.migration import backfill
+from order_common.orders_table import INDEX_KEYS, get_order, orders_for_day
+
+LEGACY = 'orders-legacy'
+ORDERS = 'orders'
+INVENTORY = 'inventory'
+NOW = 1772359200.0  # 2026-03-01T10:00:00Z
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.dynamodb = FakeDynamoDB(indexes=INDEX_KEYS)
+        legacy_items = [
+            {'PK': {'S': 'order#a'}, 'order_id': {'S': 'a'}, 'amount_total': {'N': '100'}},
+            {'PK': {'S': 'order#b'}, 'order_id': {'S': 'b'}, 'amount_total': {'N': '250'}},
+            {'PK': {'S': 'inventory'}, 'stock_quantity': {'N': '40'}},
+            {'PK': {'S': 'inventory#sku-2'}, 'stock_quantity': {'N': '7'}},
+            {'PK': {'S': 'something-else'}},
+        ]
+        for item in legacy_items:
+            self.dynamodb.put_item(TableName=LEGACY, Item=item)
+
+    def _backfill(self):
+        return backfill(self.dynamodb, LEGACY, ORDERS, INVENTORY, shard_count=2, initial_stock=100, now=NOW,
+                        page_size=2)
+
+    def _stock(self, pk):
+        return int(self.dynamodb.item(INVENTORY, pk)['stock_quantity']['N'])
+
+    def test_orders_and_counters_are_copied_once(self):
+        self.assertEqual(self._backfill(), {'orders': 2, 'counters': 2, 'ignored': 1})
+        self.assertEqual(self._backfill(), {'orders_present': 2, 'counters_present': 2, 'ignored': 1})
+
+        order = get_order(self.dynamodb, ORDERS, 'b')
+        self.assertEqual((order['amount_total'], order['created_at'], order['backfilled']),
+                         (250, '2026-03-01T10:00:00.000Z', True))
+        self.assertEqual([o['order_id'] for o in orders_for_day(self.dynamodb, ORDERS, '2026-03-01', 2)],
+                         ['a', 'b'])
+        self.assertEqual((self._stock('inventory'), self._stock('inventory#sku-2')), (40, 7))
+
+    def test_orders_and_stock_taken_since_the_deploy_are_kept(self):
+        self.dynamodb.put_item(TableName=ORDERS, Item={'PK': {'S': 'order#a'}, 'SK': {'S': 'order'},
+                                                        'order_id': {'S': 'a'}, 'status': {'S': 'shipped'}})
+        # The inventory handler started the counter from its initial stock.
+        with patch.multiple(inventory_app, dynamodb=self.dynamodb, INVENTORY_TABLE_NAME=INVENTORY,
+                            INVENTORY_SHARD_COUNT=1, INITIAL_STOCK_QUANTITY=100):
+            inventory_app.decrement_stock(quantity=3)
+
+        self.assertEqual(self._backfill(), {'orders': 1, 'orders_present': 1, 'counters': 2, 'ignored': 1})
+
+        self.assertEqual(get_order(self.dynamodb, ORDERS, 'a')['status'], 'shipped')
+        self.assertEqual(self._stock('inventory'), 40 - 3)
+
+    @patch('builtins.print')
+    def test_counters_oversold_since_the_deploy_stop_at_zero(self, _mock_print):
+        # sku-2 held 7, but the handler sold 40 from a fresh counter of 100.
+        with patch.multiple(inventory_app, dynamodb=self.dynamodb, INVENTORY_TABLE_NAME=INVENTORY,
+                            INVENTORY_SHARD_COUNT=1, INITIAL_STOCK_QUANTITY=100):
+            inventory_app.decrement_stock('sku-2', quantity=40)
+
+        self.assertEqual(self._backfill(), {'orders': 2, 'counters': 2, 'counters_oversold': 1, 'ignored': 1})
+        self.assertEqual(self._stock('inventory#sku-2'), 0)
+        self.assertEqual(self._backfill()['counters_present'], 2)
+        self.assertEqual(self._stock('inventory#sku-2'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
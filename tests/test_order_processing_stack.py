@@ -0,0 +1,432 @@
+import json
+import os
+import re
+import unittest
+
+import aws_cdk as cdk
+from aws_cdk.assertions import Match, Template
+
+from order_processing_stack.config import ConsumerConfig, FunctionConfig, OrderProcessingConfig
+from order_processing_stack.order_processing_stack import (
+    EMAIL_OUTBOX_INDEXES, ORDERS_TABLE_INDEXES, OrderProcessingStack
+)
+from order_processing_stack.packaging import BUNDLED_AWS_SERVICES
+
+HANDLER_COUNT = 7
+
+
+def _template(**settings):
+    # Optimized packaging bundles the layer in Docker; tests skip bundling.
+    app = cdk.App(context={"aws:cdk:bundling-stacks": []})
+    stack = OrderProcessingStack(app, "TestStack", config=OrderProcessingConfig(**settings))
+    return Template.from_stack(stack)
+
+
+def _handlers(template):
+    # Excludes the function CDK adds to set log retention.
+    return template.find_resources("AWS::Lambda::Function", {"Properties": {"Handler": "app.lambda_handler"}})
+
+
+class TestOrderProcessingStackNetwork(unittest.TestCase):
+
+    def _handler_functions(self, template):
+        functions = _handlers(template)
+        self.assertEqual(len(functions), HANDLER_COUNT)
+        return functions.values()
+
+    def test_nat_mode_keeps_single_nat_gateway(self):
+        template = _template(vpc_mode="nat")
+
+        template.resource_count_is("AWS::EC2::NatGateway", 1)
+        template.resource_count_is("AWS::EC2::VPCEndpoint", 0)
+        for function in self._handler_functions(template):
+            self.assertIn("VpcConfig", function["Properties"])
+
+    def test_endpoints_mode_uses_vpc_endpoints_across_azs(self):
+        template = _template(vpc_mode="endpoints", vpc_max_azs=2)
+
+        template.resource_count_is("AWS::EC2::NatGateway", 0)
+        template.resource_count_is("AWS::EC2::InternetGateway", 0)
+        template.resource_count_is("AWS::EC2::Subnet", 2)
+        template.has_resource_properties("AWS::EC2::VPCEndpoint", {
+            "VpcEndpointType": "Gateway",
+            "ServiceName": Match.object_like({"Fn::Join": Match.array_with([
+                Match.array_with([Match.string_like_regexp("dynamodb")])])}),
+        })
+        interface_endpoints = template.find_resources("AWS::EC2::VPCEndpoint",
+                                                      {"Properties": {"VpcEndpointType": "Interface"}})
+        # SNS, SQS and Secrets Manager, plus CloudWatch and Lambda for the concurrency controller.
+        self.assertEqual(len(interface_endpoints), 5)
+        for endpoint in interface_endpoints.values():
+            self.assertTrue(endpoint["Properties"]["PrivateDnsEnabled"])
+            self.assertEqual(len(endpoint["Properties"]["SubnetIds"]), 2)
+        for name, function in _handlers(template).items():
+            if name.startswith("EmailHandlerLambda"):
+                self.assertNotIn("VpcConfig", function["Properties"])
+            else:
+                self.assertEqual(len(function["Properties"]["VpcConfig"]["SubnetIds"]), 2)
+
+    def test_endpoints_mode_runs_the_ses_senders_outside_the_vpc(self):
+        template = _template(vpc_mode="endpoints", email_delivery_mode="outbox")
+
+        self.assertEqual(len(template.find_resources("AWS::EC2::VPCEndpoint", {"Properties": {
+            "ServiceName": Match.object_like({"Fn::Join": Match.array_with([
+                Match.array_with([Match.string_like_regexp("email")])])})}})), 0)
+        for name, function in _handlers(template).items():
+            sends_email = name.startswith(("EmailHandlerLambda", "EmailSenderHandlerLambda"))
+            self.assertEqual("VpcConfig" in function["Properties"], not sends_email, name)
+
+    def test_none_mode_runs_functions_outside_a_vpc(self):
+        template = _template(vpc_mode="none")
+
+        template.resource_count_is("AWS::EC2::VPC", 0)
+        template.resource_count_is("AWS::EC2::NatGateway", 0)
+        for function in self._handler_functions(template):
+            self.assertNotIn("VpcConfig", function["Properties"])
+
+
+class TestOrderProcessingStackTables(unittest.TestCase):
+
+    def test_orders_table_has_sort_key_and_reporting_indexes(self):
+        template = _template(orders_index_shard_count=8)
+
+        indexes = [
+            {"IndexName": name,
+             "KeySchema": [{"AttributeName": pk, "KeyType": "HASH"}, {"AttributeName": sk, "KeyType": "RANGE"}],
+             "Projection": {"ProjectionType": "ALL"}}
+            for name, (pk, sk) in ORDERS_TABLE_INDEXES.items()
+        ]
+        template.has_resource_properties("AWS::DynamoDB::Table", {
+            "KeySchema": [{"AttributeName": "PK", "KeyType": "HASH"}, {"AttributeName": "SK", "KeyType": "RANGE"}],
+            "GlobalSecondaryIndexes": indexes,
+        })
+        template.has_resource_properties("AWS::Lambda::Function", {
+            "Environment": {"Variables": Match.object_like({"ORDERS_INDEX_SHARD_COUNT": "8"})}
+        })
+
+    def test_aggregator_reads_new_orders_from_the_stream(self):
+        template = _template()
+
+        template.has_resource_properties("AWS::DynamoDB::Table", {
+            "KeySchema": Match.array_with([{"AttributeName": "SK", "KeyType": "RANGE"}]),
+            "StreamSpecification": {"StreamViewType": "NEW_IMAGE"},
+        })
+        template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+            "EventSourceArn": {"Fn::GetAtt": [Match.string_like_regexp("^OrdersTableV2"), "StreamArn"]},
+            "BatchSize": 500,
+            "FilterCriteria": {"Filters": [{"Pattern": Match.string_like_regexp('"eventName":\\["INSERT"\\]')}]},
+            "DestinationConfig": {"OnFailure": {"Destination": Match.any_value()}},
+        })
+        template.has_resource_properties("AWS::DynamoDB::Table", {
+            "TimeToLiveSpecification": {"AttributeName": "expires_at", "Enabled": True},
+            "KeySchema": [{"AttributeName": "PK", "KeyType": "HASH"}],
+        })
+
+    def test_original_orders_table_is_kept_for_the_backfill(self):
+        template = _template()
+
+        legacy = template.find_resources("AWS::DynamoDB::Table", {
+            "Properties": {"KeySchema": [{"AttributeName": "PK", "KeyType": "HASH"}]},
+            "DeletionPolicy": "Retain",
+        })
+        # Same construct ID and key schema as before, so the table is not replaced.
+        (name, table), = legacy.items()
+        self.assertRegex(name, "^OrdersTable(?!V2)")
+        self.assertNotIn("GlobalSecondaryIndexes", table["Properties"])
+
+        _template(legacy_orders_table=False).resource_count_is("AWS::DynamoDB::Table", 4)
+
+    def test_inventory_consumer_waits_for_the_backfill(self):
+        mappings = _template(inventory_backfill_pending=True).find_resources("AWS::Lambda::EventSourceMapping")
+
+        (mapping,) = [m for m in mappings.values() if m["Properties"].get("Enabled") is False]
+        self.assertIn("InventoryQueue", json.dumps(mapping["Properties"]["EventSourceArn"]))
+        self.assertFalse([m for m in _template().find_resources("AWS::Lambda::EventSourceMapping").values()
+                          if m["Properties"].get("Enabled") is False])
+
+    def test_inventory_has_its_own_table(self):
+        template = _template()
+
+        template.resource_count_is("AWS::DynamoDB::Table", 5)
+        template.has_resource_properties("AWS::Lambda::Function", {
+            "Environment": {"Variables": Match.object_like({"INVENTORY_TABLE_NAME": Match.any_value()})}
+        })
+
+
+class TestOrderProcessingStackRedrive(unittest.TestCase):
+
+    def test_redrive_function_knows_every_dlq(self):
+        template = _template(redrive_rate_per_second=20)
+
+        functions = template.find_resources("AWS::Lambda::Function", {"Properties": {
+            "Environment": {"Variables": Match.object_like({"REDRIVE_QUEUES": Match.any_value()})}}})
+        self.assertEqual(len(functions), 1)
+        variables = next(iter(functions.values()))["Properties"]["Environment"]["Variables"]
+        self.assertEqual(variables["REDRIVE_RATE"], "20")
+        queues_json = "".join(p if isinstance(p, str) else "" for p in variables["REDRIVE_QUEUES"]["Fn::Join"][1])
+        for name in ("email", "inventory", "db_update"):
+            self.assertIn(f'"{name}":{{"dlq":"', queues_json)
+
+
+class TestOrderProcessingStackQueueSlo(unittest.TestCase):
+
+    def test_consumer_queues_have_age_and_depth_alarms(self):
+        template = _template(email=ConsumerConfig(max_concurrency=2, timeout_seconds=30,
+                                                  max_message_age_seconds=120, queue_depth_alarm_messages=500))
+
+        template.has_resource_properties("AWS::CloudWatch::Alarm", {
+            "MetricName": "ApproximateAgeOfOldestMessage",
+            "Statistic": "Maximum",
+            "Threshold": 120,
+            "Dimensions": [{"Name": "QueueName",
+                            "Value": {"Fn::GetAtt": [Match.string_like_regexp("^EmailQueue(?!DLQ)"), "QueueName"]}}],
+        })
+        template.has_resource_properties("AWS::CloudWatch::Alarm", {
+            "MetricName": "ApproximateNumberOfMessagesVisible",
+            "Threshold": 500,
+            "EvaluationPeriods": 3,
+        })
+        age_alarms = template.find_resources("AWS::CloudWatch::Alarm", {"Properties": {
+            "MetricName": "ApproximateAgeOfOldestMessage"}})
+        self.assertEqual(len(age_alarms), 3)
+
+    def test_controller_adjusts_every_consumer_mapping_each_minute(self):
+        template = _template(db_update=ConsumerConfig(batch_size=100, max_batching_window_seconds=2,
+                                                      max_concurrency=8, min_concurrency=4))
+
+        functions = template.find_resources("AWS::Lambda::Function", {"Properties": {
+            "Environment": {"Variables": Match.object_like({"CONSUMERS": Match.any_value()})}}})
+        self.assertEqual(len(functions), 1)
+        variables = next(iter(functions.values()))["Properties"]["Environment"]["Variables"]
+        consumers_json = "".join(p if isinstance(p, str) else "" for p in variables["CONSUMERS"]["Fn::Join"][1])
+        self.assertIn('"minimum":4,"maximum":8,"batch_size":100,"target_age_seconds":150', consumers_json)
+        for name in ("email", "inventory", "db_update"):
+            self.assertIn(f'"{name}":{{"queue":"', consumers_json)
+        template.has_resource_properties("AWS::Events::Rule", {"ScheduleExpression": "rate(1 minute)"})
+        template.has_resource_properties("AWS::IAM::Policy", {"PolicyDocument": {"Statement": Match.array_with([
+            Match.object_like({"Action": ["lambda:GetEventSourceMapping", "lambda:UpdateEventSourceMapping"]})
+        ])}})
+
+    def test_controller_can_be_disabled(self):
+        template = _template(concurrency_control=False)
+
+        template.resource_count_is("AWS::Events::Rule", 0)
+        self.assertEqual(len(_handlers(template)), HANDLER_COUNT - 1)
+
+
+class TestOrderProcessingStackEmailOutbox(unittest.TestCase):
+
+    def test_sender_drains_the_outbox_at_the_ses_rate(self):
+        template = _template(email_delivery_mode="outbox", ses_max_send_rate=14, email_max_attempts=5)
+
+        pk, sk = EMAIL_OUTBOX_INDEXES["ByDueTime"]
+        template.has_resource_properties("AWS::DynamoDB::Table", {
+            "GlobalSecondaryIndexes": [Match.object_like({
+                "IndexName": "ByDueTime",
+                "KeySchema": [{"AttributeName": pk, "KeyType": "HASH"}, {"AttributeName": sk, "KeyType": "RANGE"}],
+            })],
+            "TimeToLiveSpecification": {"AttributeName": "expires_at", "Enabled": True},
+        })
+        template.has_resource_properties("AWS::Lambda::Function", {
+            "Environment": {"Variables": Match.object_like({"EMAIL_DELIVERY_MODE": "outbox",
+                                                            "EMAIL_OUTBOX_TABLE_NAME": Match.any_value()})}
+        })
+        template.has_resource_properties("AWS::Lambda::Function", {
+            "ReservedConcurrentExecutions": 1,
+            "Environment": {"Variables": Match.object_like({
+                "SES_SEND_RATE": "14",
+                "EMAIL_MAX_ATTEMPTS": "5",
+                "SES_CONFIGURATION_SET": Match.any_value(),
+            })},
+        })
+        template.has_resource_properties("AWS::Events::Rule", {"ScheduleExpression": "rate(1 minute)",
+                                                               "Targets": [Match.object_like({
+                                                                   "Arn": {"Fn::GetAtt": [Match.string_like_regexp(
+                                                                       "^EmailSenderHandlerLambda"), "Arn"]}})]})
+
+    def test_ses_events_reach_the_events_handler(self):
+        template = _template(email_delivery_mode="outbox")
+
+        template.has_resource_properties("AWS::SES::ConfigurationSetEventDestination", {
+            "EventDestination": Match.object_like({
+                "MatchingEventTypes": ["delivery", "bounce", "complaint", "reject", "renderingFailure"],
+                "SnsDestination": Match.any_value(),
+            })
+        })
+        template.has_resource_properties("AWS::SNS::Subscription", {
+            "Protocol": "lambda",
+            "Endpoint": {"Fn::GetAtt": [Match.string_like_regexp("^EmailEventsHandlerLambda"), "Arn"]},
+        })
+        template.has_resource_properties("AWS::CloudWatch::Alarm", {"MetricName": "EmailsFailed"})
+
+    def test_direct_delivery_is_the_default_and_has_no_outbox(self):
+        template = _template()
+
+        self.assertEqual(len(_handlers(template)), HANDLER_COUNT)
+        template.resource_count_is("AWS::DynamoDB::Table", 5)
+        template.resource_count_is("AWS::SES::ConfigurationSet", 0)
+        template.has_resource_properties("AWS::Lambda::Function", {
+            "Environment": {"Variables": Match.object_like({"EMAIL_DELIVERY_MODE": "direct"})}
+        })
+
+
+class TestOrderProcessingStackPackaging(unittest.TestCase):
+
+    def _layers(self, function):
+        return [layer["Ref"] for layer in function["Properties"]["Layers"]]
+
+    def test_standard_packaging_by_default(self):
+        template = _template()
+
+        for function in _handlers(template).values():
+            properties = function["Properties"]
+            self.assertEqual((properties["Runtime"], properties["Architectures"]), ("python3.9", ["x86_64"]))
+            self.assertNotIn("PREWARM_CLIENTS", properties["Environment"]["Variables"])
+        template.resource_count_is("AWS::Lambda::LayerVersion", 1)
+
+    def test_optimized_packaging_targets_arm64_with_one_layer_per_architecture(self):
+        template = _template(packaging_mode="optimized", functions={
+            "webhook": FunctionConfig(memory_size=512, architecture="x86_64")})
+
+        functions = _handlers(template)
+        arm_layers, x86_layers = set(), set()
+        for name, function in functions.items():
+            properties = function["Properties"]
+            self.assertEqual(properties["Runtime"], "python3.12")
+            self.assertEqual(properties["Environment"]["Variables"]["PREWARM_CLIENTS"], "true")
+            if name.startswith("WebhookHandlerLambda"):
+                self.assertEqual((properties["MemorySize"], properties["Architectures"]), (512, ["x86_64"]))
+                x86_layers.update(self._layers(function))
+            else:
+                self.assertEqual(properties["Architectures"], ["arm64"])
+                arm_layers.update(self._layers(function))
+        self.assertEqual((len(arm_layers), len(x86_layers)), (1, 1))
+        self.assertNotEqual(arm_layers, x86_layers)
+        template.has_resource_properties("AWS::Lambda::LayerVersion", {"CompatibleRuntimes": ["python3.12"]})
+
+    def test_trimmed_layer_keeps_every_service_the_handlers_call(self):
+        lambda_src = os.path.join(os.path.dirname(__file__), os.pardir, "lambda_src")
+        services = set()
+        for directory, _, files in os.walk(lambda_src):
+            for name in files:
+                if name.endswith(".py"):
+                    with open(os.path.join(directory, name)) as f:
+                        services.update(re.findall(r"lazy_client\('([a-z0-9-]+)'\)", f.read()))
+
+        self.assertTrue(services)
+        self.assertLessEqual(services, set(BUNDLED_AWS_SERVICES))
+
+
+class TestOrderProcessingStackLogging(unittest.TestCase):
+
+    def test_every_handler_log_group_has_the_retention(self):
+        template = _template(email_delivery_mode="outbox", log_retention_days=14)
+
+        log_groups = {retention["Properties"]["LogGroupName"]["Fn::Join"][1][1]["Ref"]: retention["Properties"]
+                      for retention in template.find_resources("Custom::LogRetention").values()}
+        self.assertEqual(set(log_groups), set(_handlers(template)))
+        for properties in log_groups.values():
+            self.assertEqual(properties["RetentionInDays"], 14)
+
+
+class TestOrderProcessingStackIngestion(unittest.TestCase):
+
+    def test_lambda_mode_proxies_webhook_to_handler(self):
+        template = _template(ingestion_mode="lambda")
+
+        template.has_resource_properties("AWS::Lambda::Function", {
+            "Environment": {"Variables": Match.object_like({"SNS_TOPIC_ARN": Match.any_value()})}
+        })
+        template.has_resource_properties("AWS::ApiGateway::Method", {
+            "HttpMethod": "POST",
+            "Integration": Match.object_like({"Type": "AWS_PROXY"}),
+        })
+        template.resource_count_is("AWS::ApiGateway::UsagePlan", 0)
+        template.has_resource_properties("AWS::ApiGateway::Resource", {"PathPart": "batch"})
+
+    def test_queues_subscribe_with_raw_message_delivery(self):
+        template = _template()
+
+        subscriptions = template.find_resources("AWS::SNS::Subscription", {"Properties": {"Protocol": "sqs"}})
+        self.assertEqual(len(subscriptions), 3)
+        for subscription in subscriptions.values():
+            self.assertTrue(subscription["Properties"]["RawMessageDelivery"])
+
+    def test_direct_mode_forwards_the_customer_id(self):
+        template = _template(ingestion_mode="direct")
+
+        template.has_resource_properties("AWS::ApiGateway::Model", {
+            "Schema": Match.object_like({"properties": Match.object_like({"customer_id": {"type": "string"}})})
+        })
+        (method,) = template.find_resources("AWS::ApiGateway::Method", {"Properties": {"HttpMethod": "POST"}}).values()
+        # The template is joined with the topic ARN; keep its literal parts.
+        parts = method["Properties"]["Integration"]["RequestTemplates"]["application/json"]["Fn::Join"][1]
+        publish_template = "".join(part for part in parts if isinstance(part, str))
+        self.assertIn("""#if($input.path('$.customer_id') != "")""", publish_template)
+        self.assertIn("""$message, ""customer_id"": $input.json('$.customer_id')""", publish_template)
+
+    def test_direct_mode_publishes_to_sns_without_a_lambda(self):
+        template = _template(ingestion_mode="direct")
+
+        self.assertEqual(len(_handlers(template)), HANDLER_COUNT - 1)
+        template.resource_count_is("AWS::SecretsManager::Secret", 0)
+        template.has_resource_properties("AWS::ApiGateway::Method", {
+            "HttpMethod": "POST",
+            "ApiKeyRequired": True,
+            "RequestValidatorId": Match.any_value(),
+            "RequestModels": {"application/json": Match.any_value()},
+            "Integration": Match.object_like({
+                "Type": "AWS",
+                "IntegrationHttpMethod": "POST",
+                "PassthroughBehavior": "NEVER",
+                "Uri": Match.object_like({"Fn::Join": Match.array_with([
+                    Match.array_with([Match.string_like_regexp(":sns:action/Publish")])])}),
+            }),
+        })
+        template.has_resource_properties("AWS::ApiGateway::Model", {
+            "Schema": Match.object_like({"required": ["order_id", "amount_total"]})
+        })
+        template.has_resource_properties("AWS::ApiGateway::RequestValidator", {"ValidateRequestBody": True})
+        template.resource_count_is("AWS::ApiGateway::UsagePlanKey", 1)
+        template.has_resource_properties("AWS::IAM::Policy", {
+            "PolicyDocument": {"Statement": [Match.object_like({"Action": "sns:Publish"})]},
+            "Roles": [{"Ref": Match.string_like_regexp("WebhookSnsIntegrationRole")}],
+        })
+
+
+class TestOrderProcessingStackFifo(unittest.TestCase):
+
+    def test_standard_topology_by_default(self):
+        template = _template()
+
+        self.assertFalse(template.find_resources("AWS::SNS::Topic", {"Properties": {"FifoTopic": True}}))
+        self.assertFalse(template.find_resources("AWS::SQS::Queue", {"Properties": {"FifoQueue": True}}))
+
+    def test_fifo_ordering_uses_fifo_topic_and_queues(self):
+        template = _template(fifo_ordering=True)
+
+        template.has_resource_properties("AWS::SNS::Topic", {
+            "FifoTopic": True,
+            "ContentBasedDeduplication": True,
+        })
+        queues = template.find_resources("AWS::SQS::Queue", {"Properties": {
+            "FifoQueue": True,
+            "DeduplicationScope": "messageGroup",
+            "FifoThroughputLimit": "perMessageGroupId",
+        }})
+        self.assertEqual(len(queues), 6)
+        mappings = template.find_resources("AWS::Lambda::EventSourceMapping", {"Properties": {
+            "EventSourceArn": {"Fn::GetAtt": [Match.string_like_regexp("Queue"), "Arn"]}}})
+        self.assertEqual(len(mappings), 3)
+        for mapping in mappings.values():
+            self.assertLessEqual(mapping["Properties"]["BatchSize"], 10)
+            self.assertNotIn("MaximumBatchingWindowInSeconds", mapping["Properties"])
+
+    def test_direct_mode_groups_by_order_id(self):
+        template = _template(fifo_ordering=True, ingestion_mode="direct")
+
+        self.assertIn("MessageGroupId", json.dumps(template.find_resources("AWS::ApiGateway::Method")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import unittest
+
+import lambda_src  # noqa: F401  Puts the shared layer on sys.path.
+from order_common.orders import (
+    InvalidOrderError, OrderRecord, decode_record, dumps, loads, unwrap, with_group_failures
+)
+
+
+class TestOrderDecoding(unittest.TestCase):
+
+    def test_raw_and_enveloped_bodies_decode_alike(self):
+        order = {'order_id': 'cs_1', 'amount_total': 100}
+        envelope = {'Type': 'Notification', 'MessageId': 'sns-1', 'Message': json.dumps(order)}
+
+        raw = decode_record({'messageId': 'm1', 'body': json.dumps(order)})
+        wrapped = decode_record({'messageId': 'm1', 'body': json.dumps(envelope)})
+
+        self.assertEqual(raw, OrderRecord('m1', 'cs_1', 100))
+        self.assertEqual(wrapped, raw)
+
+    def test_items_are_kept(self):
+        order = {'order_id': 'cs_1', 'items': [{'sku': 'a', 'quantity': 2}]}
+
+        self.assertEqual(decode_record({'body': json.dumps(order)}).items, [{'sku': 'a', 'quantity': 2}])
+
+    def test_fifo_records_are_keyed_by_order_and_deduplication_id(self):
+        body = json.dumps({'order_id': 'cs_1'})
+        standard = decode_record({'messageId': 'm1', 'body': body, 'attributes': {}})
+        fifo = decode_record({'messageId': 'm1', 'body': body,
+                              'attributes': {'MessageGroupId': 'cs_1', 'MessageDeduplicationId': 'evt_2'}})
+
+        self.assertEqual((standard.idempotency_key, fifo.idempotency_key), ('cs_1', 'cs_1#evt_2'))
+
+    def test_invalid_orders_are_rejected(self):
+        bodies = ['not json', '[]', '{}', '{"order_id": ""}', '{"order_id": 1}',
+                  '{"order_id": "1", "amount_total": "100"}', '{"order_id": "1", "amount_total": true}',
+                  '{"order_id": "1", "items": {"sku": "a"}}', '{"order_id": "1", "items": [{"quantity": 0}]}',
+                  '{"order_id": "1", "items": [{"quantity": -2}]}', '{"order_id": "1", "items": [{"quantity": 1.5}]}',
+                  json.dumps({'Message': '{}'})]
+        for body in bodies:
+            with self.subTest(body=body), self.assertRaises(ValueError):
+                decode_record({'messageId': 'm1', 'body': body})
+        with self.assertRaises(InvalidOrderError):
+            decode_record({'messageId': 'm1'})
+
+    def test_records_have_no_instance_dict(self):
+        record = OrderRecord('m1', 'cs_1')
+
+        with self.assertRaises(AttributeError):
+            record.extra = True
+
+    def test_dumps_round_trips(self):
+        message = {'order_id': 'cs_1', 'amount_total': 100}
+
+        self.assertEqual(loads(dumps(message)), message)
+        self.assertEqual(unwrap(dumps(message)), message)
+
+
+class TestGroupFailures(unittest.TestCase):
+
+    def _records(self, *groups):
+        return [{'messageId': f'm{i}', 'attributes': {'MessageGroupId': group} if group else {}}
+                for i, group in enumerate(groups)]
+
+    def test_rest_of_a_failed_group_is_failed(self):
+        records = self._records('a', 'b', 'a', 'a', 'b')
+
+        self.assertEqual(with_group_failures(records, {'m2'}), {'m2', 'm3'})
+        self.assertEqual(with_group_failures(records, {'m0', 'm1'}), {'m0', 'm1', 'm2', 'm3', 'm4'})
+
+    def test_standard_queue_records_are_unchanged(self):
+        self.assertEqual(with_group_failures(self._records(None, None), {'m0'}), {'m0'})
+
+
+if __name__ == '__main__':
+    unittest.main()
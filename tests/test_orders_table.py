@@ -0,0 +1,89 @@
+import unittest
+
+import lambda_src  # noqa: F401  Puts the shared layer on sys.path.
+from local_pipeline.fakes import FakeDynamoDB
+from order_common.dynamo import to_item
+from order_common.orders_table import (
+    INDEX_KEYS, STATUS_PLACED, get_order, index_shard, order_item, orders_for_customer, orders_for_day,
+    orders_with_status, timestamp
+)
+from order_processing_stack.order_processing_stack import ORDERS_TABLE_INDEXES
+
+TABLE = 'orders'
+SHARDS = 4
+
+
+class TestOrdersTable(unittest.TestCase):
+
+    def setUp(self):
+        self.dynamodb = FakeDynamoDB(indexes=INDEX_KEYS)
+
+    def _put(self, order_id, created_at, customer_id=None, status=STATUS_PLACED):
+        item = order_item(order_id, 100, customer_id, status, created_at=created_at, shard_count=SHARDS)
+        self.dynamodb.put_item(TableName=TABLE, Item=to_item(item))
+
+    def test_index_keys_match_the_stack(self):
+        self.assertEqual(INDEX_KEYS, ORDERS_TABLE_INDEXES)
+
+    def test_timestamp_is_sortable_utc(self):
+        self.assertEqual(timestamp(0), '1970-01-01T00:00:00.000Z')
+        self.assertEqual(timestamp(1.5), '1970-01-01T00:00:01.500Z')
+
+    def test_shards_are_stable_and_spread(self):
+        shards = [index_shard(str(i), SHARDS) for i in range(1000)]
+
+        self.assertEqual(shards, [index_shard(str(i), SHARDS) for i in range(1000)])
+        self.assertEqual(set(shards), set(range(SHARDS)))
+        self.assertGreater(min(shards.count(shard) for shard in range(SHARDS)), 200)
+
+    def test_orders_for_day_merges_shards_in_time_order(self):
+        for i in range(20):
+            self._put(f'o{i}', f'2026-03-01T10:{59 - i:02d}:00.000Z')
+        self._put('next-day', '2026-03-02T00:00:00.000Z')
+
+        orders = list(orders_for_day(self.dynamodb, TABLE, '2026-03-01', SHARDS, page_size=3))
+
+        self.assertEqual([o['order_id'] for o in orders], [f'o{i}' for i in reversed(range(20))])
+        # One query per page per shard; the other day is never read.
+        self.assertLess(self.dynamodb.stats['query'], 20)
+
+    def test_orders_for_day_within_a_time_range(self):
+        for minute in range(10):
+            self._put(f'o{minute}', f'2026-03-01T10:{minute:02d}:00.000Z')
+
+        orders = orders_for_day(self.dynamodb, TABLE, '2026-03-01', SHARDS,
+                                start='2026-03-01T10:03:00.000Z', end='2026-03-01T10:05:00.000Z')
+
+        self.assertEqual([o['order_id'] for o in orders], ['o3', 'o4', 'o5'])
+
+    def test_orders_for_customer_only_reads_that_customer(self):
+        self._put('a1', '2026-03-01T10:00:00.000Z', customer_id='cus_a')
+        self._put('b1', '2026-03-01T11:00:00.000Z', customer_id='cus_b')
+        self._put('a2', '2026-03-02T10:00:00.000Z', customer_id='cus_a')
+        self._put('anonymous', '2026-03-02T10:00:00.000Z')
+
+        orders = orders_for_customer(self.dynamodb, TABLE, 'cus_a')
+        recent = orders_for_customer(self.dynamodb, TABLE, 'cus_a', start='2026-03-02')
+
+        self.assertEqual([o['order_id'] for o in orders], ['a1', 'a2'])
+        self.assertEqual([o['order_id'] for o in recent], ['a2'])
+
+    def test_orders_with_status(self):
+        self._put('placed', '2026-03-01T10:00:00.000Z')
+        self._put('shipped', '2026-03-01T11:00:00.000Z', status='shipped')
+
+        orders = orders_with_status(self.dynamodb, TABLE, 'shipped', '2026-03-01', SHARDS)
+
+        self.assertEqual([o['order_id'] for o in orders], ['shipped'])
+
+    def test_get_order(self):
+        self._put('o1', '2026-03-01T10:00:00.000Z', customer_id='cus_a')
+
+        order = get_order(self.dynamodb, TABLE, 'o1')
+
+        self.assertEqual((order['status'], order['customer_id'], order['amount_total']), ('placed', 'cus_a', 100))
+        self.assertIsNone(get_order(self.dynamodb, TABLE, 'missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import random
+import unittest
+
+from botocore.exceptions import ClientError
+
+import lambda_src  # noqa: F401  Puts the shared layer on sys.path.
+from local_pipeline.fakes import FakeDynamoDB, ManualClock
+from order_common.outbox import (
+    INDEX_KEYS, EmailOutbox, is_permanent_error, order_id_from_tag, retry_delay, tag_value
+)
+
+
+class TestEmailOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = ManualClock(1000.0)
+        self.dynamodb = FakeDynamoDB(indexes=INDEX_KEYS)
+        self.outbox = EmailOutbox(self.dynamodb, 'outbox', shard_count=2, lease_seconds=60, clock=self.clock)
+
+    def _item(self, order_id):
+        return self.dynamodb.item('outbox', f'email#{order_id}')
+
+    def test_orders_are_added_once(self):
+        self.assertTrue(self.outbox.add('1'))
+        self.assertFalse(self.outbox.add('1'))
+        self.assertEqual(self._item('1')['attempts'], {'N': '0'})
+
+    def test_claimed_items_are_not_due_until_the_lease_ends(self):
+        for order_id in ('1', '2', '3'):
+            self.outbox.add(order_id)
+        due = self.outbox.due()
+        self.assertEqual(sorted(item['order_id'] for item in due), ['1', '2', '3'])
+
+        self.assertEqual(self.outbox.claim(due[0]), 1)
+        # A second sender that read the same item loses the claim.
+        self.assertIsNone(self.outbox.claim(due[0]))
+        self.assertEqual(len(self.outbox.due()), 2)
+
+        self.clock.advance(60)
+        self.assertEqual(len(self.outbox.due()), 3)
+
+    def test_sent_and_failed_items_leave_the_due_index(self):
+        self.outbox.add('1')
+        self.outbox.add('2')
+        self.outbox.add('3')
+        for item in self.outbox.due():
+            self.outbox.claim(item)
+        self.outbox.mark_sent('1', 'ses-1')
+        self.outbox.mark_failed('2', 'MessageRejected')
+        self.outbox.retry_after('3', 30, 'Throttling')
+
+        self.assertEqual(self._item('1')['delivery_status'], {'S': 'sent'})
+        self.assertNotIn('due_shard', self._item('1'))
+        self.assertEqual(self._item('2')['delivery_status'], {'S': 'failed'})
+        self.assertEqual(self.outbox.due(), [])
+        self.clock.advance(30)
+        self.assertEqual([item['order_id'] for item in self.outbox.due()], ['3'])
+
+    def test_ses_events_do_not_overwrite_a_later_status(self):
+        self.outbox.add('1')
+        self.outbox.claim(self.outbox.due()[0])
+        self.outbox.mark_sent('1', 'ses-1')
+
+        self.assertFalse(self.outbox.record_event('1', 'delivered', 'ses-other'))
+        self.assertTrue(self.outbox.record_event('1', 'delivered', 'ses-1'))
+        self.assertTrue(self.outbox.record_event('1', 'complained', 'ses-1'))
+        self.assertFalse(self.outbox.record_event('1', 'delivered', 'ses-1'))
+        self.assertEqual(self._item('1')['delivery_status'], {'S': 'complained'})
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_delay_doubles_up_to_the_cap(self):
+        rng = random.Random(0)
+        for attempts, low, high in ((1, 15, 30), (2, 30, 60), (4, 120, 240), (20, 1800, 3600)):
+            with self.subTest(attempts=attempts):
+                self.assertTrue(low <= retry_delay(attempts, 30, 3600, rng) <= high)
+
+    def test_permanent_errors(self):
+        def error(code):
+            return ClientError({'Error': {'Code': code, 'Message': ''}}, 'SendEmail')
+
+        self.assertTrue(is_permanent_error(error('MessageRejected')))
+        self.assertFalse(is_permanent_error(error('Throttling')))
+        self.assertFalse(is_permanent_error(Exception('timeout')))
+
+    def test_tag_round_trip(self):
+        self.assertRegex(tag_value('cs_test ünïcode/1'), r'^[0-9a-f]+$')
+        self.assertEqual(order_id_from_tag(tag_value('cs_test ünïcode/1')), 'cs_test ünïcode/1')
+
+
+if __name__ == '__main__':
+    unittest.main()
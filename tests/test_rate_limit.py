@@ -0,0 +1,66 @@
+import unittest
+
+import lambda_src  # noqa: F401  Puts the shared layer on sys.path.
+from order_common.rate_limit import TokenBucket
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=10, capacity=5, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_allows_burst_up_to_capacity(self):
+        for _ in range(5):
+            self.assertTrue(self.bucket.try_acquire())
+        self.assertFalse(self.bucket.try_acquire())
+
+        self.clock.now += 0.1
+        self.assertTrue(self.bucket.try_acquire())
+
+    def test_acquire_waits_for_refill(self):
+        self.bucket.acquire(5)
+        waited = self.bucket.acquire(2)
+
+        self.assertAlmostEqual(waited, 0.2)
+        self.assertAlmostEqual(self.clock.now, 0.2)
+
+    def test_acquire_larger_than_capacity_is_paced(self):
+        waited = self.bucket.acquire(25)
+
+        # 5 tokens are available up front, the other 20 arrive at 10/s.
+        self.assertAlmostEqual(waited, 2.0)
+
+    def test_acquire_tolerates_float_rounding_in_refill(self):
+        # A refill leaves 4e-11 tokens short: the 4e-14s sleep for them does
+        # not move a float clock at 1000.0, and acquire must not spin.
+        self.clock.now = 1000.0
+        bucket = TokenBucket(rate=1000, clock=self.clock, sleep=self.clock.sleep)
+        bucket._tokens = 1000 - 4e-11
+
+        waited = bucket.acquire(1000)
+
+        self.assertLess(waited, 1e-6)
+        self.assertEqual(bucket._tokens, 0.0)
+
+    def test_rate_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from lambda_src.redrive_handler import app
+from local_pipeline.fakes import FakeQueue, FakeSqs, ManualClock
+from order_common.redrive import Redrive, message_order_id
+
+DLQ_URL = 'https://sqs.local/000000000000/EmailQueueDLQ'
+SOURCE_URL = 'https://sqs.local/000000000000/EmailQueue'
+
+
+def _order(order_id):
+    return json.dumps({'order_id': order_id, 'amount_total': 100})
+
+
+class TestRedrive(unittest.TestCase):
+
+    def setUp(self):
+        self.dlq = FakeQueue('EmailQueueDLQ', visibility_timeout=30)
+        self.source = FakeQueue('EmailQueue', visibility_timeout=30)
+        self.sqs = FakeSqs({DLQ_URL: self.dlq, SOURCE_URL: self.source})
+
+    def _fill(self, count):
+        for i in range(count):
+            self.dlq.send(_order(str(i)))
+
+    def _source_order_ids(self):
+        return sorted(message_order_id(r['body']) for r in self.source.receive(len(self.source)))
+
+    def test_moves_every_message_with_concurrent_receivers(self):
+        self._fill(95)
+
+        stats = Redrive(self.sqs, DLQ_URL, SOURCE_URL, rate=10000, concurrency=4).run()
+
+        self.assertEqual((stats['received'], stats['moved'], stats['failed']), (95, 95, 0))
+        self.assertEqual(len(self.dlq), 0)
+        self.assertEqual(self._source_order_ids(), sorted(str(i) for i in range(95)))
+
+    def test_dry_run_moves_nothing_and_releases_messages(self):
+        self._fill(25)
+
+        stats = Redrive(self.sqs, DLQ_URL, SOURCE_URL, rate=10000, dry_run=True).run()
+
+        self.assertEqual((stats['would_move'], stats['moved']), (25, 0))
+        self.assertEqual(len(self.source), 0)
+        self.assertEqual(self.dlq.visible_count(), 25)
+
+    def test_filters_by_order_id(self):
+        self._fill(30)
+        self.dlq.send('not json')
+
+        stats = Redrive(self.sqs, DLQ_URL, SOURCE_URL, rate=10000, order_ids=['3', '17']).run()
+
+        self.assertEqual((stats['moved'], stats['skipped']), (2, 29))
+        self.assertEqual(self._source_order_ids(), ['17', '3'])
+        self.assertEqual(self.dlq.visible_count(), 29)
+
+    def test_max_messages_bounds_the_run(self):
+        self._fill(50)
+
+        stats = Redrive(self.sqs, DLQ_URL, SOURCE_URL, rate=10000, concurrency=3, max_messages=23).run()
+
+        self.assertEqual(stats['moved'], 23)
+        self.assertEqual(len(self.dlq), 27)
+
+    def test_rate_limits_sends(self):
+        self._fill(40)
+        clock = ManualClock()
+
+        stats = Redrive(self.sqs, DLQ_URL, SOURCE_URL, rate=10, concurrency=1, clock=clock, sleep=clock.advance).run()
+
+        # A burst of 10, then 10/s: the other 30 take 3 s.
+        self.assertEqual(stats['moved'], 40)
+        self.assertAlmostEqual(stats['elapsed_seconds'], 3.0, places=3)
+
+    def test_failed_sends_stay_in_the_dlq(self):
+        self._fill(12)
+        sqs = MagicMock(wraps=self.sqs)
+        sqs.send_message_batch.side_effect = ClientError(
+            {'Error': {'Code': 'AWS.SimpleQueueService.QueueDeletedRecently', 'Message': 'gone'}}, 'SendMessageBatch')
+
+        stats = Redrive(sqs, DLQ_URL, SOURCE_URL, rate=10000).run()
+
+        self.assertEqual((stats['moved'], stats['failed']), (0, 12))
+        self.assertEqual(self.dlq.visible_count(), 12)
+
+    def test_fifo_messages_keep_their_group(self):
+        dlq = FakeQueue('EmailQueueDLQ.fifo', visibility_timeout=30, fifo=True)
+        source = FakeQueue('EmailQueue.fifo', visibility_timeout=30, fifo=True)
+        for order_id in ('a', 'b', 'a'):
+            dlq.send(_order(order_id), group_id=order_id)
+
+        Redrive(FakeSqs({DLQ_URL: dlq, SOURCE_URL: source}), DLQ_URL, SOURCE_URL, rate=10000, concurrency=1).run()
+
+        records = source.receive(10)
+        self.assertEqual([r['attributes']['MessageGroupId'] for r in records], ['a', 'b', 'a'])
+        self.assertEqual([message_order_id(r['body']) for r in records], ['a', 'b', 'a'])
+
+    def test_reports_progress(self):
+        self._fill(30)
+        reports = []
+
+        Redrive(self.sqs, DLQ_URL, SOURCE_URL, rate=10000, concurrency=1, progress=reports.append,
+                progress_interval=0).run()
+
+        self.assertEqual([r['moved'] for r in reports], [10, 20, 30])
+
+
+class TestRedriveHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.dlq = FakeQueue('DbUpdateQueueDLQ', visibility_timeout=30)
+        self.source = FakeQueue('DbUpdateQueue', visibility_timeout=30)
+        patcher = patch.multiple(app, sqs=FakeSqs({DLQ_URL: self.dlq, SOURCE_URL: self.source}),
+                                 REDRIVE_QUEUES={'db_update': {'dlq': DLQ_URL, 'source': SOURCE_URL}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('builtins.print')
+    def test_redrives_the_named_queue_and_emits_metrics(self, mock_print):
+        for i in range(5):
+            self.dlq.send(_order(str(i)))
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = 60000
+
+        response = app.lambda_handler({'queue': 'db_update', 'max_messages': 3}, context)
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(response['body'])['moved'], 3)
+        self.assertEqual(len(self.source), 3)
+        documents = [json.loads(c.args[0]) for c in mock_print.call_args_list if c.args[0].startswith('{')]
+        self.assertIn(3, [d.get('RedriveMoved') for d in documents])
+
+    def test_unknown_queue_is_rejected(self):
+        response = app.lambda_handler({'queue': 'payments'}, None)
+
+        self.assertEqual(response['statusCode'], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
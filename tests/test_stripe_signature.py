@@ -0,0 +1,58 @@
+import unittest
+
+import lambda_src  # noqa: F401  Puts the shared layer on sys.path.
+from order_common.stripe_signature import (
+    ReplayCache, SignatureVerificationError, check_timestamp, compute_signature, parse_header, signature_matches
+)
+
+
+class TestStripeSignature(unittest.TestCase):
+
+    def test_compute_signature_matches_stripe_scheme(self):
+        # HMAC-SHA256 of "1700000000.{}" keyed with "whsec_test".
+        self.assertEqual(compute_signature('whsec_test', 1700000000, b'{}'),
+                         '35495024f4ef3f94e5a93e22221544c4b75e9a42300cd965ab81cb85cd994e91')
+
+    def test_parse_header(self):
+        self.assertEqual(parse_header('t=1700000000,v1=abc, v0=old,v1=def'), (1700000000, ['abc', 'def']))
+        for header in (None, '', 'v1=abc', 't=soon,v1=abc', 't=1700000000,v0=abc'):
+            with self.assertRaises(SignatureVerificationError):
+                parse_header(header)
+
+    def test_signature_matches_any_v1_value(self):
+        good = compute_signature('secret', 1, b'payload')
+
+        self.assertTrue(signature_matches('secret', 1, b'payload', ['bad', good]))
+        self.assertFalse(signature_matches('secret', 2, b'payload', [good]))
+        self.assertFalse(signature_matches('other', 1, b'payload', [good]))
+
+    def test_check_timestamp(self):
+        check_timestamp(1000, tolerance_seconds=300, now=1300)
+        with self.assertRaises(SignatureVerificationError):
+            check_timestamp(1000, tolerance_seconds=300, now=1301)
+        with self.assertRaises(SignatureVerificationError):
+            check_timestamp(1400, tolerance_seconds=300, now=1000)
+
+
+class TestReplayCache(unittest.TestCase):
+
+    def test_entries_expire_and_size_is_bounded(self):
+        now = [0]
+        cache = ReplayCache(max_size=2, clock=lambda: now[0])
+
+        cache.add('a', expires_at=10)
+        cache.add('b', expires_at=20)
+        self.assertIn('a', cache)
+
+        cache.add('c', expires_at=30)
+        # The oldest entry was evicted to stay within max_size.
+        self.assertNotIn('a', cache)
+
+        now[0] = 20
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,17 @@
 import json
+import time
 import unittest
 from unittest.mock import MagicMock, patch
 
 from lambda_src.webhook_handler import app
+from order_common.stripe_signature import compute_signature
 
 
 class TestWebhookHandler(unittest.TestCase):
 
+    def setUp(self):
+        app.api_key_cache.clear()
+
     @patch('lambda_src.webhook_handler.app.sns_client')
     @patch('lambda_src.webhook_handler.app.secrets_client')
     def test_lambda_handler_success(self, mock_secrets_client, mock_sns_client):
@@ -31,6 +36,10 @@ class TestWebhookHandler(unittest.TestCase):
         self.assertEqual(response['statusCode'], 200)
         self.assertEqual(json.loads(response['body']), {'message': 'Webhook received and published successfully.'})
         mock_sns_client.publish.assert_called_once()
+        # The order is published once encoded; raw delivery hands it to the queues as is.
+        published = mock_sns_client.publish.call_args.kwargs
+        self.assertNotIn('MessageStructure', published)
+        self.assertEqual(json.loads(published['Message']), {'order_id': '123', 'amount_total': 100})
 
     @patch('lambda_src.webhook_handler.app.secrets_client')
     def test_lambda_handler_missing_fields(self, mock_secrets_client):
@@ -54,6 +63,24 @@ class TestWebhookHandler(unittest.TestCase):
         self.assertEqual(response['statusCode'], 400)
         self.assertEqual(json.loads(response['body']), {'message': 'Missing required fields.'})
 
+    @patch('lambda_src.webhook_handler.app.sns_client')
+    @patch('lambda_src.webhook_handler.app.secrets_client')
+    def test_orders_the_consumers_would_reject_are_refused(self, mock_secrets_client, mock_sns_client):
+        mock_secrets_client.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+
+        for order in ({'order_id': 123, 'amount_total': 100},
+                      {'order_id': '123', 'amount_total': '100'},
+                      {'order_id': '123', 'amount_total': True},
+                      {'order_id': '123', 'amount_total': -5},
+                      {'order_id': '123', 'amount_total': 100, 'customer_id': 7}):
+            with self.subTest(order=order):
+                event = {'body': json.dumps(dict(order, api_key='test-api-key'))}
+
+                response = app.lambda_handler(event, None)
+
+                self.assertEqual(response['statusCode'], 400)
+        mock_sns_client.publish.assert_not_called()
+
     def test_lambda_handler_invalid_json(self):
         # Mock event with invalid JSON
         event = {
@@ -87,6 +114,220 @@ class TestWebhookHandler(unittest.TestCase):
         response = app.lambda_handler(event, None)
 
         # Assertions
+        self.assertEqual(response['statusCode'], 403)
+
+    @patch('lambda_src.webhook_handler.app.sns_client')
+    @patch('lambda_src.webhook_handler.app.secrets_client')
+    def test_api_key_is_cached_across_invocations(self, mock_secrets_client, mock_sns_client):
+        mock_secrets_client.get_secret_value.return_value = {
+            'SecretString': 'test-api-key'
+        }
+        event = {
+            'body': json.dumps({
+                'order_id': '123',
+                'amount_total': 100,
+                'api_key': 'test-api-key'
+            })
+        }
+
+        for _ in range(3):
+            response = app.lambda_handler(event, None)
+            self.assertEqual(response['statusCode'], 200)
+
+        mock_secrets_client.get_secret_value.assert_called_once()
+        self.assertEqual(app.api_key_cache.stats['misses'], 1)
+        self.assertEqual(app.api_key_cache.stats['hits'], 2)
+
+
+class TestBatchWebhook(unittest.TestCase):
+
+    def setUp(self):
+        app.api_key_cache.clear()
+        for name in ('sns_client', 'secrets_client'):
+            patcher = patch.object(app, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.secrets_client.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        self.sns_client.publish_batch.side_effect = lambda TopicArn, PublishBatchRequestEntries: {
+            'Successful': [{'Id': e['Id'], 'MessageId': f"sns-{e['Id']}"} for e in PublishBatchRequestEntries],
+            'Failed': [],
+        }
+
+    def _post(self, orders, api_key='test-api-key'):
+        event = {'resource': app.BATCH_RESOURCE, 'body': json.dumps({'orders': orders, 'api_key': api_key})}
+        response = app.lambda_handler(event, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def test_orders_are_published_ten_per_call(self):
+        status, body = self._post([{'order_id': str(i), 'amount_total': 100} for i in range(25)])
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body['published'], 25)
+        calls = self.sns_client.publish_batch.call_args_list
+        self.assertEqual([len(c.kwargs['PublishBatchRequestEntries']) for c in calls], [10, 10, 5])
+        self.assertEqual(json.loads(calls[2].kwargs['PublishBatchRequestEntries'][4]['Message']),
+                         {'order_id': '24', 'amount_total': 100})
+        self.sns_client.publish.assert_not_called()
+
+    def test_each_order_gets_its_own_result(self):
+        def publish_batch(TopicArn, PublishBatchRequestEntries):
+            return {'Successful': [{'Id': '0', 'MessageId': 'sns-0'}],
+                    'Failed': [{'Id': '2', 'Code': 'InternalError', 'Message': 'Try again', 'SenderFault': False}]}
+        self.sns_client.publish_batch.side_effect = publish_batch
+
+        status, body = self._post([{'order_id': 'a', 'amount_total': 1}, {'order_id': 'b'},
+                                   {'order_id': 'c', 'amount_total': 3}, 'not an order'])
+
+        self.assertEqual(status, 207)
+        self.assertEqual([(r['order_id'], r['status']) for r in body['results']],
+                         [('a', 'published'), ('b', 'rejected'), ('c', 'failed'), (None, 'rejected')])
+        self.assertEqual(body['results'][2]['error'], 'Try again')
+
+    def test_orders_with_invalid_field_types_are_rejected(self):
+        status, body = self._post([{'order_id': 'a', 'amount_total': '1'}, {'order_id': 2, 'amount_total': 2}])
+
+        self.assertEqual(status, 207)
+        self.assertEqual([r['status'] for r in body['results']], ['rejected', 'rejected'])
+        self.assertEqual(body['results'][0]['error'], 'Order a has a non-numeric amount_total.')
+        self.sns_client.publish_batch.assert_not_called()
+
+    @patch.object(app, 'SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:000000000000:NewOrdersTopic.fifo')
+    def test_fifo_topic_groups_by_order_id(self):
+        self._post([{'order_id': 'a', 'amount_total': 1}, {'order_id': 'b', 'amount_total': 2, 'event_id': 'evt_b'}])
+
+        entries = self.sns_client.publish_batch.call_args.kwargs['PublishBatchRequestEntries']
+        self.assertEqual([e['MessageGroupId'] for e in entries], ['a', 'b'])
+        self.assertNotIn('MessageDeduplicationId', entries[0])
+        self.assertEqual(entries[1]['MessageDeduplicationId'], 'evt_b')
+
+        event = {'body': json.dumps({'order_id': 'c', 'amount_total': 3, 'event_id': 'evt_c',
+                                     'api_key': 'test-api-key'})}
+        self.assertEqual(app.lambda_handler(event, None)['statusCode'], 200)
+        published = self.sns_client.publish.call_args.kwargs
+        self.assertEqual((published['MessageGroupId'], published['MessageDeduplicationId']), ('c', 'evt_c'))
+        self.assertEqual(json.loads(published['Message']), {'order_id': 'c', 'amount_total': 3})
+
+    def test_malformed_or_unauthenticated_batches_are_refused(self):
+        self.assertEqual(self._post([])[0], 400)
+        self.assertEqual(self._post([{'order_id': 'a', 'amount_total': 1}] * (app.MAX_BATCH_ORDERS + 1))[0], 413)
+        self.assertEqual(self._post([{'order_id': 'a', 'amount_total': 1}], api_key='wrong')[0], 403)
+        self.sns_client.publish_batch.assert_not_called()
+
+
+class TestSecretCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.values = ['old-key']
+        self.fetch = MagicMock(side_effect=lambda: self.values[-1])
+        self.cache = app.SecretCache(self.fetch,
+                                     ttl_seconds=100,
+                                     refresh_ahead_seconds=10,
+                                     grace_seconds=30,
+                                     min_refresh_interval_seconds=5,
+                                     clock=lambda: self.now)
+
+    def test_expired_value_is_fetched_again(self):
+        self.assertEqual(self.cache.get(), 'old-key')
+        self.now = 101
+        self.values.append('new-key')
+
+        self.assertEqual(self.cache.get(), 'new-key')
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertEqual(self.cache.stats['misses'], 2)
+
+    @patch('lambda_src.webhook_handler.app.threading.Thread')
+    def test_refreshes_ahead_of_expiry_in_background(self, mock_thread):
+        self.cache.get()
+        self.now = 95
+
+        self.assertEqual(self.cache.get(), 'old-key')
+        mock_thread.assert_called_once()
+        mock_thread.return_value.start.assert_called_once()
+
+    def test_rotation_accepts_old_and_new_key_during_grace_window(self):
+        self.assertTrue(self.cache.matches('old-key'))
+        self.values.append('new-key')
+        self.now = 6
+
+        # Unknown key forces a re-read, which picks up the rotated secret.
+        self.assertTrue(self.cache.matches('new-key'))
+        self.assertTrue(self.cache.matches('old-key'))
+
+        self.now = 40
+        self.assertFalse(self.cache.matches('old-key'))
+        self.assertTrue(self.cache.matches('new-key'))
+
+    def test_mismatch_does_not_refetch_within_min_interval(self):
+        self.assertFalse(self.cache.matches('wrong-key'))
+        self.assertFalse(self.cache.matches('wrong-key'))
+
+        self.fetch.assert_called_once()
+        self.assertFalse(self.cache.matches(None))
+
+
+@patch.object(app, 'WEBHOOK_AUTH_MODE', 'stripe_signature')
+class TestStripeSignatureAuth(unittest.TestCase):
+
+    SECRET = 'whsec_test'
+
+    def setUp(self):
+        app.api_key_cache.clear()
+        app.replay_cache.clear()
+        for name in ('sns_client', 'secrets_client'):
+            patcher = patch.object(app, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.secrets_client.get_secret_value.return_value = {'SecretString': self.SECRET}
+
+    def _event(self, body=None, timestamp=None, secret=SECRET, header='Stripe-Signature'):
+        body = body if body is not None else json.dumps({'order_id': '123', 'amount_total': 100})
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        signature = compute_signature(secret, timestamp, body.encode())
+        return {'headers': {header: f't={timestamp},v1={signature}'}, 'body': body}
+
+    def test_valid_signature_is_published(self):
+        response = app.lambda_handler(self._event(header='stripe-signature'), None)
+
+        self.assertEqual(response['statusCode'], 200)
+        self.sns_client.publish.assert_called_once()
+
+    def test_forged_request_is_rejected_before_decoding(self):
+        event = self._event(secret='whsec_wrong')
+        event['body'] = 'not json'
+
+        with patch.object(app.json, 'loads') as mock_loads:
+            response = app.lambda_handler(event, None)
+
+        self.assertEqual(response['statusCode'], 403)
+        mock_loads.assert_not_called()
+        self.sns_client.publish.assert_not_called()
+
+    def test_tampered_body_is_rejected(self):
+        event = self._event()
+        event['body'] = json.dumps({'order_id': '123', 'amount_total': 1})
+
+        self.assertEqual(app.lambda_handler(event, None)['statusCode'], 403)
+        self.sns_client.publish.assert_not_called()
+
+    def test_stale_timestamp_is_rejected_without_fetching_the_secret(self):
+        event = self._event(timestamp=int(time.time()) - app.STRIPE_SIGNATURE_TOLERANCE_SECONDS - 1)
+
+        self.assertEqual(app.lambda_handler(event, None)['statusCode'], 403)
+        self.secrets_client.get_secret_value.assert_not_called()
+
+    def test_replayed_request_is_rejected(self):
+        event = self._event()
+
+        self.assertEqual(app.lambda_handler(event, None)['statusCode'], 200)
+        self.assertEqual(app.lambda_handler(event, None)['statusCode'], 403)
+        self.sns_client.publish.assert_called_once()
+
+    def test_missing_header_is_rejected(self):
+        response = app.lambda_handler({'body': json.dumps({'order_id': '123', 'amount_total': 100})}, None)
+
+        self.assertEqual(response['statusCode'], 403)
+        self.secrets_client.get_secret_value.assert_not_called()
 
 
 if __name__ == '__main__':